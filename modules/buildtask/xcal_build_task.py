@@ -11,24 +11,31 @@ sys.path.append(parentparentdir)
 
 import logging
 import json
-import re
 import shlex
 import tarfile
-import shutil
 from common import XcalGlobals
-from common.CommonGlobals import SOURCE_FILES_NAME
+from common.BuildConcurrency import BuildConcurrency, BuildTokenLease
+from common.CommonGlobals import SOURCE_FILES_NAME, CPPCHECK_RESULT_CACHE_FILE_NAME
+from common.CppcheckResultCache import CppcheckResultCache
+from common.CppcheckScanner import CppcheckScanner
 from common.RunCommandService import ExecuteCommandService
 from common.XcalFileUtility import FilePathResolver
 from xcal_common.py.error import EXcalbuildFail, ENoIFileGenerated
 
 logger = logging.getLogger(__name__)
 
+# the outer package only wraps preprocess.tar.gz which is compressed already, store its members without compression
+# so that it is still a gzip file for the server but the data is not compressed again
+PREPROCESS_PACKAGE_COMPRESS_LEVEL = 0
+# buffer size used to read and write the preprocess packages
+PREPROCESS_PACKAGE_BUFFER_SIZE = 1024 * 1024
+
 
 class XcalBuildTask(object):
     def __init__(self):
         pass
 
-    def prepare_build_command(self, job_config: dict, global_ctx: dict, unknown_args: dict):
+    def prepare_build_command(self, job_config: dict, global_ctx: dict, unknown_args: dict, build_jobs: int = None):
         logger.info("prepare build command")
 
         path_resolver = FilePathResolver()
@@ -41,6 +48,8 @@ class XcalBuildTask(object):
         # prepare build command & prebuild Command
         default_build_command = global_ctx.get("DEFAULT_BUILD_COMMAND")
         build_command = job_config.get("build", default_build_command) + ' ' + job_config.get("buildArgs", "")
+        if build_jobs is not None:
+            build_command = BuildConcurrency.inject_jobs(build_command, build_jobs)
         pre_build_command = job_config.get("prebuildCommand")
         scan_all = job_config.get("scan_all")
         pre_cmd = pre_build_command
@@ -134,36 +143,37 @@ class XcalBuildTask(object):
         path_resolver = FilePathResolver()
         log_path = path_resolver.get_log_file_output_path(job_config)
 
-        command = self.prepare_build_command(job_config, global_ctx, unknown_args)
-
-        logger.debug("xcalbuild command: %s" % command)
-        logger.debug("xcalbuild log path: %s" % log_path)
-
-        rc = ExecuteCommandService.execute_command(command, logfile = log_path)
+        build_jobs, token_lease = XcalBuildTask._get_build_jobs(job_config)
+        try:
+            command = self.prepare_build_command(job_config, global_ctx, unknown_args, build_jobs)
+
+            logger.debug("xcalbuild command: %s" % command)
+            logger.debug("xcalbuild log path: %s" % log_path)
+
+            environment = None
+            if build_jobs is not None:
+                environment = BuildConcurrency.get_build_environment(build_jobs)
+            # no limit unless the job config sets buildTimeout, in seconds
+            timeout = float(job_config.get("buildTimeout") or 0)
+            result = ExecuteCommandService.run_command(command, logfile = log_path, environment = environment,
+                                                       timeout = timeout if timeout > 0 else None,
+                                                       max_log_size = job_config.get("buildLogMaxSize"),
+                                                       sample_interval = job_config.get("buildSampleInterval"))
+        finally:
+            if token_lease is not None:
+                token_lease.release()
+        rc = result.returncode
 
         logger.debug("xcalbuild command return code: %s" % str(rc))
         if rc != 0:
-            logger.error("xcalbuild failed, please check the log: %s" % log_path)
+            logger.error("xcalbuild failed, please check the log: %s, last output:\n%s" % (log_path, result.get_tail()))
             raise EXcalbuildFail
 
-        # Assertion for the directory layout, hard code intentionally
-        with tarfile.open(FilePathResolver().get_preprocessed_tar_output_path(job_config), "r") as tf:
-            names = tf.getnames()
-            assert len(names) > 0
-            assert 'xcalibyte.properties' in names
-
-            i_file_count = 0
-
-            for one_item in names:
-                if re.search("\.ii$", one_item) is not None or re.search("\.i$", one_item) is not None:
-                    i_file_count += 1
-
-            if i_file_count <= 0:
-                logger.warning("no .i/.ii files generated, please check the log: %s" % log_path)
-                raise ENoIFileGenerated
-
         default_path = path_resolver.get_xcalbuild_script_path_new(job_config)
         result_dir = path_resolver.get_precsan_res_save_output_path(job_config)
+
+        XcalBuildTask._validate_preprocess_package(FilePathResolver().get_preprocessed_tar_output_path(job_config), log_path)
+
         # by default, suppressions.txt placed at client root path,
         # and default_path(xcalbuild path) is {client_root_path}/executable/xcalbuild/bin/xcalbuild,
         # so use 4 dirname method to get cppcheck suppression file path
@@ -184,11 +194,23 @@ class XcalBuildTask(object):
             output_file = os.path.join(result_dir, XcalGlobals.SCAN_MISRA_RESULT_FILE_NAME)
             source_code_file_list = XcalBuildTask._get_source_code_file_list(job_config.get("projectPath"), source_code_file_path)
             if len(source_code_file_list) > 0:
-                cppcheck_command = "cppcheck --addon=misra.py --suppressions-list=%s %s --xml 2> %s" % (suppression_file_path, " ".join(source_code_file_list), output_file)
                 logger.info("begin to do cppcheck scan")
-                rc = ExecuteCommandService.execute_command(cppcheck_command, logfile = log_path)
-                if rc != 0:
-                    logger.warning("cppcheck failed, ignore cppcheck scan. return code: %s, log path: %s" % (str(rc), log_path))
+                cache = XcalBuildTask._open_cppcheck_result_cache(job_config, suppression_file_path)
+                try:
+                    # the files are read from a file list, so the command line is bounded, and the shards run in
+                    # parallel if cppcheckShard is set
+                    success = CppcheckScanner.scan(source_code_file_list, suppression_file_path, output_file, log_path,
+                                                   workers=job_config.get("cppcheckWorkers"),
+                                                   shard=job_config.get("cppcheckShard", False),
+                                                   max_files=job_config.get("cppcheckShardMaxFiles"),
+                                                   max_bytes=job_config.get("cppcheckShardMaxBytes"),
+                                                   timeout=job_config.get("cppcheckShardTimeout"),
+                                                   cache=cache)
+                finally:
+                    if cache is not None:
+                        cache.close()
+                if not success:
+                    logger.warning("cppcheck failed, ignore cppcheck scan. log path: %s" % log_path)
                 else:
                     logger.info("cppcheck scan successfully")
                     is_cppcheck_scan_success = True
@@ -198,24 +220,114 @@ class XcalBuildTask(object):
         # Add one logic to tar preprocess.tar.gz and source_files.json together
         # And upload the tar file to server side
         preprocess_file_path = FilePathResolver().get_preprocessed_tar_output_path(job_config)
-        tmp_preprocess = preprocess_file_path.replace("preprocess.tar.gz", "tmp_preprocess_tgz")
         src_files_json = preprocess_file_path.replace("preprocess.tar.gz", "source_files.json")
-        if os.path.exists(tmp_preprocess):
-            shutil.rmtree(tmp_preprocess)
-        os.mkdir(tmp_preprocess)
-        shutil.move(preprocess_file_path, tmp_preprocess)
-        shutil.copy(src_files_json, tmp_preprocess)     # this file will also be used for generate file info
+        package_files = [preprocess_file_path, src_files_json]     # source_files.json will also be used for generate file info
         if is_cppcheck_scan_success:
-            shutil.move(output_file, tmp_preprocess)
+            package_files.append(output_file)
         try:
-            with tarfile.open(preprocess_file_path, 'w:gz') as tf:
-                tf.add(tmp_preprocess, '')
-            # when finish tar file, del useless tmp folder
-            shutil.rmtree(tmp_preprocess)
+            XcalBuildTask._package_preprocess_result(preprocess_file_path, package_files)
         except Exception as e:
             logger.error("package preprocess.tar.gz and source_files.json to one package failed.")
             logger.exception(e)
             raise e
+        # the cppcheck result is moved into the package
+        if is_cppcheck_scan_success:
+            os.remove(output_file)
+
+    @staticmethod
+    def _get_build_jobs(job_config: dict):
+        """
+        :param job_config: job config, buildJobs is "auto" or the number of jobs, the build command is used as is if not set
+        :return: tuple of (number of build jobs or None, BuildTokenLease to release after the build or None)
+        """
+        build_jobs = job_config.get("buildJobs")
+        if build_jobs is None:
+            return None, None
+
+        if str(build_jobs).lower() == "auto":
+            build_jobs = BuildConcurrency.get_build_jobs(job_config.get("buildMemoryPerJob"), job_config.get("buildMaxJobs"))
+        build_jobs = max(1, int(build_jobs))
+
+        # the agents on the same host share one cpu budget through the token file
+        token_lease = None
+        if job_config.get("buildTokenFile"):
+            token_lease = BuildTokenLease(job_config.get("buildTokenFile"), build_jobs, job_config.get("buildTokenBudget"))
+            build_jobs = token_lease.acquire()
+        return build_jobs, token_lease
+
+    @staticmethod
+    def _open_cppcheck_result_cache(job_config: dict, suppression_file_path: str):
+        """
+        :param job_config: job config, the cache is disabled by cppcheckCache
+        :param suppression_file_path: cppcheck suppressions list file
+        :return: CppcheckResultCache, None if disabled or the cppcheck version is unknown
+        """
+        if not job_config.get("cppcheckCache", True):
+            return None
+
+        cppcheck_version = CppcheckResultCache.get_cppcheck_version()
+        if cppcheck_version is None:
+            logger.warning("unknown cppcheck version, cppcheck result cache is disabled")
+            return None
+
+        cache_path = FilePathResolver.get_scan_cache_path(FilePathResolver().get_output_path_dir(job_config),
+                                                          CPPCHECK_RESULT_CACHE_FILE_NAME)
+        logger.info("cppcheck result cache path: %s" % cache_path)
+        return CppcheckResultCache(cache_path, suppression_file_path, cppcheck_version,
+                                   max_size=job_config.get("cppcheckCacheMaxSize"))
+
+    @staticmethod
+    def _validate_preprocess_package(preprocess_file_path, log_path):
+        """
+        Check the directory layout of the package generated by xcalbuild, the member headers are read as a stream
+        and it stops reading once xcalibyte.properties and a .i/.ii file are found
+        :param preprocess_file_path: preprocess.tar.gz path
+        :param log_path: xcalbuild log path
+        :return: None
+        """
+        # Assertion for the directory layout, hard code intentionally
+        member_count = 0
+        has_properties = False
+        has_i_file = False
+        with tarfile.open(preprocess_file_path, "r|*", bufsize=PREPROCESS_PACKAGE_BUFFER_SIZE) as tf:
+            member = tf.next()
+            while member is not None:
+                member_count += 1
+                if member.name == 'xcalibyte.properties':
+                    has_properties = True
+                elif member.name.endswith((".i", ".ii")):
+                    has_i_file = True
+                if has_properties and has_i_file:
+                    break
+                member = tf.next()
+        assert member_count > 0
+        assert has_properties
+
+        if not has_i_file:
+            logger.warning("no .i/.ii files generated, please check the log: %s" % log_path)
+            raise ENoIFileGenerated
+
+    @staticmethod
+    def _package_preprocess_result(preprocess_file_path, package_files):
+        """
+        Package the files into preprocess.tar.gz. The package is written into a temporary file and then replaces
+        preprocess.tar.gz, so the original preprocess.tar.gz can be packaged without moving it.
+        The layout is the same as adding a directory of the files as '': the root directory entry first,
+        then the files sorted by name
+        :param preprocess_file_path: preprocess.tar.gz path
+        :param package_files: files to put in the package, in the root directory of the package
+        :return: None
+        """
+        tmp_package_path = preprocess_file_path + ".tmp"
+        try:
+            with tarfile.open(tmp_package_path, 'w:gz', compresslevel=PREPROCESS_PACKAGE_COMPRESS_LEVEL) as tf:
+                tf.add(os.path.dirname(os.path.abspath(preprocess_file_path)), '', recursive=False)
+                for package_file in sorted(package_files, key=os.path.basename):
+                    tf.add(package_file, os.path.basename(package_file))
+            os.replace(tmp_package_path, preprocess_file_path)
+        finally:
+            if os.path.exists(tmp_package_path):
+                os.remove(tmp_package_path)
 
     @staticmethod
     def _is_tool(name):
@@ -0,0 +1,267 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import json
+import logging
+import os
+import re
+import shlex
+
+import psutil
+
+try:
+    import fcntl
+except ImportError:
+    # no host wide token file on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# memory in bytes a compile job is expected to use, the number of jobs is bounded by the available memory
+BUILD_MEMORY_PER_JOB = 1024 * 1024 * 1024
+# the tools the number of jobs is injected into as a command line option
+MAKE_TOOLS = ("make", "gmake", "ninja")
+# short options of the make tools that take an argument, the rest of a combined short option (e.g. -Cdir) is the
+# argument, so a "j" after them is not the jobs option
+MAKE_OPTIONS_WITH_ARGUMENT = {"make": "CfIoWlE", "gmake": "CfIoWlE", "ninja": "Cfdtwkl"}
+# the environment variables make reads its options from
+MAKE_FLAGS_VARIABLES = ("MAKEFLAGS", "GNUMAKEFLAGS")
+GRADLE_TOOLS = ("gradle", "gradlew")
+SHELL_OPERATORS = ("&&", "||", ";", "|", "&")
+
+
+class BuildConcurrency(object):
+    """
+    Pick the number of parallel build jobs from the cpu count and the available memory, and inject it into the
+    build command of the common build tools.
+    """
+
+    @staticmethod
+    def get_cpu_count():
+        """
+        :return: number of cpus this process is allowed to run on
+        """
+        if hasattr(os, "sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
+
+    @staticmethod
+    def get_build_jobs(memory_per_job: int = None, max_jobs: int = None):
+        """
+        :param memory_per_job: memory in bytes a job is expected to use
+        :param max_jobs: upper limit of the number of jobs
+        :return: number of parallel build jobs, at least 1
+        """
+        memory_per_job = BUILD_MEMORY_PER_JOB if memory_per_job is None else int(memory_per_job)
+        cpu_count = BuildConcurrency.get_cpu_count()
+        available_memory = psutil.virtual_memory().available
+        jobs = min(cpu_count, available_memory // max(1, memory_per_job))
+        if max_jobs is not None:
+            jobs = min(jobs, int(max_jobs))
+        jobs = max(1, int(jobs))
+        logger.info("build jobs: %d, cpu count: %d, available memory: %.2fG" %
+                    (jobs, cpu_count, available_memory / 1024 / 1024 / 1024))
+        return jobs
+
+    @staticmethod
+    def has_make_jobs_option(tool: str, tokens: list):
+        """
+        :param tool: make tool, one of MAKE_TOOLS
+        :param tokens: arguments of the tool
+        :return: True if the arguments set the number of jobs, including in a combined short option (e.g. -Bj4)
+        """
+        options_with_argument = MAKE_OPTIONS_WITH_ARGUMENT.get(tool, "")
+        for token in tokens:
+            if token in SHELL_OPERATORS:
+                break
+            if token.startswith("--"):
+                if token.startswith("--jobs") or token.startswith("--jobserver"):
+                    return True
+                continue
+            if not token.startswith("-"):
+                continue
+            for option in token[1:]:
+                if option == "j":
+                    return True
+                if option in options_with_argument:
+                    break
+        return False
+
+    @staticmethod
+    def has_make_flags_jobs(environment: dict = None):
+        """
+        :param environment: environment of the build, default is the environment of this process
+        :return: True if MAKEFLAGS (or GNUMAKEFLAGS) sets the number of jobs or passes a job server
+        """
+        environment = os.environ if environment is None else environment
+        for variable in MAKE_FLAGS_VARIABLES:
+            words = environment.get(variable, "").split()
+            if len(words) == 0:
+                continue
+            # the first word may be the single letter flags without the dash, e.g. "kj" or "ks -j4"
+            if not words[0].startswith("-") and "=" not in words[0]:
+                words[0] = "-" + words[0]
+            if BuildConcurrency.has_make_jobs_option("make", words):
+                return True
+        return False
+
+    @staticmethod
+    def _get_token_end(command: str, tokens: list):
+        """
+        :param command: shell command
+        :param tokens: the first tokens of the command, split by shlex
+        :return: index of the command right after the tokens, None if not found
+        """
+        # the end of a word is only the end of the tokens if the words before it split into the same tokens,
+        # a quoted word with spaces, e.g. CFLAGS='-O2 -g', is more than one word
+        for word in re.finditer(r"\S+", command):
+            try:
+                words_tokens = shlex.split(command[:word.end()])
+            except ValueError:
+                continue
+            if words_tokens == tokens:
+                return word.end()
+            if len(words_tokens) > len(tokens):
+                break
+        return None
+
+    @staticmethod
+    def inject_jobs(build_command: str, jobs: int, environment: dict = None):
+        """
+        Add the number of jobs to the make/ninja/gradle command, unless the command, the variables assigned in front of
+        it or MAKEFLAGS set it already. cmake --build reads it from the environment, see get_build_environment
+        :param build_command: build command of the user
+        :param jobs: number of parallel build jobs
+        :param environment: environment of the build, default is the environment of this process
+        :return: build command with the number of jobs
+        """
+        try:
+            tokens = shlex.split(build_command)
+        except ValueError:
+            logger.warning("cannot parse the build command, use it as is: %s" % build_command)
+            return build_command
+
+        # the variable assignments in front of the tool, e.g. CC=gcc MAKEFLAGS=-j4 make
+        assignments = dict()
+        tool_index = 0
+        while tool_index < len(tokens) and re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", tokens[tool_index]) is not None:
+            name, value = tokens[tool_index].split("=", 1)
+            assignments[name] = value
+            tool_index += 1
+        if tool_index == len(tokens):
+            return build_command
+
+        tool = os.path.basename(tokens[tool_index])
+        if tool in MAKE_TOOLS:
+            if BuildConcurrency.has_make_jobs_option(tool, tokens[tool_index + 1:]):
+                return build_command
+            if tool != "ninja" and (BuildConcurrency.has_make_flags_jobs(assignments)
+                                    or BuildConcurrency.has_make_flags_jobs(environment)):
+                logger.info("number of jobs is set by MAKEFLAGS, not injected into the build command")
+                return build_command
+            # insert after the tool, so that it applies to the first command of a compound command
+            index = BuildConcurrency._get_token_end(build_command, tokens[:tool_index + 1])
+            if index is None:
+                logger.warning("cannot locate the build tool in the build command, use it as is: %s" % build_command)
+                return build_command
+            return "%s -j%d%s" % (build_command[:index], jobs, build_command[index:])
+        if tool in GRADLE_TOOLS:
+            if any(token.startswith("--max-workers") for token in tokens) \
+                    or any(token in SHELL_OPERATORS for token in tokens):
+                return build_command
+            return "%s --max-workers=%d" % (build_command.rstrip(), jobs)
+
+        logger.debug("number of jobs is not injected into the build command: %s" % build_command)
+        return build_command
+
+    @staticmethod
+    def get_build_environment(jobs: int, environment: dict = None):
+        """
+        :param jobs: number of parallel build jobs
+        :param environment: environment of the build, default is the environment of this process
+        :return: copy of the environment with the number of jobs for cmake --build
+        """
+        environment = dict(os.environ if environment is None else environment)
+        # the parallel level set by the user is kept
+        environment.setdefault("CMAKE_BUILD_PARALLEL_LEVEL", str(jobs))
+        return environment
+
+
+class BuildTokenLease(object):
+    """
+    Share one cpu budget among the builds of the agents on the same host. The token file records the number of jobs
+    each running build holds, by pid. A build gets the jobs left in the budget (at least 1) and gives them back on
+    release, the records of the exited processes are dropped. The file is locked while it is updated.
+    """
+
+    def __init__(self, token_file: str, jobs: int, budget: int = None):
+        """
+        :param token_file: path of the token file shared by the agents on the host
+        :param jobs: number of jobs wanted
+        :param budget: total number of jobs of the host, default is the cpu count
+        """
+        self.token_file = token_file
+        self.jobs = int(jobs)
+        self.budget = BuildConcurrency.get_cpu_count() if budget is None else int(budget)
+        self.pid = str(os.getpid())
+        self.granted = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def _update(self, function):
+        """
+        Update the token records while the token file is locked
+        :param function: called with the dict of pid to jobs, it modifies the dict and returns the result
+        :return: result of the function
+        """
+        with open(self.token_file, "a+") as token_file:
+            fcntl.flock(token_file, fcntl.LOCK_EX)
+            try:
+                token_file.seek(0)
+                try:
+                    tokens = json.loads(token_file.read() or "{}")
+                except ValueError:
+                    logger.warning("token file is broken, reset it: %s" % self.token_file)
+                    tokens = dict()
+                tokens = {pid: jobs for pid, jobs in tokens.items() if psutil.pid_exists(int(pid))}
+                result = function(tokens)
+                token_file.seek(0)
+                token_file.truncate()
+                json.dump(tokens, token_file)
+                token_file.flush()
+            finally:
+                fcntl.flock(token_file, fcntl.LOCK_UN)
+        return result
+
+    def acquire(self):
+        """
+        :return: number of jobs granted
+        """
+        if fcntl is None:
+            self.granted = self.jobs
+            return self.granted
+
+        def take(tokens):
+            used = sum(jobs for pid, jobs in tokens.items() if pid != self.pid)
+            tokens[self.pid] = max(1, min(self.jobs, self.budget - used))
+            return tokens[self.pid], used
+
+        self.granted, used = self._update(take)
+        logger.info("build jobs granted: %d, wanted: %d, used by others: %d, budget: %d" %
+                    (self.granted, self.jobs, used, self.budget))
+        return self.granted
+
+    def release(self):
+        """
+        Give back the jobs
+        :return: None
+        """
+        if fcntl is None or self.granted is None:
+            return
+        self._update(lambda tokens: tokens.pop(self.pid, None))
+        self.granted = None
@@ -0,0 +1,217 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# size of a chunk, the last chunk may be smaller
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# number of chunks uploaded in parallel, the chunks read but not uploaded are bounded by it as well
+UPLOAD_CHUNK_WORKERS = 4
+# the upload state is kept next to the file with this suffix, so that an interrupted upload is resumed
+UPLOAD_STATE_SUFFIX = ".upload.json"
+# status codes of the session init telling that the file service does not have the chunked upload at all
+UPLOAD_UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+
+
+class ChunkedUploadUnsupported(Exception):
+    """
+    Raised when the upload session cannot be created, the file should be uploaded as a whole.
+    permanent is True if the file service does not support the chunked upload at all, otherwise only this upload
+    falls back (e.g. a transient server error)
+    """
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class ChunkedUploader(object):
+    """
+    Upload a file in fixed size chunks through an upload session of the file service:
+        fileChunkUploadInitApi      POST, create the upload session, returns {"uploadId": ...}
+        fileChunkUploadStatusApi    GET, the chunks received by the session, returns {"chunks": [index, ...]}
+        fileChunkUploadApi          PUT, a chunk with its offset and crc32 in the headers
+        fileChunkUploadCompleteApi  POST, with the crc32 of the file, returns {"id": file id}
+    The file is read once in order, the crc32 of each chunk and of the whole file are calculated while reading, and
+    several chunks are uploaded in parallel. The acknowledged chunks are recorded in a state file, an interrupted
+    upload of the same file is resumed from the chunks the session received.
+    """
+
+    def __init__(self, connector, token: str, file_path: str, file_type: str, chunk_size: int = None, workers: int = None):
+        """
+        :param connector: XcalConnect.Connector used to send the requests
+        :param token: token of the task
+        :param file_path: file to upload
+        :param file_type: name of the FileType
+        :param chunk_size: size of a chunk in bytes
+        :param workers: number of chunks uploaded in parallel
+        """
+        self.connector = connector
+        self.token = token
+        self.file_path = file_path
+        self.file_type = file_type
+        self.chunk_size = UPLOAD_CHUNK_SIZE if chunk_size is None else int(chunk_size)
+        self.workers = UPLOAD_CHUNK_WORKERS if workers is None else max(1, int(workers))
+        self.state_path = file_path + UPLOAD_STATE_SUFFIX
+        self.state = None
+        self.state_lock = threading.Lock()
+
+    def _get_url(self, api_name: str, upload_id: str = "", index: int = 0):
+        api_path = self.connector.api_server.get(api_name)
+        if api_path is None:
+            raise ChunkedUploadUnsupported("%s is not configured" % api_name, permanent = True)
+        return self.connector.host_url + api_path.replace("{token}", self.token) \
+            .replace("{uploadId}", upload_id).replace("{index}", str(index))
+
+    def _get_signature(self):
+        """
+        :return: [size, mtime_ns, chunk size] of the file, the state is only resumed if it is unchanged
+        """
+        stat = os.stat(self.file_path)
+        return [stat.st_size, stat.st_mtime_ns, self.chunk_size]
+
+    def _load_state(self):
+        """
+        :return: the saved upload state of the same file, None if not exists or the file changed
+        """
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError) as err:
+            logger.warning("cannot load upload state %s, ignore it: %s" % (self.state_path, err))
+            return None
+        if state.get("signature") != self._get_signature():
+            logger.info("file changed since the last upload, start a new upload: %s" % self.file_path)
+            return None
+        return state
+
+    def _save_state(self):
+        """
+        Write the upload state, the state file is replaced at once so that it is never half written
+        :return: None
+        """
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as state_file:
+            json.dump(self.state, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def _init_upload(self):
+        """
+        :return: id of the new upload session
+        :raise: ChunkedUploadUnsupported if the session is not created, it is permanent if the api is not found or
+                not implemented, e.g. an older file service
+        """
+        result = self.connector.send_http_request(self._get_url("fileChunkUploadInitApi"),
+                                                  data = {"token": self.token,
+                                                          "fileName": os.path.basename(self.file_path),
+                                                          "fileSize": os.path.getsize(self.file_path),
+                                                          "chunkSize": self.chunk_size,
+                                                          "type": self.file_type},
+                                                  header = {}, method = "POST")
+        if not result.ok:
+            raise ChunkedUploadUnsupported("upload session is not created, status code: %s" % result.status_code,
+                                           permanent = result.status_code in UPLOAD_UNSUPPORTED_STATUS_CODES)
+        try:
+            return result.json()["uploadId"]
+        except (ValueError, KeyError) as err:
+            raise ChunkedUploadUnsupported("upload session is not created, invalid response: %s" % err)
+
+    def _get_received_chunks(self, upload_id: str):
+        """
+        :param upload_id: id of the upload session
+        :return: set of the chunk indexes received by the session, None if the session does not exist any more
+        """
+        result = self.connector.send_http_request(self._get_url("fileChunkUploadStatusApi", upload_id),
+                                                  data = {}, header = {}, method = "GET")
+        if result.status_code in (404, 410):
+            return None
+        result.raise_for_status()
+        return set(result.json().get("chunks", []))
+
+    def _upload_chunk(self, upload_id: str, index: int, data: bytes, checksum: int):
+        """
+        :param upload_id: id of the upload session
+        :param index: index of the chunk
+        :param data: content of the chunk
+        :param checksum: crc32 of the chunk
+        :return: index of the chunk
+        """
+        result = self.connector.send_http_request(self._get_url("fileChunkUploadApi", upload_id, index),
+                                                  data = data,
+                                                  header = {"Content-Type": "application/octet-stream",
+                                                            "X-Chunk-Offset": str(index * self.chunk_size),
+                                                            "X-Chunk-Checksum": str(checksum)},
+                                                  method = "PUT_DATA")
+        result.raise_for_status()
+        with self.state_lock:
+            self.state["chunks"].append(index)
+            self._save_state()
+        return index
+
+    def _complete(self, upload_id: str, checksum: int):
+        """
+        :param upload_id: id of the upload session
+        :param checksum: crc32 of the file
+        :return: file id
+        """
+        result = self.connector.send_http_request(self._get_url("fileChunkUploadCompleteApi", upload_id),
+                                                  data = {"token": self.token, "file_checksum": str(checksum),
+                                                          "type": self.file_type},
+                                                  header = {}, method = "POST")
+        result.raise_for_status()
+        return result.json().get("id")
+
+    def upload(self):
+        """
+        Upload the file, resume the interrupted upload of the same file if any
+        :return: file id
+        """
+        self.state = self._load_state()
+        received = None
+        if self.state is not None:
+            received = self._get_received_chunks(self.state["uploadId"])
+            if received is None:
+                logger.info("upload session %s expired, start a new upload" % self.state["uploadId"])
+        if received is None:
+            self.state = {"uploadId": self._init_upload(), "signature": self._get_signature(), "chunks": []}
+            received = set()
+        self.state["chunks"] = sorted(received)
+        self._save_state()
+        upload_id = self.state["uploadId"]
+        logger.info("upload %s in chunks of %d bytes, upload id: %s, %d chunks received already" %
+                    (self.file_path, self.chunk_size, upload_id, len(received)))
+
+        checksum = 0
+        pending = deque()
+        with open(self.file_path, "rb") as upload_file, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                index = 0
+                data = upload_file.read(self.chunk_size)
+                while data:
+                    # the file checksum needs the received chunks too, they are read but not uploaded
+                    checksum = zlib.crc32(data, checksum)
+                    if index not in received:
+                        pending.append(executor.submit(self._upload_chunk, upload_id, index, data, zlib.crc32(data)))
+                        if len(pending) >= self.workers:
+                            pending.popleft().result()
+                    index += 1
+                    data = upload_file.read(self.chunk_size)
+                while len(pending) > 0:
+                    pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        file_id = self._complete(upload_id, checksum)
+        os.remove(self.state_path)
+        return file_id
@@ -25,6 +25,10 @@ PREPROCESS_FILE_NAME = "preprocess.tar.gz"
 VCS_DIFF_RESULT_FILE_NAME = "scm_diff.txt"
 SOURCE_FILES_NAME = "source_files.json"
 COMMIT_FILE_NAME = 'commit_id.txt'
+FILE_INFO_CACHE_FILE_NAME = "fileinfo_cache.db"
+SOURCE_MANIFEST_FILE_NAME = "source_manifest.json"
+SOURCE_BLOB_INDEX_FILE_NAME = "source_blobs.json"
+CPPCHECK_RESULT_CACHE_FILE_NAME = "cppcheck_cache.db"
 
 # common constant variable which will be used by both agent and scan service
 OFFLINE_AGENT_TYPE = "offline_agent"
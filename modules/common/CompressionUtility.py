@@ -1,18 +1,28 @@
 #
 #  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
 #
+import gzip
+import hashlib
 import logging
 import os
 import sys
 import tarfile
 import time
 import zipfile
+import zlib
 import json
+import shutil
+import struct
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from stat import S_IXUSR
 
 from common.CommonGlobals import TaskErrorNo
 from common.XcalException import XcalException
-from common.XcalGlobals import SOURCE_CODE_SUFFIX
+from common.PathFilter import PathFilter
+from common.SourceBlobIndex import SourceBlobIndex
 from common.XcalLogger import XcalLogger
 from common.FileUtility import FileUtility
 
@@ -20,6 +30,445 @@ from xcal_common.py.error import EVariableMustHaveValue, ESourceDirectoryNotExis
 
 logger = logging.getLogger(__name__)
 
+# read size used when archiving the source code files
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+# files larger than it are not read in memory by the worker threads, they are written by zipfile from the file
+ARCHIVE_READ_MAX_SIZE = 8 * 1024 * 1024
+# number of files in flight per worker thread when archiving the files
+ARCHIVE_WINDOW_FACTOR = 4
+# bytes of the files read in memory by the worker threads and not written yet
+ARCHIVE_PENDING_MAX_SIZE = 64 * 1024 * 1024
+# buffer size used to read the compressed stream and write the extracted files
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+# size of the data compressed into one gzip member by ParallelGzipWriter
+GZIP_BLOCK_SIZE = 1024 * 1024
+# same default compress level as tarfile
+GZIP_COMPRESS_LEVEL = 9
+# first bytes of a gzip file
+GZIP_MAGIC = b"\x1f\x8b"
+
+# records of the zip format written by ZipArchiveWriter, see the APPNOTE of PKWARE
+ZIP_LOCAL_HEADER_STRUCT = "<4sHHHHHLLLHH"
+ZIP_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+ZIP_CENTRAL_HEADER_STRUCT = "<4sHHHHHHLLLHHHHHLL"
+ZIP_CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+ZIP_END_STRUCT = "<4sHHHHLLH"
+ZIP_END_SIGNATURE = b"PK\x05\x06"
+ZIP64_END_STRUCT = "<4sQHHLLQQQQ"
+ZIP64_END_SIGNATURE = b"PK\x06\x06"
+ZIP64_LOCATOR_STRUCT = "<4sLQL"
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+ZIP64_LOCAL_EXTRA_STRUCT = "<HHQQ"
+ZIP64_EXTRA_ID = 0x0001
+# sizes and offsets beyond it are written in the ZIP64 extra, the same limits as zipfile
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP_DEFAULT_VERSION = 20
+ZIP64_VERSION = 45
+ZIP_FLAG_UTF8 = 0x800
+
+
+def _compress_zip_member(zinfo: zipfile.ZipInfo, data: bytes, compress_level: int = None):
+    """
+    Fill the CRC and sizes of the member and compress its content as a raw deflate stream, so that it can run in a
+    worker thread and ZipArchiveWriter only appends the result
+    :param zinfo: ZipInfo of the member
+    :param data: file content
+    :param compress_level: deflate compress level (1-9), the file is stored if None or 0
+    :return: the data of the member as it is written in the archive
+    """
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data) & 0xFFFFFFFF
+    if compress_level:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(data) + compressor.flush()
+    else:
+        zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.compress_size = len(data)
+    return data
+
+
+def _read_zip_member(file_path: str, arcname: str, compress_level: int = None):
+    """
+    Stat, read and compress the file for the archive, so that it can run in a worker thread
+    :param file_path: file path
+    :param arcname: name of the file in the archive
+    :param compress_level: deflate compress level (1-9), the file is stored if None or 0
+    :return: tuple of (ZipInfo, member data), the data is None if the file is too large to be read in memory
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    if zinfo.file_size > ARCHIVE_READ_MAX_SIZE:
+        return zinfo, None
+
+    with open(file_path, 'rb') as f:
+        return zinfo, _compress_zip_member(zinfo, f.read(), compress_level)
+
+
+def _read_blob_member(file_path: str, blob_index: SourceBlobIndex = None, compress_level: int = None):
+    """
+    Hash the file by sha256, and read and compress it as a blob pack member named by the sha256 if it is not
+    uploaded yet
+    :param file_path: file path
+    :param blob_index: index of the uploaded blobs
+    :param compress_level: deflate compress level (1-9), the file is stored if None or 0
+    :return: tuple of (sha256, file size, ZipInfo, member data), the ZipInfo is None if the blob is uploaded,
+             the data is None if the file is too large to be read in memory
+    """
+    file_stat = os.stat(file_path)
+    keep_content = file_stat.st_size <= ARCHIVE_READ_MAX_SIZE
+    hasher = hashlib.sha256()
+    file_size = 0
+    chunks = []
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(ARCHIVE_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            file_size += len(chunk)
+            if keep_content:
+                chunks.append(chunk)
+    sha256 = hasher.hexdigest()
+
+    if blob_index is not None and blob_index.get_pack(sha256) is not None:
+        return sha256, file_size, None, None
+
+    zinfo = zipfile.ZipInfo.from_file(file_path, sha256)
+    if not keep_content:
+        return sha256, file_size, zinfo, None
+    return sha256, file_size, zinfo, _compress_zip_member(zinfo, b"".join(chunks), compress_level)
+
+
+def _get_member_weight(file_path: str, arcname: str):
+    """
+    :param file_path: file path
+    :param arcname: name of the file in the archive
+    :return: bytes of the member kept in memory while it is in flight
+    """
+    return min(os.path.getsize(file_path), ARCHIVE_READ_MAX_SIZE)
+
+
+def _map_members(function, members, workers: int = None, weigh=None):
+    """
+    Call the function on each member in worker threads, only a bounded window of members is in flight.
+    The window is bounded by the number of members, and by ARCHIVE_PENDING_MAX_SIZE bytes if weigh is given
+    :param function: called as function(file path, name in the archive)
+    :param members: iterable of (file path, name in the archive)
+    :param workers: number of worker threads, default is the cpu count. run in the current thread if 1
+    :param weigh: called as weigh(file path, name in the archive), returns the bytes the member keeps in memory
+    :return: generator of (member, result of the function) in the order of the members
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        for member in members:
+            yield member, function(*member)
+        return
+
+    pending = deque()
+    pending_size = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for member in members:
+                size = weigh(*member) if weigh is not None else 0
+                # the members are yielded in order, so the oldest ones are waited for to make room
+                while len(pending) > 0 and (len(pending) >= workers * ARCHIVE_WINDOW_FACTOR or
+                                            pending_size + size > ARCHIVE_PENDING_MAX_SIZE):
+                    done_member, future, done_size = pending.popleft()
+                    pending_size -= done_size
+                    yield done_member, future.result()
+                pending.append((member, executor.submit(function, *member), size))
+                pending_size += size
+            while len(pending) > 0:
+                member, future, _ = pending.popleft()
+                yield member, future.result()
+        finally:
+            for _, future, _ in pending:
+                future.cancel()
+
+
+def _write_zip_members(zip_writer, members, compress_level: int = None, workers: int = None):
+    """
+    Archive the files, worker threads stat, read and compress the files in parallel while the members are
+    appended to the archive in order by the current thread
+    :param zip_writer: ZipArchiveWriter
+    :param members: iterable of (file path, name in the archive)
+    :param compress_level: deflate compress level (1-9), the file is stored if None or 0
+    :param workers: number of worker threads, default is the cpu count
+    :return: number of files archived
+    """
+    count = 0
+    read_member = lambda file_path, arcname: _read_zip_member(file_path, arcname, compress_level)
+    for (file_path, _), (zinfo, data) in _map_members(read_member, members, workers, _get_member_weight):
+        _append_zip_member(zip_writer, file_path, zinfo, data, compress_level)
+        count += 1
+    return count
+
+
+def _append_zip_member(zip_writer, file_path: str, zinfo: zipfile.ZipInfo, data: bytes, compress_level: int = None):
+    """
+    Append the member read by _read_zip_member or _read_blob_member to the archive
+    :param zip_writer: ZipArchiveWriter
+    :param file_path: file path
+    :param zinfo: ZipInfo of the member
+    :param data: the compressed member data, streamed from the file path by the current thread if None
+    :param compress_level: deflate compress level (1-9) of the streamed file, stored if None or 0
+    :return: None
+    """
+    if data is None:
+        zip_writer.write_file(zinfo, file_path, compress_level)
+    else:
+        zip_writer.write_member(zinfo, data)
+
+
+class ZipArchiveWriter(object):
+    """
+    Write-only zip archive whose members are compressed before they are appended, so that the worker threads
+    compress them in parallel. zipfile compresses in the thread writing the archive and has no public api to append
+    compressed data, so the records are written here as the .ZIP File Format Specification of PKWARE (APPNOTE)
+    specifies, ZIP64 extensions included. The archive reads the same by zipfile and unzip as one written by zipfile
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the archive, it is replaced if exists
+        """
+        self.file = open(path, "wb")
+        self.members = []
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self.offset += len(data)
+
+    @staticmethod
+    def _encode_name(zinfo: zipfile.ZipInfo):
+        """
+        :return: tuple of (file name bytes, general purpose flags)
+        """
+        try:
+            return zinfo.filename.encode("ascii"), zinfo.flag_bits
+        except UnicodeEncodeError:
+            return zinfo.filename.encode("utf-8"), zinfo.flag_bits | ZIP_FLAG_UTF8
+
+    @staticmethod
+    def _get_dos_time(zinfo: zipfile.ZipInfo):
+        """
+        :return: tuple of (dos time, dos date) of the modification time
+        """
+        year, month, day, hour, minute, second = zinfo.date_time
+        return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+    def _get_local_header(self, zinfo: zipfile.ZipInfo, zip64: bool):
+        name, flags = ZipArchiveWriter._encode_name(zinfo)
+        dos_time, dos_date = ZipArchiveWriter._get_dos_time(zinfo)
+        extra = b""
+        compress_size, file_size = zinfo.compress_size, zinfo.file_size
+        if zip64:
+            extra = struct.pack(ZIP64_LOCAL_EXTRA_STRUCT, ZIP64_EXTRA_ID, 16, file_size, compress_size)
+            compress_size = file_size = ZIP64_MARKER
+        return struct.pack(ZIP_LOCAL_HEADER_STRUCT, ZIP_LOCAL_HEADER_SIGNATURE,
+                           ZIP64_VERSION if zip64 else ZIP_DEFAULT_VERSION, flags, zinfo.compress_type,
+                           dos_time, dos_date, zinfo.CRC, compress_size, file_size, len(name), len(extra)) + name + extra
+
+    def write_member(self, zinfo: zipfile.ZipInfo, data: bytes):
+        """
+        Append a member whose CRC, sizes and compress type are filled and whose data is compressed already
+        :param zinfo: ZipInfo of the member
+        :param data: the data of the member as it is written in the archive
+        :return: None
+        """
+        zinfo.header_offset = self.offset
+        zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+        self._write(self._get_local_header(zinfo, zip64))
+        self._write(data)
+        self.members.append(zinfo)
+
+    def write_file(self, zinfo: zipfile.ZipInfo, file_path: str, compress_level: int = None):
+        """
+        Append a member streamed from the file in the current thread, for the files too large to be read in memory.
+        The local header is written again once the CRC and sizes are known
+        :param zinfo: ZipInfo of the member, from the stat of the file
+        :param file_path: file path
+        :param compress_level: deflate compress level (1-9), the file is stored if None or 0
+        :return: None
+        """
+        zinfo.header_offset = self.offset
+        zinfo.compress_type = zipfile.ZIP_DEFLATED if compress_level else zipfile.ZIP_STORED
+        zinfo.CRC = zinfo.compress_size = 0
+        # same as zipfile, leave room for the deflate stream being a bit larger than the file
+        zip64 = zinfo.file_size * 1.05 > ZIP64_LIMIT
+        self._write(self._get_local_header(zinfo, zip64))
+
+        compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -zlib.MAX_WBITS) if compress_level else None
+        crc = file_size = compress_size = 0
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(ARCHIVE_CHUNK_SIZE), b""):
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                self._write(chunk)
+                compress_size += len(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            self._write(chunk)
+            compress_size += len(chunk)
+
+        zinfo.CRC, zinfo.file_size, zinfo.compress_size = crc & 0xFFFFFFFF, file_size, compress_size
+        if not zip64 and (file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT):
+            raise RuntimeError("%s grows beyond the ZIP64 limit while it is archived" % file_path)
+        self.file.seek(zinfo.header_offset)
+        self.file.write(self._get_local_header(zinfo, zip64))
+        self.file.seek(self.offset)
+        self.members.append(zinfo)
+
+    def _get_central_header(self, zinfo: zipfile.ZipInfo):
+        name, flags = ZipArchiveWriter._encode_name(zinfo)
+        dos_time, dos_date = ZipArchiveWriter._get_dos_time(zinfo)
+        # the values which do not fit are moved into the ZIP64 extra, in this order
+        fields = [zinfo.file_size, zinfo.compress_size, zinfo.header_offset]
+        zip64_values = [value for value in fields if value > ZIP64_LIMIT]
+        fields = [ZIP64_MARKER if value > ZIP64_LIMIT else value for value in fields]
+        extra = b""
+        version = ZIP_DEFAULT_VERSION
+        if zip64_values:
+            extra = struct.pack("<HH%dQ" % len(zip64_values), ZIP64_EXTRA_ID, 8 * len(zip64_values), *zip64_values)
+            version = ZIP64_VERSION
+        return struct.pack(ZIP_CENTRAL_HEADER_STRUCT, ZIP_CENTRAL_HEADER_SIGNATURE,
+                           (zinfo.create_system << 8) | version, version, flags, zinfo.compress_type,
+                           dos_time, dos_date, zinfo.CRC, fields[1], fields[0], len(name), len(extra), 0, 0,
+                           zinfo.internal_attr, zinfo.external_attr, fields[2]) + name + extra
+
+    def close(self):
+        """
+        Write the central directory and the end records
+        :return: None
+        """
+        if self.file.closed:
+            return
+        directory_offset = self.offset
+        for zinfo in self.members:
+            self._write(self._get_central_header(zinfo))
+        directory_size = self.offset - directory_offset
+        count = len(self.members)
+        if count > ZIP_FILECOUNT_LIMIT or directory_offset > ZIP64_LIMIT or directory_size > ZIP64_LIMIT:
+            zip64_end_offset = self.offset
+            self._write(struct.pack(ZIP64_END_STRUCT, ZIP64_END_SIGNATURE, 44, ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                                    count, count, directory_size, directory_offset))
+            self._write(struct.pack(ZIP64_LOCATOR_STRUCT, ZIP64_LOCATOR_SIGNATURE, 0, zip64_end_offset, 1))
+            count = min(count, 0xFFFF)
+            directory_size = min(directory_size, ZIP64_MARKER)
+            directory_offset = min(directory_offset, ZIP64_MARKER)
+        self._write(struct.pack(ZIP_END_STRUCT, ZIP_END_SIGNATURE, 0, 0, count, count, directory_size,
+                                directory_offset, 0))
+        self.file.close()
+
+
+def _compress_gzip_member(data: bytes, compress_level: int):
+    """
+    :param data: data to compress
+    :param compress_level: gzip compress level (0-9)
+    :return: a complete gzip member (header, deflate stream and trailer) of the data
+    """
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipWriter(object):
+    """
+    Write-only file object which compresses the written data as pigz does. The data is split into blocks, each block
+    is compressed into an independent gzip member by the worker threads, and the members are written in order.
+    A multi-member gzip file is still a valid gzip file, gzip, tarfile and zcat read it as a whole
+    """
+
+    def __init__(self, fileobj, compress_level: int = GZIP_COMPRESS_LEVEL, workers: int = None,
+                 block_size: int = GZIP_BLOCK_SIZE):
+        """
+        :param fileobj: binary file object the gzip members are written to
+        :param compress_level: gzip compress level (0-9)
+        :param workers: number of worker threads, default is the cpu count
+        :param block_size: size of the data compressed into one gzip member
+        """
+        self.fileobj = fileobj
+        self.compress_level = compress_level
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.offset = 0
+        self.member_count = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def tell(self):
+        """
+        :return: number of the uncompressed bytes written
+        """
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def _submit(self, block: bytes):
+        self.pending.append(self.executor.submit(_compress_gzip_member, block, self.compress_level))
+        self.member_count += 1
+        if len(self.pending) >= self.workers * ARCHIVE_WINDOW_FACTOR:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        """
+        Compress the remaining data, and write all the gzip members
+        :return: None
+        """
+        if self.closed:
+            return
+        # an empty input still needs one gzip member to be a valid gzip file
+        if len(self.buffer) > 0 or self.member_count == 0:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending) > 0:
+            self.fileobj.write(self.pending.popleft().result())
+        self.executor.shutdown()
+        self.closed = True
+
+    def abort(self):
+        """
+        Stop compressing without writing the remaining data
+        :return: None
+        """
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+        self.closed = True
+
 
 class CompressionUtility:
     ZIP_UNIX_SYSTEM = 3
@@ -28,34 +477,37 @@ class CompressionUtility:
         pass
 
     @staticmethod
-    def compress_tar_package(logger: XcalLogger, src_location: str, package_path: str, mode="x:gz"):
+    def compress_tar_package(logger: XcalLogger, src_location: str, package_path: str, mode="x:gz", workers: int = None):
         """
         Make a tar archive from a file/directory, write to a specific location.
         Support bzip, lzma, gzip (bz2, xz, gz)
         :param logger: Logger of parent
         :param src_location: Directory path
         :param package_path: The output tar archive path
-        :param mode: The file mode (x:gz) for GZIP tar "x" for normal tar archive
+        :param mode: The file mode (x:gz) for GZIP tar "x" for normal tar archive, which skips the compression
+                     for the local only packages
+        :param workers: number of threads to compress GZIP tar, 1 to compress by tarfile in the current thread
         :return: None
         """
         with XcalLogger("CompressionUtility", "compress_tar_package", debug_mode=logger.debug_mode, parent = logger, trace_id=logger.trace_id, span_id=logger.span_id):
             if os.path.exists(package_path):
                 os.remove(package_path)
             try:
-                with tarfile.open(package_path, mode) as t:
-                    t.add(src_location, arcname=os.path.basename(src_location), recursive=True)
+                CompressionUtility._write_tar(package_path, mode, src_location, os.path.basename(src_location), workers)
             except Exception as e:
                 raise XcalException("CompressionUtility", "compress_tar_package", "exception arise in making tarball",
                                     TaskErrorNo.E_COMPRESS_FAIL)
 
     @staticmethod
-    def compress_tar_from_dir(logger: XcalLogger, src_location: str, package_path: str, mode="x:gz"):
+    def compress_tar_from_dir(logger: XcalLogger, src_location: str, package_path: str, mode="x:gz", workers: int = None):
         """
         Make a tar archive from a directory, write to a specific location.
         :param logger: Logger of parent
         :param src_location: Directory path
         :param package_path: The output tar archive path
-        :param mode: The file mode (x:gz) for GZIP tar "x" for normal tar archive
+        :param mode: The file mode (x:gz) for GZIP tar "x" for normal tar archive, which skips the compression
+                     for the local only packages
+        :param workers: number of threads to compress GZIP tar, 1 to compress by tarfile in the current thread
         :return: None
         """
         with XcalLogger("CompressionUtility", "compress_tar_from_dir", debug_mode=logger.debug_mode, parent = logger, trace_id=logger.trace_id, span_id=logger.span_id):
@@ -64,57 +516,258 @@ class CompressionUtility:
             if not os.path.exists(src_location):
                 raise XcalException("CompressionUtility", "compress_tar_from_dir", "cannot locate source directory %s" % src_location, TaskErrorNo.E_COMPRESS_FAIL)
             try:
-                with tarfile.open(package_path, mode) as t:
-                    t.add(src_location, arcname=".", recursive=True)
+                CompressionUtility._write_tar(package_path, mode, src_location, ".", workers)
             except Exception as e:
                 raise XcalException("CompressionUtility", "compress_tar_from_dir", "tarball creation error",
                                     TaskErrorNo.E_COMPRESS_FAIL)
         pass
 
     @staticmethod
-    def extract_file(logger: XcalLogger, fname: str, dest_dir: str, remove: bool):
+    def _write_tar(package_path: str, mode: str, src_location: str, arcname: str, workers: int = None):
+        """
+        Write the file/directory into a tar archive, GZIP tar is compressed by ParallelGzipWriter unless workers is 1.
+        A plain tar (mode x or w) is written without any compression stream, through a large buffer and with the
+        members copied in ARCHIVE_CHUNK_SIZE blocks instead of the 16K blocks of tarfile
+        :param package_path: The output tar archive path
+        :param mode: The file mode, e.g. x:gz, w:gz, x
+        :param src_location: file/directory path
+        :param arcname: name of the file/directory in the archive
+        :param workers: number of threads to compress GZIP tar
+        :return: None
+        """
+        file_mode, _, compression = mode.partition(":")
+        if compression == "" and file_mode in ("x", "w"):
+            with open(package_path, file_mode + "b", buffering=ARCHIVE_CHUNK_SIZE) as f, \
+                    tarfile.open(fileobj=f, mode="w", copybufsize=ARCHIVE_CHUNK_SIZE) as t:
+                t.add(src_location, arcname=arcname, recursive=True)
+            return
+
+        if compression != "gz" or workers == 1:
+            with tarfile.open(package_path, mode) as t:
+                t.add(src_location, arcname=arcname, recursive=True)
+            return
+
+        with open(package_path, file_mode + "b") as f, ParallelGzipWriter(f, workers=workers) as gz:
+            with tarfile.open(fileobj=gz, mode="w", copybufsize=ARCHIVE_CHUNK_SIZE) as t:
+                t.add(src_location, arcname=arcname, recursive=True)
+
+    @staticmethod
+    def extract_file(logger: XcalLogger, fname: str, dest_dir: str, remove: bool, workers: int = None,
+                     incremental: bool = False):
         """
         Extract file by zipfile/tarfile
         :param logger:
         :param fname: file to be extracted
         :param dest_dir: extract file to where
         :param remove:
+        :param workers: number of threads to decompress the zip members, default is the cpu count.
+                        tar is a stream so it is always extracted by one thread
+        :param incremental: skip the files already extracted, whose size and mtime are the same as the member
         :return:
         """
         with XcalLogger("CompressionUtility", "extract_file", debug_mode=logger.debug_mode, parent = logger, trace_id=logger.trace_id, span_id=logger.span_id) as log:
             log.info("extracting tar(gz|xz|bz2)/zip", "begin to extract file %s to %s" % (fname, dest_dir))
             if fname.endswith('.tar') or fname.endswith('.tar.gz') or fname.endswith('.tar.bz2') or fname.endswith(
                     '.tar.xz'):
-                with tarfile.open(fname) as t:
-                    t.extractall(path=dest_dir)
+                skipped = CompressionUtility._extract_tar(fname, dest_dir, incremental)
             elif fname.endswith('.zip'):
-                with zipfile.ZipFile(fname) as z:
-                    # Decompressing each file in the archive
-                    for info in z.infolist():
-                        extracted_path = z.extract(info, dest_dir)
-                        # If source system is UNIX-based and the file is with execution privilege
-                        # We should preserve the execution rights on the file extracted.
-                        if info.create_system == CompressionUtility.ZIP_UNIX_SYSTEM \
-                                and sys.platform != "win32" \
-                                and os.path.isfile(extracted_path):
-                            unix_attributes = info.external_attr >> 16
-                            if unix_attributes & S_IXUSR:
-                                os.chmod(extracted_path, os.stat(extracted_path).st_mode | S_IXUSR)
-
+                skipped = CompressionUtility._extract_zip(fname, dest_dir, workers, incremental)
             else:
                 raise XcalException("CompressionUtility", "extract_file", "Cannot identify package type",
                                     TaskErrorNo.E_EXTRACT_UNKNOWN_FILEKIND)
+            if skipped > 0:
+                log.info("extracting tar(gz|xz|bz2)/zip", "%d files are already extracted, skipped" % skipped)
 
             if remove:
                 os.remove(fname)
 
     @staticmethod
-    def get_archive(filename, file_path, input_file=None, destination_path=None):
+    def _get_extract_path(dest_dir: str, member_name: str):
+        """
+        :param dest_dir: real path of the destination directory
+        :param member_name: name of the archive member
+        :return: path to extract the member to
+        :raise XcalException: the member is out of the destination directory, e.g. absolute path or has '..'
+        """
+        extract_path = os.path.realpath(os.path.join(dest_dir, member_name))
+        if extract_path != dest_dir and not extract_path.startswith(os.path.join(dest_dir, "")):
+            raise XcalException("CompressionUtility", "extract_file",
+                                "archive member %s is out of the destination directory %s" % (member_name, dest_dir),
+                                TaskErrorNo.E_API_FILE_COMPRESSFILE_DECOMPRESS_FAILED)
+        return extract_path
+
+    @staticmethod
+    def _check_link(dest_dir: str, member: tarfile.TarInfo):
+        """
+        Check the link member and its target are in the destination directory. An absolute symbolic link is allowed
+        as long as it points into the destination directory, a relative one is resolved from the directory of the link.
+        The link itself is not followed, it may be extracted already
+        :param dest_dir: real path of the destination directory
+        :param member: symbolic link or hard link member of the tar file
+        :return: path to extract the link to
+        :raise XcalException: the link or its target is out of the destination directory
+        """
+        parent_path = CompressionUtility._get_extract_path(dest_dir, os.path.dirname(member.name))
+        extract_path = os.path.join(parent_path, os.path.basename(member.name))
+        if member.issym():
+            # os.path.join keeps the absolute target as it is
+            target_path = os.path.join(parent_path, member.linkname)
+        else:
+            # the target of the hard link is another member of the tar file
+            target_path = os.path.join(dest_dir, member.linkname)
+        target_path = os.path.realpath(target_path)
+        if target_path != dest_dir and not target_path.startswith(os.path.join(dest_dir, "")):
+            raise XcalException("CompressionUtility", "extract_file",
+                                "link %s -> %s points out of the destination directory %s" %
+                                (member.name, member.linkname, dest_dir),
+                                TaskErrorNo.E_API_FILE_COMPRESSFILE_DECOMPRESS_FAILED)
+        return extract_path
+
+    @staticmethod
+    def _is_extracted(extract_path: str, size: int, mtime: int):
+        """
+        :param extract_path: path the member is extracted to
+        :param size: size of the member
+        :param mtime: modification time of the member, in seconds
+        :return: True if the file is already extracted with the same size and mtime
+        """
+        try:
+            file_stat = os.lstat(extract_path)
+        except OSError:
+            return False
+        return file_stat.st_size == size and int(file_stat.st_mtime) == int(mtime)
+
+    @staticmethod
+    def _extract_tar(fname: str, dest_dir: str, incremental: bool = False):
+        """
+        Extract the tar file as a stream, the members are decompressed and written in large buffers one by one.
+        The links, absolute or relative, are only rejected when their targets resolve out of the destination directory
+        :param fname: tar file, may be compressed by gzip, bzip2 or lzma
+        :param dest_dir: extract file to where
+        :param incremental: skip the files already extracted with the same size and mtime
+        :return: number of the skipped files
+        """
+        dest_dir = os.path.realpath(dest_dir)
+        skipped = 0
+        directories = []
+        with open(fname, "rb") as f:
+            # the gzip stream of tarfile stops at the end of the first gzip member, while the GZIP tar written by
+            # ParallelGzipWriter has many of them. GzipFile reads all the members
+            is_gzip = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+            f.seek(0)
+            fileobj, mode = (gzip.GzipFile(fileobj=f), "r|") if is_gzip else (f, "r|*")
+            with fileobj, tarfile.open(fileobj=fileobj, mode=mode, bufsize=EXTRACT_BUFFER_SIZE) as t:
+                t.copybufsize = EXTRACT_BUFFER_SIZE
+                for member in t:
+                    if member.issym() or member.islnk():
+                        extract_path = CompressionUtility._check_link(dest_dir, member)
+                    else:
+                        extract_path = CompressionUtility._get_extract_path(dest_dir, member.name)
+
+                    if incremental and member.isfile() and \
+                            CompressionUtility._is_extracted(extract_path, member.size, member.mtime):
+                        skipped += 1
+                        continue
+
+                    # same as extractall, the attributes of the directories are set after their files are extracted
+                    if member.isdir():
+                        directories.append(member)
+                    t.extract(member, dest_dir, set_attrs=not member.isdir())
+
+                for member in sorted(directories, key=lambda directory: directory.name, reverse=True):
+                    directory_path = os.path.join(dest_dir, member.name)
+                    t.chown(member, directory_path, False)
+                    t.utime(member, directory_path)
+                    t.chmod(member, directory_path)
+        return skipped
+
+    @staticmethod
+    def _extract_zip(fname: str, dest_dir: str, workers: int = None, incremental: bool = False):
+        """
+        Extract the zip file, the members are decompressed concurrently by worker threads,
+        each thread reads the zip file by its own file handle
+        :param fname: zip file
+        :param dest_dir: extract file to where
+        :param workers: number of worker threads, default is the cpu count
+        :param incremental: skip the files already extracted with the same size and mtime
+        :return: number of the skipped files
+        """
+        dest_dir = os.path.realpath(dest_dir)
+        os.makedirs(dest_dir, exist_ok=True)
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        local = threading.local()
+        zip_files = []
+        zip_files_lock = threading.Lock()
+
+        def extract_member(info: zipfile.ZipInfo, extract_path: str):
+            if not hasattr(local, "zip_file"):
+                local.zip_file = zipfile.ZipFile(fname)
+                with zip_files_lock:
+                    zip_files.append(local.zip_file)
+            CompressionUtility._extract_zip_member(local.zip_file, info, extract_path)
+
+        skipped = 0
+        with zipfile.ZipFile(fname) as z:
+            members = []
+            for info in z.infolist():
+                extract_path = CompressionUtility._get_extract_path(dest_dir, info.filename)
+                if info.is_dir():
+                    os.makedirs(extract_path, exist_ok=True)
+                    continue
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                if incremental and CompressionUtility._is_extracted(extract_path, info.file_size, mtime):
+                    skipped += 1
+                    continue
+                members.append((info, extract_path))
+
+        try:
+            if workers <= 1:
+                for info, extract_path in members:
+                    extract_member(info, extract_path)
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for future in [executor.submit(extract_member, info, extract_path) for info, extract_path in members]:
+                        future.result()
+        finally:
+            for zip_file in zip_files:
+                zip_file.close()
+        return skipped
+
+    @staticmethod
+    def _extract_zip_member(z: zipfile.ZipFile, info: zipfile.ZipInfo, extract_path: str):
+        """
+        Extract one file member of the zip file, the mtime of the member is kept for the incremental extraction
+        :param z: zip file
+        :param info: the member
+        :param extract_path: path to extract the member to
+        :return: None
+        """
+        os.makedirs(os.path.dirname(extract_path), exist_ok=True)
+        with z.open(info) as source, open(extract_path, "wb") as target:
+            shutil.copyfileobj(source, target, EXTRACT_BUFFER_SIZE)
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        os.utime(extract_path, (mtime, mtime))
+
+        # If source system is UNIX-based and the file is with execution privilege
+        # We should preserve the execution rights on the file extracted.
+        if info.create_system == CompressionUtility.ZIP_UNIX_SYSTEM and sys.platform != "win32":
+            unix_attributes = info.external_attr >> 16
+            if unix_attributes & S_IXUSR:
+                os.chmod(extract_path, os.stat(extract_path).st_mode | S_IXUSR)
+
+    @staticmethod
+    def get_archive(filename, file_path, input_file=None, destination_path=None, path_filter: PathFilter = None,
+                    compress_level: int = None, workers: int = None):
         """
         :param filename: xxx.zip file
         :param file_path: where to find the files in the input_file
         :param input_file: contains the files which need to be archived
         :param destination_path:
+        :param path_filter: selects the source code files, default selects all the source code files in file_path
+        :param compress_level: deflate compress level (1-9), the files are stored without compression if None or 0
+        :param workers: number of threads to read the files, default is the cpu count
         :return:
         """
         utility = FileUtility()
@@ -134,35 +787,25 @@ class CompressionUtility:
             logger.error("project path does not exist: %s" % file_path)
             raise ESourceDirectoryNotExist
 
+        if path_filter is None:
+            path_filter = PathFilter(file_path)
+        if compress_level is not None:
+            compress_level = int(compress_level)
+        if workers is not None:
+            workers = int(workers)
+
         logger.debug("filename: %s, file_path: %s, input_file: %s, destination_path: %s" % (filename, file_path, input_file, destination_path))
         logger.info("begin to archive: %s" % file_path)
         logger.info("archive start at: %s" % time.asctime())
 
-        if input_file is None or not os.path.exists(input_file):
-            # if input_file(source_files.json) is None or not exists, collect all the source code files in
-            # project_path. For now scan java gradle projects need this.
-            with zipfile.ZipFile(filename, 'w') as source_code_zip:
-                utility.goto_dir(file_path)
-                for root, dirs, filenames in os.walk(file_path, followlinks = True):
-                    for filename in filenames:
-                        if filename.endswith(tuple(SOURCE_CODE_SUFFIX)):
-                            source_code_zip.write(os.path.relpath(os.path.join(root, filename)))
-                utility.goback_dir()
-        else:
-            with open(input_file) as json_file:
-                source_code_files = json.load(json_file)
-                with zipfile.ZipFile(filename, 'w') as source_code_zip:
-                    utility.goto_dir(file_path)
-                    for source_code_file in source_code_files:
-                        if not os.path.exists(source_code_file):
-                            logger.error("source code file does not exist: %s" % source_code_file)
-                            raise ECommonFileNotExist
-
-                        if source_code_file.startswith(file_path):
-                            source_code_zip.write(os.path.relpath(source_code_file, file_path))
-                        else:
-                            logger.warning("source code file %s does not belongs to project %s" % (source_code_file, file_path))
-                    utility.goback_dir()
+        members = CompressionUtility._get_archive_members(file_path, input_file, path_filter)
+        with ZipArchiveWriter(filename) as source_code_zip:
+            try:
+                count = _write_zip_members(source_code_zip, members, compress_level, workers)
+            except FileNotFoundError as err:
+                logger.error("source code file does not exist: %s" % err.filename)
+                raise ECommonFileNotExist
+        logger.info("%d files archived" % count)
 
         archive_file_path = os.path.join(destination_path, filename)
 
@@ -173,6 +816,129 @@ class CompressionUtility:
 
         return archive_file_path
 
+    @staticmethod
+    def get_dedup_archive(manifest_filename, file_path, input_file=None, destination_path=None,
+                          path_filter: PathFilter = None, blob_index: SourceBlobIndex = None,
+                          compress_level: int = None, workers: int = None):
+        """
+        Content addressed alternative of get_archive. The manifest lists the relative path and sha256 of every
+        source code file, and a new blob pack holds only the file contents which are not uploaded yet
+        :param manifest_filename: xxx.json manifest file
+        :param file_path: where to find the files in the input_file
+        :param input_file: contains the files which need to be archived
+        :param destination_path: where to write the manifest and the blob pack
+        :param path_filter: selects the source code files, default selects all the source code files in file_path
+        :param blob_index: index of the uploaded blobs, all the blobs are packed if None
+        :param compress_level: deflate compress level (1-9), the files are stored without compression if None or 0
+        :param workers: number of threads to read and hash the files, default is the cpu count
+        :return: manifest file path
+        """
+        if destination_path is None:
+            destination_path = os.getcwd()
+        os.makedirs(destination_path, exist_ok = True)
+
+        file_path = os.path.normpath(file_path)
+        if not os.path.exists(file_path):
+            logger.error("project path does not exist: %s" % file_path)
+            raise ESourceDirectoryNotExist
+
+        if path_filter is None:
+            path_filter = PathFilter(file_path)
+        if compress_level is not None:
+            compress_level = int(compress_level)
+        if workers is not None:
+            workers = int(workers)
+        # relative input_file is relative to the destination path as get_archive does
+        if input_file is not None:
+            input_file = os.path.join(destination_path, input_file)
+
+        logger.info("begin to archive by content: %s" % file_path)
+        logger.info("archive start at: %s" % time.asctime())
+
+        pack = "source_blobs_%s.zip" % uuid.uuid4().hex
+        pack_path = os.path.join(destination_path, pack)
+        files = []
+        packed_blobs = set()
+        read_member = lambda source_code_file, relative_path: _read_blob_member(source_code_file, blob_index, compress_level)
+        members = CompressionUtility._get_archive_members(file_path, input_file, path_filter)
+        with ZipArchiveWriter(pack_path) as blob_zip:
+            try:
+                for (source_code_file, relative_path), (sha256, file_size, zinfo, data) in _map_members(read_member, members, workers, _get_member_weight):
+                    if zinfo is not None and sha256 not in packed_blobs:
+                        _append_zip_member(blob_zip, source_code_file, zinfo, data, compress_level)
+                        packed_blobs.add(sha256)
+                    files.append({"relativePath": relative_path.replace(os.sep, "/"),
+                                  "sha256": sha256,
+                                  "fileSize": file_size,
+                                  "pack": pack if sha256 in packed_blobs else blob_index.get_pack(sha256)})
+            except FileNotFoundError as err:
+                logger.error("source code file does not exist: %s" % err.filename)
+                raise ECommonFileNotExist
+
+        if len(packed_blobs) == 0:
+            os.remove(pack_path)
+            pack = None
+
+        manifest_path = os.path.join(destination_path, manifest_filename)
+        with open(manifest_path, "w") as manifest_file:
+            json.dump({"pack": pack, "files": files}, manifest_file, indent=1)
+
+        logger.info("%d files archived, %d new blobs packed in %s" % (len(files), len(packed_blobs), pack))
+        logger.info("archive complete at: %s" % time.asctime())
+        return manifest_path
+
+    @staticmethod
+    def _get_archive_members(file_path: str, input_file: str, path_filter: PathFilter):
+        """
+        :param file_path: project path
+        :param input_file: contains the files which need to be archived
+        :param path_filter: selects the source code files
+        :return: generator of (file path, name in the archive) of the source code files
+        """
+        if input_file is None or not os.path.exists(input_file):
+            # if input_file(source_files.json) is None or not exists, collect all the source code files in
+            # project_path. For now scan java gradle projects need this.
+            return CompressionUtility._iter_project_archive_members(file_path, path_filter)
+
+        with open(input_file) as json_file:
+            source_code_files = json.load(json_file)
+        return CompressionUtility._iter_listed_archive_members(file_path, source_code_files, path_filter)
+
+    @staticmethod
+    def _iter_project_archive_members(file_path: str, path_filter: PathFilter):
+        """
+        :param file_path: project path
+        :param path_filter: selects the source code files
+        :return: generator of (file path, name in the archive) of the source code files in the project path
+        """
+        for root, dirs, filenames in os.walk(file_path, followlinks = True):
+            for filename in filenames:
+                if path_filter.has_source_suffix(filename):
+                    source_code_file = os.path.join(root, filename)
+                    relative_path = path_filter.get_relative_path(source_code_file)
+                    if path_filter.match_patterns(relative_path):
+                        yield source_code_file, relative_path
+
+    @staticmethod
+    def _iter_listed_archive_members(file_path: str, source_code_files: list, path_filter: PathFilter):
+        """
+        :param file_path: project path
+        :param source_code_files: source code file paths
+        :param path_filter: selects the source code files
+        :return: generator of (file path, name in the archive) of the source code files which belong to the project
+        """
+        for source_code_file in source_code_files:
+            source_code_file = os.path.normpath(source_code_file)
+            if not path_filter.is_under_project(source_code_file):
+                logger.warning("source code file %s does not belongs to project %s" % (source_code_file, file_path))
+                continue
+
+            relative_path = path_filter.get_relative_path(source_code_file)
+            if path_filter.match_patterns(relative_path):
+                yield source_code_file, relative_path
+            else:
+                logger.debug("source code file %s is excluded" % source_code_file)
+
     @staticmethod
     def add_dir_to_zip_file(path, zip_file:zipfile.ZipFile):
         """
@@ -0,0 +1,202 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+from common.HashUtility import HashUtility
+from common.SqliteLruCache import SqliteLruCache
+
+logger = logging.getLogger(__name__)
+
+# default max total size in bytes of the cached results, least recently used entries are evicted beyond it
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# include directives of a source code file, all of them are taken regardless of the conditional compilation
+INCLUDE_PATTERN = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*[<"]([^>"\r\n]+)[>"]', re.MULTILINE)
+# include of a macro, the included file is not known without preprocessing
+COMPUTED_INCLUDE_PATTERN = re.compile(rb'^[ \t]*#[ \t]*include[ \t]+[A-Za-z_]', re.MULTILINE)
+
+
+class CppcheckResultCache(SqliteLruCache):
+    """
+    Persistent cache of the cppcheck misra result of each source code file, stored in a sqlite database.
+    An entry is keyed by the file path, the sha256 of the file content, the sha256 of the files it includes
+    (recursively), the sha256 of the suppressions list and the cppcheck version, so a file is only scanned again when
+    one of them changes. The result of a file is the xml fragment of the errors reported while checking it as a
+    translation unit.
+    cppcheck is run without include paths, so the included files are resolved from the folder of the including file
+    as cppcheck does. The include names not resolved are a part of the key too, and the files including a macro are
+    not cached at all.
+    """
+
+    def __init__(self, cache_path: str, suppression_file_path: str, cppcheck_version: str, max_size: int = None):
+        """
+        :param cache_path: path of the sqlite database file, created if not exists
+        :param suppression_file_path: cppcheck suppressions list file
+        :param cppcheck_version: version returned by get_cppcheck_version
+        :param max_size: max total size in bytes of the cached results
+        """
+        self.cppcheck_version = cppcheck_version
+        self.max_size = DEFAULT_MAX_SIZE if max_size is None else int(max_size)
+        self.context = "%s:%s" % (HashUtility.get_sha256_hash(suppression_file_path), cppcheck_version)
+        super().__init__(cache_path)
+
+    def create_tables(self):
+        self.conn.execute("CREATE TABLE IF NOT EXISTS misra_result ("
+                          "key TEXT PRIMARY KEY, errors TEXT, size INTEGER, last_used INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS misra_result_last_used ON misra_result (last_used)")
+
+    @staticmethod
+    def get_cppcheck_version():
+        """
+        :return: output of cppcheck --version, None if cppcheck cannot be run
+        """
+        try:
+            ret = subprocess.run(["cppcheck", "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                 universal_newlines=True)
+        except OSError as err:
+            logger.warning("cannot get cppcheck version: %s" % err)
+            return None
+        if ret.returncode != 0:
+            return None
+        return ret.stdout.strip()
+
+    @staticmethod
+    def _read_includes(file_path: str):
+        """
+        :param file_path: source code or header file path
+        :return: tuple of (list of the included file paths, list of the include names not resolved, True if a macro is
+                 included), None if the file cannot be read
+        """
+        try:
+            with open(file_path, "rb") as source_file:
+                data = source_file.read()
+        except OSError:
+            return None
+
+        directory = os.path.dirname(file_path)
+        included = []
+        missing = []
+        for name in INCLUDE_PATTERN.findall(data):
+            name = name.decode("UTF-8", errors="replace").strip()
+            include_path = os.path.normpath(os.path.join(directory, name))
+            if os.path.isfile(include_path):
+                included.append(include_path)
+            else:
+                missing.append(name)
+        return included, missing, COMPUTED_INCLUDE_PATTERN.search(data) is not None
+
+    @staticmethod
+    def _get_include_closure(file_path: str, includes: dict):
+        """
+        :param file_path: source code file path
+        :param includes: dict of file path to the result of _read_includes
+        :return: tuple of (set of the file paths included recursively, set of the include names not resolved),
+                 None if a macro is included or the file cannot be read
+        """
+        included = set()
+        missing = set()
+        pending = [file_path]
+        while len(pending) > 0:
+            result = includes.get(pending.pop())
+            if result is None or result[2]:
+                return None
+            missing.update(result[1])
+            for include_path in result[0]:
+                if include_path not in included and include_path != file_path:
+                    included.add(include_path)
+                    pending.append(include_path)
+        return included, missing
+
+    def get_keys(self, file_list: list, workers: int = None):
+        """
+        :param file_list: source code file paths
+        :param workers: number of threads to read and hash the files, default is the cpu count
+        :return: dict of file path to the cache key, the files cannot be read or including a macro are not included
+        """
+        workers = (os.cpu_count() or 1) if workers is None else max(1, int(workers))
+        readable_files = [file_path for file_path in file_list if os.access(file_path, os.R_OK)]
+
+        # read the include directives level by level, every header is read once however many files include it
+        includes = dict()
+        pending = list(dict.fromkeys(readable_files))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while len(pending) > 0:
+                includes.update(zip(pending, executor.map(CppcheckResultCache._read_includes, pending)))
+                pending = list(dict.fromkeys(include_path for file_path in pending if includes[file_path] is not None
+                                             for include_path in includes[file_path][0] if include_path not in includes))
+
+        closures = dict()
+        for file_path in readable_files:
+            closure = CppcheckResultCache._get_include_closure(file_path, includes)
+            if closure is None:
+                logger.debug("%s includes a macro or cannot be read, its cppcheck result is not cached" % file_path)
+                continue
+            closures[file_path] = closure
+
+        hashed_files = set(closures)
+        for included, missing in closures.values():
+            hashed_files.update(included)
+        digests = HashUtility.get_files_digests(hashed_files, ("sha256",), workers)
+
+        keys = dict()
+        for file_path, (included, missing) in closures.items():
+            # the cached errors name the file, so the path is a part of the key as well as the content
+            parts = [file_path, digests[file_path]["sha256"], self.context]
+            parts.extend(sorted("%s=%s" % (include_path, digests[include_path]["sha256"]) for include_path in included))
+            parts.extend(sorted("?%s" % name for name in missing))
+            keys[file_path] = hashlib.sha256("\n".join(parts).encode("UTF-8")).hexdigest()
+        return keys
+
+    def get(self, key: str):
+        """
+        :param key: cache key returned by get_keys
+        :return: list of the cached error elements, None if not cached
+        """
+        row = self.conn.execute("SELECT errors FROM misra_result WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.miss_count += 1
+            return None
+
+        self.hit_count += 1
+        self.touch("misra_result", "key", key)
+        return list(ElementTree.fromstring(row[0]))
+
+    def put(self, key: str, errors: list):
+        """
+        :param key: cache key returned by get_keys
+        :param errors: error elements reported for the file, empty if no error
+        :return: None
+        """
+        fragment = ElementTree.Element("errors")
+        fragment.extend(errors)
+        data = ElementTree.tostring(fragment, encoding="unicode")
+        self.conn.execute("INSERT OR REPLACE INTO misra_result (key, errors, size, last_used) VALUES (?, ?, ?, ?)",
+                          (key, data, len(data), self.generation))
+
+    def evict(self):
+        """
+        Remove the least recently used entries when the total size of the cached results exceeds max_size
+        :return: number of entries removed
+        """
+        total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM misra_result").fetchone()[0]
+        if total_size <= self.max_size:
+            return 0
+
+        keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM misra_result ORDER BY last_used"):
+            if total_size <= self.max_size:
+                break
+            keys.append((key,))
+            total_size -= size
+        self.conn.executemany("DELETE FROM misra_result WHERE key = ?", keys)
+        logger.debug("evict %d entries from cppcheck result cache" % len(keys))
+        return len(keys)
+
+    def get_stats(self):
+        return "cppcheck result cache hit: %d, miss: %d" % (self.hit_count, self.miss_count)
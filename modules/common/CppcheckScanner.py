@@ -0,0 +1,261 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# a shard is closed once it reaches either limit, a file larger than the byte limit is a shard of its own
+CPPCHECK_SHARD_MAX_FILES = 64
+CPPCHECK_SHARD_MAX_BYTES = 16 * 1024 * 1024
+# the file lists and the xml results of the shards are kept in this folder of the result dir
+CPPCHECK_SHARD_FOLDER_NAME = "cppcheck_shards"
+
+
+class CppcheckScanner(object):
+    """
+    Run cppcheck with the misra addon over the source code files. cppcheck reads the files from a --file-list, so the
+    command line does not grow with the number of files.
+    The files can be split into shards, each shard is one cppcheck process, and the shards run in parallel and their
+    xml results are merged into one result file. The misra rules across the translation units (e.g. the external
+    identifiers) only see the files of the same shard, so sharding is only used when it is asked for.
+    """
+
+    @staticmethod
+    def split_shards(file_list: list, max_files: int = None, max_bytes: int = None):
+        """
+        :param file_list: source code file paths
+        :param max_files: max number of files in a shard
+        :param max_bytes: max total size of the files in a shard
+        :return: list of shards, each is a list of file paths
+        """
+        max_files = CPPCHECK_SHARD_MAX_FILES if max_files is None else int(max_files)
+        max_bytes = CPPCHECK_SHARD_MAX_BYTES if max_bytes is None else int(max_bytes)
+
+        shards = []
+        shard = []
+        shard_bytes = 0
+        for file_path in file_list:
+            try:
+                file_size = os.path.getsize(file_path)
+            except OSError:
+                file_size = 0
+            if len(shard) > 0 and (len(shard) >= max_files or shard_bytes + file_size > max_bytes):
+                shards.append(shard)
+                shard = []
+                shard_bytes = 0
+            shard.append(file_path)
+            shard_bytes += file_size
+        if len(shard) > 0:
+            shards.append(shard)
+        return shards
+
+    @staticmethod
+    def _run_shard(index: int, shard: list, suppression_file_path: str, shard_dir: str, log_path: str, timeout: float):
+        """
+        Run cppcheck over the files of the shard, the xml result is written to the stderr as the single command did
+        :param index: index of the shard, used to name the files of the shard
+        :param shard: file paths of the shard
+        :param suppression_file_path: cppcheck suppressions list file
+        :param shard_dir: folder of the file list and the xml result of the shard
+        :param log_path: the stdout of cppcheck is appended to it
+        :param timeout: seconds before the shard is killed, no limit if None
+        :return: path of the xml result, None if cppcheck failed
+        """
+        file_list_path = os.path.join(shard_dir, "shard_%d.txt" % index)
+        result_path = os.path.join(shard_dir, "shard_%d.xml" % index)
+        with open(file_list_path, "w") as file_list:
+            file_list.write("\n".join(shard))
+
+        command = ["cppcheck", "--addon=misra.py", "--suppressions-list=%s" % suppression_file_path,
+                   "--file-list=%s" % file_list_path, "--xml"]
+        logger.debug("cppcheck shard %d: %d files" % (index, len(shard)))
+        with open(log_path, "ab") as log_file, open(result_path, "wb") as result_file:
+            # the addon runs in child processes of cppcheck, kill the whole process group on timeout
+            process = subprocess.Popen(command, stdout=log_file, stderr=result_file, start_new_session=(os.name == "posix"))
+            try:
+                rc = process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                if os.name == "posix":
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+                process.wait()
+                logger.warning("cppcheck shard %d timeout after %s seconds, file list: %s" % (index, timeout, file_list_path))
+                return None
+
+        if rc != 0:
+            logger.warning("cppcheck shard %d failed, return code: %s, file list: %s" % (index, rc, file_list_path))
+            return None
+        return result_path
+
+    @staticmethod
+    def _read_result(result_path: str):
+        """
+        :param result_path: xml result of cppcheck
+        :return: tuple of (root element, list of the error elements)
+        """
+        root = ElementTree.parse(result_path).getroot()
+        errors = root.find("errors")
+        if errors is None:
+            return root, []
+        error_list = list(errors)
+        # only the header (version of the results and cppcheck) is kept in the root
+        root.remove(errors)
+        return root, error_list
+
+    @staticmethod
+    def _write_results(results: list, output_file: str, cached_errors: list = None, cppcheck_version: str = None):
+        """
+        Merge the errors into one xml result, the errors reported more than once (e.g. in a shared header) are kept once
+        :param results: list of (root element, list of the error elements) returned by _read_result
+        :param output_file: merged xml result
+        :param cached_errors: error elements of the files not scanned again
+        :param cppcheck_version: used in the header if there is no result, e.g. all the files are cached
+        :return: number of errors in the merged result
+        """
+        if len(results) > 0:
+            root = results[0][0]
+        else:
+            root = ElementTree.Element("results", {"version": "2"})
+            if cppcheck_version is not None:
+                ElementTree.SubElement(root, "cppcheck", {"version": cppcheck_version.split()[-1]})
+        errors = ElementTree.SubElement(root, "errors")
+
+        error_keys = set()
+        error_lists = [error_list for _, error_list in results]
+        if cached_errors is not None:
+            error_lists.append(cached_errors)
+        for error_list in error_lists:
+            for error in error_list:
+                key = CppcheckScanner._get_error_key(error)
+                if key not in error_keys:
+                    error_keys.add(key)
+                    errors.append(error)
+
+        ElementTree.ElementTree(root).write(output_file, encoding="UTF-8", xml_declaration=True)
+        return len(error_keys)
+
+    @staticmethod
+    def merge_results(result_paths: list, output_file: str):
+        """
+        Merge the xml results of the shards
+        :param result_paths: xml results of cppcheck
+        :param output_file: merged xml result
+        :return: number of errors in the merged result
+        """
+        results = [CppcheckScanner._read_result(result_path) for result_path in result_paths]
+        return CppcheckScanner._write_results(results, output_file)
+
+    @staticmethod
+    def _cache_shard_errors(cache, shard: list, errors: list, file_keys: dict):
+        """
+        Split the errors of a shard by the file checked and save them in the cache
+        :param cache: CppcheckResultCache
+        :param shard: file paths of the shard
+        :param errors: error elements of the shard
+        :param file_keys: dict of file path to the cache key
+        :return: number of files cached
+        """
+        file_errors = {file_path: [] for file_path in shard if file_path in file_keys}
+        for error in errors:
+            location = error.find("location")
+            # file0 is the file checked when the error is located in a header included by it
+            file_path = None if location is None else location.get("file0", location.get("file"))
+            if file_path is not None:
+                file_path = os.path.normpath(file_path)
+            if file_path not in file_errors:
+                # the error cannot be told apart by file, do not cache the shard otherwise it is lost next time
+                logger.debug("error of unknown file in the shard, do not cache it: %s" % error.get("id"))
+                return 0
+            file_errors[file_path].append(error)
+
+        for file_path, error_list in file_errors.items():
+            cache.put(file_keys[file_path], error_list)
+        return len(file_errors)
+
+    @staticmethod
+    def _get_error_key(error):
+        """
+        :param error: error element of the cppcheck xml result
+        :return: hashable key identifies the error
+        """
+        locations = tuple((location.get("file"), location.get("line"), location.get("column"))
+                          for location in error.findall("location"))
+        return error.get("id"), error.get("severity"), error.get("msg"), locations
+
+    @staticmethod
+    def scan(file_list: list, suppression_file_path: str, output_file: str, log_path: str, workers: int = None,
+             shard: bool = False, max_files: int = None, max_bytes: int = None, timeout: float = None, cache=None):
+        """
+        Scan the files, in shards if asked, and merge the results into the output file
+        :param file_list: source code file paths
+        :param suppression_file_path: cppcheck suppressions list file
+        :param output_file: merged xml result
+        :param log_path: the stdout of cppcheck is appended to it
+        :param workers: number of shards run in parallel, default is the cpu count
+        :param shard: split the files into shards, otherwise all the files are checked by one cppcheck process
+        :param max_files: max number of files in a shard
+        :param max_bytes: max total size of the files in a shard
+        :param timeout: seconds before a shard is killed, no limit if None
+        :param cache: CppcheckResultCache, only the files not cached are scanned if given
+        :return: True if all the shards succeeded and the result is merged
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        timeout = None if timeout is None else float(timeout)
+
+        cached_errors = None
+        file_keys = dict()
+        if cache is not None:
+            cached_errors = []
+            scan_list = []
+            file_keys = cache.get_keys(file_list, workers)
+            for file_path in file_list:
+                errors = cache.get(file_keys[file_path]) if file_path in file_keys else None
+                if errors is None:
+                    scan_list.append(file_path)
+                else:
+                    cached_errors.extend(errors)
+            logger.info("cppcheck result cached for %d of %d files" % (len(file_list) - len(scan_list), len(file_list)))
+            file_list = scan_list
+
+        shard_dir = os.path.join(os.path.dirname(output_file), CPPCHECK_SHARD_FOLDER_NAME)
+        os.makedirs(shard_dir, exist_ok=True)
+        if shard:
+            shards = CppcheckScanner.split_shards(file_list, max_files, max_bytes)
+        else:
+            shards = [file_list] if len(file_list) > 0 else []
+        logger.info("cppcheck scan %d files in %d shards, workers: %d" % (len(file_list), len(shards), workers))
+
+        # the shards are separate processes, the threads only wait for them
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+            futures = [executor.submit(CppcheckScanner._run_shard, index, shard_files, suppression_file_path, shard_dir,
+                                       log_path, timeout)
+                       for index, shard_files in enumerate(shards)]
+            result_paths = [future.result() for future in futures]
+
+        if None in result_paths:
+            # the shards of the failed scan are kept for troubleshooting
+            return False
+
+        try:
+            results = [CppcheckScanner._read_result(result_path) for result_path in result_paths]
+        except ElementTree.ParseError as err:
+            logger.warning("cannot merge the cppcheck results in %s: %s" % (shard_dir, err))
+            return False
+
+        if cache is not None:
+            for shard_files, (_, errors) in zip(shards, results):
+                CppcheckScanner._cache_shard_errors(cache, shard_files, errors, file_keys)
+        count = CppcheckScanner._write_results(results, output_file, cached_errors,
+                                               cache.cppcheck_version if cache is not None else None)
+        logger.info("cppcheck scan merged %d errors into %s" % (count, output_file))
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        return True
@@ -0,0 +1,143 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import logging
+import os
+
+from common.SqliteLruCache import SqliteLruCache
+
+logger = logging.getLogger(__name__)
+
+# default max number of files kept in the cache, least recently used entries are evicted beyond it
+DEFAULT_MAX_ENTRIES = 1000000
+
+
+class FileInfoCache(SqliteLruCache):
+    """
+    Persistent cache of the per-file scan result (checksum, file size, number of lines), stored in a sqlite
+    database and keyed by the file path. An entry is only reused when the stat signature
+    (size, mtime_ns, inode) of the file is unchanged since it was cached.
+    The scan result of the files tracked by git is also keyed by the git blob id, which identifies the content.
+    """
+
+    def __init__(self, cache_path: str, max_entries: int = None, verify: bool = False):
+        """
+        :param cache_path: path of the sqlite database file, created if not exists
+        :param max_entries: max number of entries kept in the cache
+        :param verify: verification mode, cached entries are re-scanned and compared instead of trusted
+        """
+        self.max_entries = DEFAULT_MAX_ENTRIES if max_entries is None else int(max_entries)
+        self.verify = bool(verify)
+        self.mismatch_count = 0
+        super().__init__(cache_path)
+
+    def create_tables(self):
+        self.conn.execute("CREATE TABLE IF NOT EXISTS file_info ("
+                          "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+                          "checksum INTEGER, line_num INTEGER, last_used INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS file_info_last_used ON file_info (last_used)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS blob_info ("
+                          "blob_id TEXT PRIMARY KEY, checksum INTEGER, size INTEGER, line_num INTEGER, last_used INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS blob_info_last_used ON blob_info (last_used)")
+
+    @staticmethod
+    def get_signature(file_path: str):
+        """
+        :param file_path: file path
+        :return: tuple of (size, mtime_ns, inode) of the file
+        """
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, file_path: str, signature: tuple):
+        """
+        Get the cached scan result of the file
+        :param file_path: absolute file path
+        :param signature: stat signature returned by get_signature
+        :return: tuple of (checksum, file size, number of lines), or None if not cached or the file changed
+        """
+        row = self.conn.execute("SELECT size, mtime_ns, inode, checksum, line_num FROM file_info WHERE path = ?",
+                                (file_path,)).fetchone()
+        if row is None or tuple(row[:3]) != tuple(signature):
+            self.miss_count += 1
+            return None
+
+        self.hit_count += 1
+        self.touch("file_info", "path", file_path)
+        return row[3], row[0], row[4]
+
+    def put(self, file_path: str, signature: tuple, scan_result: tuple):
+        """
+        Save the scan result of the file
+        :param file_path: absolute file path
+        :param signature: stat signature returned by get_signature before the file is scanned
+        :param scan_result: tuple of (checksum, file size, number of lines)
+        :return: None
+        """
+        size, mtime_ns, inode = signature
+        checksum, _, line_num = scan_result
+        self.conn.execute("INSERT OR REPLACE INTO file_info (path, size, mtime_ns, inode, checksum, line_num, last_used) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (file_path, size, mtime_ns, inode, checksum, line_num, self.generation))
+
+    def get_blob(self, blob_id: str):
+        """
+        Get the cached scan result of the git blob
+        :param blob_id: git blob id of the file content
+        :return: tuple of (checksum, file size, number of lines), or None if not cached
+        """
+        row = self.conn.execute("SELECT checksum, size, line_num FROM blob_info WHERE blob_id = ?", (blob_id,)).fetchone()
+        if row is None:
+            self.miss_count += 1
+            return None
+
+        self.hit_count += 1
+        self.touch("blob_info", "blob_id", blob_id)
+        return row[0], row[1], row[2]
+
+    def put_blob(self, blob_id: str, scan_result: tuple):
+        """
+        Save the scan result of the git blob
+        :param blob_id: git blob id of the file content
+        :param scan_result: tuple of (checksum, file size, number of lines)
+        :return: None
+        """
+        checksum, size, line_num = scan_result
+        self.conn.execute("INSERT OR REPLACE INTO blob_info (blob_id, checksum, size, line_num, last_used) "
+                          "VALUES (?, ?, ?, ?, ?)", (blob_id, checksum, size, line_num, self.generation))
+
+    def check(self, file_path: str, cached_result: tuple, scan_result: tuple):
+        """
+        Compare the cached scan result with the re-scanned one in verification mode, the caller corrects a stale entry
+        by put or put_blob with the scan result
+        :param file_path: absolute file path
+        :param cached_result: scan result returned by get or get_blob
+        :param scan_result: scan result of the file
+        :return: True if they are the same
+        """
+        if tuple(cached_result) == tuple(scan_result):
+            return True
+
+        self.mismatch_count += 1
+        logger.warning("file info cache of %s is stale, cached: %s, actual: %s" % (file_path, cached_result, scan_result))
+        return False
+
+    def evict(self):
+        """
+        Remove the least recently used entries when the cache holds more than max_entries
+        :return: number of entries removed
+        """
+        removed = 0
+        for table, key in (("file_info", "path"), ("blob_info", "blob_id")):
+            count = self.conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+            if count <= self.max_entries:
+                continue
+
+            self.conn.execute("DELETE FROM %s WHERE %s IN (SELECT %s FROM %s ORDER BY last_used LIMIT ?)"
+                              % (table, key, key, table), (count - self.max_entries,))
+            logger.debug("evict %d entries from %s of file info cache" % (count - self.max_entries, table))
+            removed += count - self.max_entries
+        return removed
+
+    def get_stats(self):
+        return "file info cache hit: %d, miss: %d, mismatch: %d" % (self.hit_count, self.miss_count, self.mismatch_count)
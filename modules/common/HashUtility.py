@@ -6,7 +6,12 @@
 import hashlib
 import logging
 import os
+import stat
 import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# read size used when hashing the files, the file is streamed so the memory does not grow with the file size
+HASH_CHUNK_SIZE = 1024 * 1024
 
 
 class CRC32(object):
@@ -47,34 +52,137 @@ class CRC32(object):
         copy._digest = self._digest
         return copy
 
+    def digest(self):
+        """
+        Return the digest of the data passed to the update() method so far, in big endian bytes.
+        """
+        return self._digest.to_bytes(self.digest_size, "big")
+
+    def hexdigest(self):
+        """
+        Like digest() except the digest is returned as a string of hexadecimal digits.
+        """
+        return self.digest().hex()
+
+
+# hash algorithms can be used by HashUtility, any hashlib algorithm is supported besides them
+HASH_ALGORITHMS = {CRC32.name: CRC32}
+
+
+def register_hash_algorithm(name: str, factory):
+    """
+    Register a hash algorithm, so that it can be used by HashUtility.get_file_digests
+    :param name: algorithm name
+    :param factory: callable returns a hash object with update() and hexdigest() as hashlib does
+    :return: None
+    """
+    HASH_ALGORITHMS[name] = factory
+
+
+def _new_hash(algorithm: str):
+    """
+    :param algorithm: registered algorithm name or hashlib algorithm name
+    :return: a new hash object
+    """
+    factory = HASH_ALGORITHMS.get(algorithm)
+    if factory is not None:
+        return factory()
+    return hashlib.new(algorithm)
+
 
 class HashUtility(object):
 
+    @staticmethod
+    def iter_file_chunks(fp):
+        """
+        Read the binary file object to the end in large chunks into one buffer reused for all the chunks, so no
+        bytes object is created per chunk. A small regular file gets a buffer of its size, one more byte lets the
+        first read reach the end of file
+
+        :param fp: binary file object, better unbuffered
+        :return: generator of (buffer, size), only buffer[:size] is read, and it is overwritten by the next chunk
+        """
+        file_stat = os.fstat(fp.fileno())
+        buffer_size = HASH_CHUNK_SIZE
+        if stat.S_ISREG(file_stat.st_mode):
+            buffer_size = min(HASH_CHUNK_SIZE, file_stat.st_size + 1)
+        buffer = bytearray(buffer_size)
+        size = fp.readinto(buffer)
+        while size:
+            yield buffer, size
+            size = fp.readinto(buffer)
+
+    @staticmethod
+    def get_file_hashes(filename, algorithms=("crc32", "sha256")):
+        """
+        Read the file once in large chunks and feed every chunk to the hash objects of all the algorithms.
+        zlib and hashlib release the GIL for large buffers, so files can be hashed by several threads
+
+        :param filename: file path
+        :param algorithms: registered algorithm names or hashlib algorithm names
+        :return: dict of algorithm name to the hash object
+        """
+        hashes = {algorithm: _new_hash(algorithm) for algorithm in algorithms}
+        with open(filename, mode="rb", buffering=0) as fp:
+            for buffer, size in HashUtility.iter_file_chunks(fp):
+                with memoryview(buffer) as view:
+                    for hash_object in hashes.values():
+                        hash_object.update(view[:size])
+        return hashes
+
+    @staticmethod
+    def get_file_digests(filename, algorithms=("crc32", "sha256")):
+        """
+        Calculate several digests of a file in a single read
+
+        :param filename: file path
+        :param algorithms: registered algorithm names or hashlib algorithm names
+        :return: dict of algorithm name to the digest, crc32 is a decimal string as get_crc32_checksum, others are hex
+        """
+        digests = dict()
+        for algorithm, hash_object in HashUtility.get_file_hashes(filename, algorithms).items():
+            if isinstance(hash_object, CRC32):
+                digests[algorithm] = str(hash_object._digest)
+            else:
+                digests[algorithm] = hash_object.hexdigest()
+        return digests
+
+    @staticmethod
+    def get_files_digests(filenames, algorithms=("crc32", "sha256"), workers: int = None):
+        """
+        Calculate the digests of many files concurrently in a thread pool
+
+        :param filenames: file paths
+        :param algorithms: registered algorithm names or hashlib algorithm names
+        :param workers: number of worker threads, default is the cpu count
+        :return: dict of file path to the digests returned by get_file_digests
+        """
+        filenames = list(filenames)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 1 or len(filenames) <= 1:
+            return {filename: HashUtility.get_file_digests(filename, algorithms) for filename in filenames}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda filename: HashUtility.get_file_digests(filename, algorithms), filenames)
+            return dict(zip(filenames, results))
+
     @staticmethod
     def get_crc32_checksum(filename):
         """
         Method for calculating the hash of a file. using crc32 algorithm
 
         :param filename: Name of the file to calculate the hash for.
-        :returns: Digest of the file, in hex.
+        :returns: Digest of the file, in decimal.
         """
-        crc32 = CRC32()
-        chunk_size=4096
-        with open(filename, mode="rb", buffering=0) as fp:
-            buffer = fp.read(chunk_size)
-            while len(buffer) > 0:
-                crc32.update(buffer)
-                buffer = fp.read(chunk_size)
-        return str(crc32._digest)
+        return HashUtility.get_file_digests(filename, ("crc32",))["crc32"]
         #return hex(crc32._digest).upper()[2:]  #return hex value
 
     @staticmethod
     def get_md5_checksum(filename):
         """
         Get file checksum value.
-        Note that sometimes you won't be able to fit the whole file in memory.
-        In that case, you'll have to read chunks of 4096 bytes sequentially and feed them to the Md5 function.
-        Refer to: https://stackoverflow.com/questions/3431825/generating-an-md5-checksum-of-a-file
+        The file is read in chunks, so it does not need to fit in memory.
 
         :param filename: file path
         :return: the digest value as a string of hexadecimal digits
@@ -87,11 +195,7 @@ class HashUtility(object):
             logging.error("[_get_checksum] %s cannot be read", filename)
             return -1
 
-        hash_md5 = hashlib.md5()
-        with open(filename, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return HashUtility.get_file_digests(filename, ("md5",))["md5"]
 
     @staticmethod
     def get_sha256_hash(filename):
@@ -100,9 +204,7 @@ class HashUtility(object):
         :param filename:
         :return:
         """
-        with open(filename, "rb") as f:
-            sha = hashlib.sha256(f.read()).hexdigest()
-        return sha
+        return HashUtility.get_file_digests(filename, ("sha256",))["sha256"]
 
     @staticmethod
     def get_sha1_hash(filename):
@@ -111,6 +213,4 @@ class HashUtility(object):
         :param filename:
         :return:
         """
-        with open(filename, "rb") as f:
-            sha = hashlib.sha1(f.read()).hexdigest()
-        return sha
+        return HashUtility.get_file_digests(filename, ("sha1",))["sha1"]
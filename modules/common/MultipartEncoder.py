@@ -0,0 +1,84 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import logging
+import os
+import uuid
+import zlib
+
+from requests.packages.urllib3.fields import RequestField
+
+logger = logging.getLogger(__name__)
+
+# read size of the file, the memory used by the upload does not grow with the file size
+MULTIPART_BLOCK_SIZE = 1024 * 1024
+
+
+class MultipartStream(object):
+    """
+    multipart/form-data body of a file upload, generated while it is sent instead of built in memory.
+    The parts are encoded the same as requests does for data= and files=. The file is read in blocks once per send,
+    and its crc32 can be sent as a form field after the file part, so that it is calculated in the same read.
+    The body has a known length (Content-Length) unless the checksum field is used, then it is sent with
+    chunked transfer encoding as the length of the checksum is not known before the file is read.
+    """
+
+    def __init__(self, fields: dict, file_field: str, file_path: str, checksum_field: str = None):
+        """
+        :param fields: form fields sent before the file
+        :param file_field: name of the file field
+        :param file_path: file to upload, its base name is the file name of the part
+        :param checksum_field: name of the form field of the crc32 (in decimal) of the file, sent after the file
+        """
+        self.file_path = file_path
+        self.checksum_field = checksum_field
+        self.checksum = None
+        self.boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=%s" % self.boundary
+
+        self.head = b"".join(self._encode_part(name, value) for name, value in fields.items()) + \
+            self._encode_part_header(file_field, os.path.basename(file_path))
+        self.tail = b"\r\n"
+        self.end = ("--%s--\r\n" % self.boundary).encode("latin-1")
+        self.length = None
+        if checksum_field is None:
+            self.length = len(self.head) + os.path.getsize(file_path) + len(self.tail) + len(self.end)
+
+    def _encode_part_header(self, name: str, filename: str = None):
+        field = RequestField(name = name, data = None, filename = filename)
+        field.make_multipart(content_type = None)
+        return ("--%s\r\n" % self.boundary).encode("latin-1") + field.render_headers().encode("latin-1")
+
+    def _encode_part(self, name: str, value):
+        if not isinstance(value, bytes):
+            value = str(value).encode("UTF-8")
+        return self._encode_part_header(name) + value + b"\r\n"
+
+    def __bool__(self):
+        # requests replaces a false body with {}
+        return True
+
+    def __len__(self):
+        """
+        :return: length of the body, 0 if not known so that requests uses chunked transfer encoding
+        """
+        return self.length or 0
+
+    def __iter__(self):
+        """
+        Generate the body from the beginning, a new pass reads the file again (e.g. when the request is retried)
+        :return: generator of the blocks of the body
+        """
+        yield self.head
+        checksum = 0
+        with open(self.file_path, "rb") as upload_file:
+            data = upload_file.read(MULTIPART_BLOCK_SIZE)
+            while data:
+                checksum = zlib.crc32(data, checksum)
+                yield data
+                data = upload_file.read(MULTIPART_BLOCK_SIZE)
+        self.checksum = checksum
+        yield self.tail
+        if self.checksum_field is not None:
+            yield self._encode_part(self.checksum_field, checksum)
+        yield self.end
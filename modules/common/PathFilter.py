@@ -0,0 +1,129 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import fnmatch
+import logging
+import os
+import re
+
+from common.XcalGlobals import SOURCE_CODE_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# prefix of the include/exclude pattern which is a regular expression instead of a glob pattern
+REGEX_PATTERN_PREFIX = "re:"
+
+
+class PathFilter(object):
+    """
+    Select the source code files of a project. The suffixes and the include/exclude patterns are compiled once,
+    so that the check of each file is a set lookup plus at most two regular expression matches.
+    The include/exclude patterns are glob patterns (or regular expressions with the "re:" prefix) matched against
+    the path relative to the project path, with '/' as separator.
+    """
+
+    def __init__(self, project_path: str, suffixes: list = None, include_patterns: list = None,
+                 exclude_patterns: list = None, xcalbuild_path: str = None):
+        """
+        :param project_path: project path, the files out of it are not selected
+        :param suffixes: suffixes of the source code files, default is SOURCE_CODE_SUFFIX
+        :param include_patterns: only the files match one of the patterns are selected, all files if empty
+        :param exclude_patterns: the files match one of the patterns are not selected
+        :param xcalbuild_path: the header files in xcalbuild path are owned by xcalbuild
+        """
+        self.project_path = os.path.normpath(project_path)
+        self.project_prefix = os.path.join(self.project_path, "")
+        self.xcalbuild_path = xcalbuild_path
+
+        if suffixes is None:
+            suffixes = SOURCE_CODE_SUFFIX
+        # the suffix with one dot is looked up by the extension of the file name, others fall back to endswith
+        self.suffix_set = set(suffix for suffix in suffixes if suffix.count('.') == 1 and suffix.startswith('.'))
+        self.other_suffixes = tuple(suffix for suffix in suffixes if suffix not in self.suffix_set)
+
+        self.include_regex = self._compile_patterns(include_patterns)
+        self.exclude_regex = self._compile_patterns(exclude_patterns)
+
+    @staticmethod
+    def _compile_patterns(patterns: list):
+        """
+        :param patterns: glob patterns, or regular expressions start with REGEX_PATTERN_PREFIX
+        :return: one compiled regular expression matches any of the patterns, None if no pattern
+        """
+        if not patterns:
+            return None
+        if isinstance(patterns, str):
+            patterns = [patterns]
+
+        regex_list = []
+        for pattern in patterns:
+            if pattern.startswith(REGEX_PATTERN_PREFIX):
+                regex_list.append(pattern[len(REGEX_PATTERN_PREFIX):])
+            else:
+                regex_list.append(fnmatch.translate(pattern))
+        logger.debug("compile path patterns: %s" % patterns)
+        return re.compile("|".join("(?:%s)" % regex for regex in regex_list))
+
+    def has_source_suffix(self, filename: str):
+        """
+        :param filename: file name or file path
+        :return: True if the file has one of the source code suffixes
+        """
+        index = filename.rfind('.')
+        if index >= 0 and filename[index:] in self.suffix_set:
+            return True
+        return len(self.other_suffixes) > 0 and filename.endswith(self.other_suffixes)
+
+    def is_under_project(self, path: str):
+        """
+        :param path: normalized absolute path
+        :return: True if the path is the project path or in it
+        """
+        return path == self.project_path or path.startswith(self.project_prefix)
+
+    def get_relative_path(self, path: str):
+        """
+        same as os.path.relpath for the normalized absolute path in the project path, without walking the components
+        :param path: normalized absolute path in the project path
+        :return: path relative to the project path
+        """
+        if path == self.project_path:
+            return os.curdir
+        if path.startswith(self.project_prefix):
+            return path[len(self.project_prefix):]
+        return os.path.relpath(path, self.project_path)
+
+    def in_xcalbuild_path(self, path: str):
+        """
+        :param path: directory or file path
+        :return: True if the path is in the xcalbuild path
+        """
+        return self.xcalbuild_path is not None and self.xcalbuild_path in path
+
+    def is_xcalbuild_header(self, path: str):
+        """
+        :param path: file path
+        :return: True if the file is a header file owned by xcalbuild
+        """
+        return path.endswith(".h") and self.in_xcalbuild_path(path)
+
+    def match_patterns(self, relative_path: str):
+        """
+        :param relative_path: file path relative to the project path
+        :return: True if the file is selected by the include/exclude patterns
+        """
+        if self.include_regex is None and self.exclude_regex is None:
+            return True
+        if os.sep != '/':
+            relative_path = relative_path.replace(os.sep, '/')
+        if self.include_regex is not None and self.include_regex.match(relative_path) is None:
+            return False
+        return self.exclude_regex is None or self.exclude_regex.match(relative_path) is None
+
+    def is_source_file(self, filename: str, relative_path: str):
+        """
+        :param filename: file name
+        :param relative_path: file path relative to the project path
+        :return: True if the file is a source code file selected by the filter
+        """
+        return self.has_source_suffix(filename) and self.match_patterns(relative_path)
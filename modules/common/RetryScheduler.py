@@ -0,0 +1,257 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import logging
+import random
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# the status codes retried, the authentication errors (401/403) are never retried
+RETRY_STATUS_CODES = (429, 494, 500, 502, 503, 504)
+# an endpoint is opened (calls fail fast) after this number of consecutive failed attempts, for the reset timeout
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised without sending the request when the circuit of the endpoint is open
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of an endpoint. It is opened after failure_threshold consecutive failures, no call is sent while
+    it is open. After reset_timeout one trial call is let through (half open), the circuit is closed again if it
+    succeeds, otherwise it is opened for another reset_timeout. The other calls wait for the trial instead of
+    failing fast, as long as their deadline allows.
+    """
+
+    def __init__(self, failure_threshold: int = None, reset_timeout: float = None):
+        self.failure_threshold = CIRCUIT_FAILURE_THRESHOLD if failure_threshold is None else int(failure_threshold)
+        self.reset_timeout = CIRCUIT_RESET_TIMEOUT if reset_timeout is None else float(reset_timeout)
+        self.failure_count = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.condition = threading.Condition()
+
+    def allow(self, timeout: float = 0):
+        """
+        Wait until the call can be sent, i.e. the circuit is closed or the call is the trial of the half open circuit
+        :param timeout: max seconds to wait, wait until the call can be sent if None
+        :return: True if the call can be sent, False if it still cannot after the timeout
+        """
+        end_time = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.opened_at is None:
+                    return True
+                wait = None     # until the running trial ends
+                if not self.trial_running:
+                    wait = self.opened_at + self.reset_timeout - time.monotonic()
+                    if wait <= 0:
+                        self.trial_running = True
+                        return True
+                if end_time is not None:
+                    remaining = end_time - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.condition.wait(wait)
+
+    def is_open(self):
+        """
+        :return: True if no call is sent (or only the trial call is let through)
+        """
+        with self.condition:
+            return self.opened_at is not None
+
+    def record_success(self):
+        with self.condition:
+            self.failure_count = 0
+            self.opened_at = None
+            self.trial_running = False
+            self.condition.notify_all()
+
+    def record_failure(self):
+        """
+        :return: True if the circuit is opened by this failure
+        """
+        with self.condition:
+            self.failure_count += 1
+            was_closed = self.opened_at is None
+            if self.trial_running or self.failure_count >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trial_running = False
+                self.condition.notify_all()
+                return was_closed
+            return False
+
+    def record_throttled(self):
+        """
+        The endpoint asks to retry later (429 with Retry-After), it is up so it is not a failure, nor a success
+        :return: None
+        """
+        with self.condition:
+            if self.trial_running:
+                # let the next waiting call try again
+                self.trial_running = False
+                self.condition.notify_all()
+
+
+class RetryScheduler(object):
+    """
+    Send the requests with retries bounded by a deadline per call. The attempts are spaced by exponential backoff
+    with full jitter, never longer than the time left before the deadline. The authentication errors and the other
+    client errors are returned at once. Each endpoint has a circuit breaker, and the retries are counted per endpoint.
+    A call waits for the circuit of its endpoint while it is open, and fails only when the wait exceeds its deadline.
+    A 429 with Retry-After is retried after the time asked, it is not counted as a failure of the endpoint.
+    A policy is a dict with:
+        retry: max number of retries
+        backoff: backoff of the first retry in seconds, doubled by each retry
+        maxBackoff: max backoff in seconds
+        deadline: seconds a call may take including the retries, no deadline if None
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breakers = dict()
+        self.metrics = dict()
+
+    def get_breaker(self, endpoint: str):
+        with self.lock:
+            breaker = self.breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker()
+                self.breakers[endpoint] = breaker
+            return breaker
+
+    def _count(self, endpoint: str, name: str):
+        with self.lock:
+            counters = self.metrics.setdefault(endpoint, {"calls": 0, "attempts": 0, "retries": 0, "failures": 0,
+                                                          "rejected": 0, "circuitOpened": 0})
+            counters[name] += 1
+
+    def get_metrics(self):
+        """
+        :return: dict of endpoint to the counters of calls, attempts, retries, failures, rejected and circuitOpened
+        """
+        with self.lock:
+            return {endpoint: dict(counters) for endpoint, counters in self.metrics.items()}
+
+    @staticmethod
+    def is_retryable(response):
+        """
+        :param response: response of the attempt
+        :return: True if the request should be retried
+        """
+        return response.status_code in RETRY_STATUS_CODES
+
+    @staticmethod
+    def is_throttled(response):
+        """
+        :param response: response of the attempt, None if it failed to connect
+        :return: True if the server asks to retry later, which is not a failure of the endpoint
+        """
+        return response is not None and response.status_code == 429 and response.headers.get("Retry-After") is not None
+
+    @staticmethod
+    def get_backoff(policy: dict, retry_count: int, response=None):
+        """
+        :param policy: retry policy
+        :param retry_count: number of the retry, start from 1
+        :param response: response of the failed attempt, its Retry-After is followed
+        :return: seconds to wait before the retry
+        """
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                return float(retry_after)
+        backoff = min(float(policy.get("maxBackoff", 60)), float(policy.get("backoff", 1)) * (2 ** (retry_count - 1)))
+        return random.uniform(0, backoff)
+
+    def call(self, endpoint: str, send, policy: dict, timeout=None):
+        """
+        Send the request with retries
+        :param endpoint: name of the endpoint, used by the circuit breaker and the metrics
+        :param send: called as send(timeout) to send the request, returns the response
+        :param policy: retry policy
+        :param timeout: timeout of an attempt, a number or (connect, read) in seconds, bounded by the deadline.
+                        no timeout if None, the deadline only bounds the retries then
+        :return: the response of the last attempt
+        """
+        breaker = self.get_breaker(endpoint)
+        self._count(endpoint, "calls")
+        max_retry = int(policy.get("retry", 0))
+        deadline = policy.get("deadline")
+        if deadline is not None:
+            deadline = time.monotonic() + float(deadline)
+
+        retry_count = 0
+        while True:
+            if not breaker.allow(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                self._count(endpoint, "rejected")
+                raise CircuitOpenError("circuit of %s is open after %d failures" % (endpoint, breaker.failure_count))
+
+            self._count(endpoint, "attempts")
+            response = None
+            error = None
+            try:
+                response = send(RetryScheduler._bound_timeout(timeout, deadline))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                error = err
+            except Exception:
+                # not retried, but the trial call of a half open circuit must be ended
+                breaker.record_failure()
+                raise
+
+            if error is None and not RetryScheduler.is_retryable(response):
+                # the client errors (e.g. 401/403) are not failures of the endpoint, and not retried either
+                breaker.record_success()
+                return response
+
+            if RetryScheduler.is_throttled(response):
+                breaker.record_throttled()
+            elif breaker.record_failure():
+                self._count(endpoint, "circuitOpened")
+                logger.warning("circuit of %s is opened" % endpoint)
+
+            retry_count += 1
+            backoff = RetryScheduler.get_backoff(policy, retry_count, response)
+            remaining = None if deadline is None else deadline - time.monotonic()
+            # an open circuit is waited for by the next attempt
+            if retry_count > max_retry or (remaining is not None and remaining <= backoff):
+                self._count(endpoint, "failures")
+                logger.warning("%s failed after %d attempts: %s" %
+                               (endpoint, retry_count, error if error is not None else response.status_code))
+                if error is not None:
+                    raise error
+                return response
+
+            self._count(endpoint, "retries")
+            logger.info("retry %s in %.1f seconds (%d/%d): %s" %
+                        (endpoint, backoff, retry_count, max_retry, error if error is not None else response.status_code))
+            if response is not None:
+                response.close()
+            time.sleep(backoff)
+
+    @staticmethod
+    def _bound_timeout(timeout, deadline):
+        """
+        :param timeout: timeout of an attempt, a number or (connect, read) in seconds, or None
+        :param deadline: monotonic time of the deadline, or None
+        :return: the timeout not beyond the deadline, None if no timeout
+        """
+        if deadline is None or timeout is None:
+            return timeout
+        remaining = max(0.001, deadline - time.monotonic())
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return min(connect, remaining) if connect is not None else remaining, \
+                min(read, remaining) if read is not None else remaining
+        return min(float(timeout), remaining)
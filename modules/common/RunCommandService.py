@@ -1,11 +1,117 @@
+import gzip
 import logging
 import os
+import select
+import shutil
+import signal
 import subprocess
+import sys
 import tempfile
+import threading
+import time
+from collections import deque
+
+try:
+    import psutil
+except ImportError:
+    # only needed to sample the cpu/rss of the commands run by run_command
+    psutil = None
 
 
 logger = logging.getLogger(__name__)
 
+# the log file is rotated once it grows beyond it, the rotated files are compressed as <log file>.<n>.gz
+COMMAND_LOG_MAX_SIZE = 100 * 1024 * 1024
+COMMAND_LOG_BACKUP_COUNT = 5
+# number of the last output lines kept in memory for the error report
+COMMAND_TAIL_LINES = 200
+# seconds between two cpu/rss samples of the process tree, and max number of samples kept
+COMMAND_SAMPLE_INTERVAL = 5.0
+COMMAND_SAMPLE_MAX_COUNT = 2000
+# seconds to wait for the process group to exit after SIGTERM before it is killed
+COMMAND_KILL_GRACE_PERIOD = 10.0
+# seconds the output pipes are still read after the command exits, as its background processes may hold them open
+COMMAND_OUTPUT_DRAIN_TIMEOUT = COMMAND_KILL_GRACE_PERIOD
+# seconds between two checks of the readers whether they should stop reading the pipes
+COMMAND_PIPE_POLL_INTERVAL = 0.5
+
+
+class RotatingLogWriter(object):
+    """
+    Append the output of the commands to the log file, the file is rotated and compressed when it exceeds max_size.
+    The writes from several pump threads are serialized by a lock.
+    """
+
+    def __init__(self, path: str, max_size: int = None, backup_count: int = None):
+        """
+        :param path: log file path
+        :param max_size: size in bytes the file is rotated beyond, never rotated if 0
+        :param backup_count: number of the rotated files kept
+        """
+        self.path = path
+        self.max_size = COMMAND_LOG_MAX_SIZE if max_size is None else int(max_size)
+        self.backup_count = COMMAND_LOG_BACKUP_COUNT if backup_count is None else int(backup_count)
+        self.lock = threading.Lock()
+        self.file = open(path, "a+b")
+        self.size = self.file.tell()
+
+    def write(self, data: bytes):
+        """
+        :param data: bytes appended to the log
+        :return: None
+        """
+        with self.lock:
+            if self.file.closed:
+                # the output of the detached readers after the command is done
+                return
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
+            if 0 < self.max_size < self.size:
+                self._rotate()
+
+    def _rotate(self):
+        """
+        Shift the rotated files and compress the current log file as the first of them
+        :return: None
+        """
+        self.file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            rotated_path = "%s.%d.gz" % (self.path, index)
+            if os.path.exists(rotated_path):
+                os.replace(rotated_path, "%s.%d.gz" % (self.path, index + 1))
+        if self.backup_count > 0:
+            with open(self.path, "rb") as log_file, gzip.open("%s.1.gz" % self.path, "wb") as rotated_file:
+                shutil.copyfileobj(log_file, rotated_file)
+        self.file = open(self.path, "w+b")
+        self.size = 0
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class CommandResult(object):
+    """
+    Result of a command run by ExecuteCommandService.run_command
+    """
+
+    def __init__(self):
+        self.returncode = None
+        self.timed_out = False
+        # last lines of the output
+        self.tail = deque(maxlen=COMMAND_TAIL_LINES)
+        # list of (seconds since the start, number of processes, cpu seconds, rss bytes) of the process tree
+        self.samples = deque(maxlen=COMMAND_SAMPLE_MAX_COUNT)
+        # pid -> [process name, cpu seconds, peak rss bytes]
+        self.processes = dict()
+
+    def get_tail(self):
+        """
+        :return: the last lines of the output as a string
+        """
+        return "".join(self.tail)
+
 
 class ExecuteCommandService(object):
 
@@ -54,3 +160,236 @@ class ExecuteCommandService(object):
 
         logger.debug("command return code: %s" % rc)
         return rc
+
+    @staticmethod
+    def run_command(command: str, logfile: str = None, environment: dict = None, timeout: float = None,
+                    max_log_size: int = None, sample_interval: float = None, echo: bool = True):
+        """
+        Invoke the shell to execute command, the stdout and stderr are streamed into the log file while it runs.
+        Unlike execute_command, the command runs in its own session so that it can be killed as a whole on timeout,
+        and its process tree is sampled if psutil is installed
+        :param command: command line to execute
+        :param logfile: file name to the log file of the process, a temporary file is used if None
+        :param environment: environment variables to pass down
+        :param timeout: seconds before the whole process group is killed, no limit if None
+        :param max_log_size: size in bytes the log file is rotated beyond, never rotated if 0
+        :param sample_interval: seconds between two cpu/rss samples, no sample if 0
+        :param echo: also write the output to the stdout/stderr of this process, as the output was not captured before
+        :return: CommandResult
+        """
+        logger.info("begin to run command: %s" % command)
+
+        if environment is None:
+            environment = dict(os.environ)
+
+        tempfile_used = False
+        if logfile is None:
+            local_temp_file = tempfile.NamedTemporaryFile(mode="w+b")
+            logfile = local_temp_file.name
+            tempfile_used = True
+
+        logger.info("dump to file: %s" % logfile)
+
+        result = CommandResult()
+        log_writer = RotatingLogWriter(logfile, max_log_size)
+        try:
+            log_writer.write("\n---- execution command ------ \n".encode("UTF-8"))
+            log_writer.write(str(command).encode("UTF-8"))
+            log_writer.write(("\n----- saving dump to file -----\n" + logfile).encode("UTF-8"))
+            log_writer.write("\n----- environment: -----\n".encode("UTF-8"))
+            log_writer.write(str(environment).encode("UTF-8"))
+            log_writer.write("\n-------------------\n".encode("UTF-8"))
+
+            # Invoking Process --------------------------
+            # in its own process group on posix, so that the whole build is killed on timeout
+            process = subprocess.Popen(command, shell = True, env = environment, stdout = subprocess.PIPE,
+                                       stderr = subprocess.PIPE, start_new_session = (os.name == "posix"))
+            start_time = time.time()
+            stop_event = threading.Event()
+            detach_event = threading.Event()
+            pump_threads = [threading.Thread(target = ExecuteCommandService._pump_output,
+                                             args = (process.stdout, log_writer, result, sys.stdout if echo else None,
+                                                     detach_event)),
+                            threading.Thread(target = ExecuteCommandService._pump_output,
+                                             args = (process.stderr, log_writer, result, sys.stderr if echo else None,
+                                                     detach_event))]
+            threads = list(pump_threads)
+            sample_interval = COMMAND_SAMPLE_INTERVAL if sample_interval is None else float(sample_interval)
+            if sample_interval > 0 and psutil is not None:
+                threads.append(threading.Thread(target = ExecuteCommandService._sample_process,
+                                                args = (process.pid, result, sample_interval, start_time, stop_event)))
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+
+            try:
+                process.wait(timeout = timeout)
+            except subprocess.TimeoutExpired:
+                result.timed_out = True
+                logger.error("command timeout after %s seconds, kill it: %s" % (timeout, command))
+                ExecuteCommandService._kill_process(process)
+            stop_event.set()
+            # the background processes of the command (e.g. a daemon started by the build) inherit the pipes and may
+            # hold them open long after it exits, the rest of the output is only read for a bounded time
+            drain_deadline = time.time() + COMMAND_OUTPUT_DRAIN_TIMEOUT
+            for thread in threads:
+                thread.join(max(0.0, drain_deadline - time.time()))
+            pipes_held = any(thread.is_alive() for thread in pump_threads)
+            if pipes_held:
+                logger.warning("output pipes are still held by the background processes %s seconds after the command "
+                               "exits, stop reading them: %s" % (COMMAND_OUTPUT_DRAIN_TIMEOUT, command))
+                # the readers close the pipes once they stop
+                detach_event.set()
+                for thread in pump_threads:
+                    thread.join(COMMAND_PIPE_POLL_INTERVAL * 2)
+
+            rc = process.returncode
+            result.returncode = rc
+            log_writer.write("\n-------------------\n".encode("UTF-8"))
+            if pipes_held:
+                log_writer.write(("output pipes still held by the background processes after %s seconds, "
+                                  "the rest of their output is not logged\n" % COMMAND_OUTPUT_DRAIN_TIMEOUT).encode("UTF-8"))
+            if result.timed_out:
+                log_writer.write(("command timeout after %s seconds\n" % timeout).encode("UTF-8"))
+            log_writer.write(("command return code: %s, elapsed: %.1f seconds\n" % (rc, time.time() - start_time)).encode("UTF-8"))
+            log_writer.write(ExecuteCommandService._format_profile(result).encode("UTF-8"))
+        finally:
+            log_writer.close()
+
+        if tempfile_used:
+            local_temp_file.close()
+
+        logger.debug("command return code: %s" % rc)
+        return result
+
+    @staticmethod
+    def _pump_output(stream, log_writer: RotatingLogWriter, result: CommandResult, echo_stream=None,
+                     detach_event: threading.Event = None):
+        """
+        Copy the output of the process line by line into the log, until the stream is closed or the reader is detached
+        :param stream: stdout or stderr pipe of the process
+        :param log_writer: log of the command
+        :param result: the last lines are kept in its tail
+        :param echo_stream: text stream the output is also written to, None if not echoed
+        :param detach_event: set to stop reading the stream even if it is not closed, the stream is closed then
+        :return: None
+        """
+        with stream:
+            for line in ExecuteCommandService._read_lines(stream, detach_event):
+                log_writer.write(line)
+                text = line.decode("UTF-8", errors = "ignore")
+                result.tail.append(text)
+                if echo_stream is not None:
+                    echo_stream.write(text)
+                    echo_stream.flush()
+
+    @staticmethod
+    def _read_lines(stream, detach_event: threading.Event = None):
+        """
+        :param stream: stdout or stderr pipe of the process
+        :param detach_event: set to stop reading, checked every COMMAND_PIPE_POLL_INTERVAL
+        :return: generator of the lines read from the stream, until it is closed or the detach event is set
+        """
+        if os.name != "posix" or detach_event is None:
+            # select does not work on the pipes on Windows, the reader is only stopped by closing the stream
+            yield from iter(stream.readline, b"")
+            return
+
+        fd = stream.fileno()
+        pending = b""
+        while not detach_event.is_set():
+            ready, _, _ = select.select([fd], [], [], COMMAND_PIPE_POLL_INTERVAL)
+            if len(ready) == 0:
+                continue
+            data = os.read(fd, 64 * 1024)
+            if len(data) == 0:
+                break
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+        if len(pending) > 0:
+            yield pending
+
+    @staticmethod
+    def _sample_process(pid: int, result: CommandResult, interval: float, start_time: float, stop_event: threading.Event):
+        """
+        Sample the cpu time and rss of the process and its children until the stop event is set
+        :param pid: pid of the shell running the command
+        :param result: the samples are saved in it
+        :param interval: seconds between two samples
+        :param start_time: time the process started
+        :param stop_event: set when the process exits
+        :return: None
+        """
+        try:
+            root = psutil.Process(pid)
+        except psutil.Error:
+            return
+
+        while not stop_event.wait(interval):
+            try:
+                processes = [root] + root.children(recursive = True)
+            except psutil.Error:
+                return
+
+            cpu_total = 0.0
+            rss_total = 0
+            for process in processes:
+                try:
+                    with process.oneshot():
+                        cpu_times = process.cpu_times()
+                        cpu = cpu_times.user + cpu_times.system
+                        rss = process.memory_info().rss
+                        name = process.name()
+                except psutil.Error:
+                    # the process exits during the sample
+                    continue
+                cpu_total += cpu
+                rss_total += rss
+                info = result.processes.setdefault(process.pid, [name, 0.0, 0])
+                info[1] = max(info[1], cpu)
+                info[2] = max(info[2], rss)
+            result.samples.append((round(time.time() - start_time, 1), len(processes), round(cpu_total, 2), rss_total))
+
+    @staticmethod
+    def _kill_process(process: subprocess.Popen):
+        """
+        Terminate the process group of the process, kill it if not exit in the grace period
+        :param process: process started in its own process group
+        :return: None
+        """
+        if os.name != "posix":
+            process.kill()
+            process.wait()
+            return
+
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout = COMMAND_KILL_GRACE_PERIOD)
+        except subprocess.TimeoutExpired:
+            logger.warning("command not exit after SIGTERM, kill it. pid: %d" % process.pid)
+        except ProcessLookupError:
+            pass
+        try:
+            # the children may be still running even if the shell exits
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+    @staticmethod
+    def _format_profile(result: CommandResult, top: int = 10):
+        """
+        :param result: result of the command
+        :param top: number of the processes listed
+        :return: summary of the cpu/rss samples written to the log
+        """
+        if len(result.samples) == 0:
+            return ""
+
+        lines = ["----- profile: %d samples, peak rss: %.1fM -----" %
+                 (len(result.samples), max(sample[3] for sample in result.samples) / 1024 / 1024)]
+        for pid, (name, cpu, rss) in sorted(result.processes.items(), key = lambda item: item[1][1], reverse = True)[:top]:
+            lines.append("pid: %d, name: %s, cpu: %.2fs, peak rss: %.1fM" % (pid, name, cpu, rss / 1024 / 1024))
+        return "\n".join(lines) + "\n"
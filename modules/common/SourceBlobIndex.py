@@ -0,0 +1,114 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import json
+import logging
+import os
+import threading
+import time
+
+from common.CommonGlobals import SOURCE_BLOB_INDEX_FILE_NAME
+from common.XcalFileUtility import FilePathResolver
+
+logger = logging.getLogger(__name__)
+
+# uploaded blobs older than it are not reused, the file service expires the uploaded objects after 7 days by default
+DEFAULT_EXPIRE_DAYS = 6
+
+
+class SourceBlobIndex(object):
+    """
+    Index of the source code blobs already uploaded to the file service, keyed by the sha256 of the file content.
+    Each blob is stored in a blob pack (a zip file whose members are named by the sha256), the index records
+    which pack holds the blob and when the pack was uploaded. The index is a json file kept in the folder shared
+    by the scans of the project, it is only updated after the pack is uploaded and saved in the file cache of
+    the server. The index is only a hint, a blob is reused only if the file cache of the server confirms its pack,
+    each pack is asked once.
+    """
+
+    def __init__(self, index_path: str, expire_days: float = None, file_cache = None):
+        """
+        :param index_path: path of the index json file, it is fine if not exists
+        :param expire_days: the blobs uploaded before it are treated as not uploaded
+        :param file_cache: SourceFileCache of the server, no blob is reused if None
+        """
+        self.index_path = index_path
+        self.expire_days = DEFAULT_EXPIRE_DAYS if expire_days is None else float(expire_days)
+        self.file_cache = file_cache
+        self.blobs = dict()     # sha256 -> [pack name, upload time]
+        self.confirmed_packs = dict()     # pack name -> True if confirmed by the file cache
+        self.lock = threading.Lock()
+
+        if os.path.exists(index_path):
+            try:
+                with open(index_path) as index_file:
+                    self.blobs = json.load(index_file)
+            except (OSError, ValueError) as err:
+                logger.warning("cannot load source blob index %s, ignore it: %s" % (index_path, err))
+
+        expire_time = time.time() - self.expire_days * 24 * 3600
+        self.blobs = {sha256: blob for sha256, blob in self.blobs.items() if blob[1] >= expire_time}
+        logger.debug("%d uploaded source blobs in index %s" % (len(self.blobs), index_path))
+
+    @staticmethod
+    def get_index_path(output_path: str):
+        """
+        :param output_path: output path of the scan
+        :return: path of the index, in the parent of the output path which is shared by the scans of the project
+        """
+        return FilePathResolver.get_scan_cache_path(output_path, SOURCE_BLOB_INDEX_FILE_NAME)
+
+    def get_pack(self, sha256: str):
+        """
+        The pack of the blob is asked to the file cache at the first call for the pack, the answer is kept for the
+        other blobs of the pack. It is called by the threads reading the files
+        :param sha256: sha256 of the file content
+        :return: name of the uploaded blob pack which holds the blob, None if not uploaded or not confirmed
+        """
+        blob = self.blobs.get(sha256)
+        if blob is None or self.file_cache is None:
+            return None
+
+        pack = blob[0]
+        with self.lock:
+            if pack not in self.confirmed_packs:
+                self.confirmed_packs[pack] = self.file_cache.confirm_pack(pack)
+                if not self.confirmed_packs[pack]:
+                    logger.debug("source blob pack %s is not confirmed by the file cache" % pack)
+            return pack if self.confirmed_packs[pack] else None
+
+    @staticmethod
+    def get_manifest_blobs(manifest: dict):
+        """
+        :param manifest: manifest written by CompressionUtility.get_dedup_archive
+        :return: list of sha256 of the blobs in the new pack of the manifest
+        """
+        pack = manifest.get("pack")
+        if pack is None:
+            return []
+        return list(dict.fromkeys(file_info["sha256"] for file_info in manifest.get("files", [])
+                                  if file_info.get("pack") == pack))
+
+    def add_blobs(self, blobs: list, pack: str, upload_time: float = None):
+        """
+        Record the blobs of a pack after the pack is uploaded and saved in the file cache
+        :param blobs: sha256 of the blobs
+        :param pack: name of the uploaded blob pack
+        :param upload_time: time the pack is uploaded, default is now
+        :return: number of blobs added
+        """
+        if upload_time is None:
+            upload_time = time.time()
+        for sha256 in blobs:
+            self.blobs[sha256] = [pack, upload_time]
+        return len(blobs)
+
+    def save(self):
+        """
+        Write the index, the index file is replaced at once so that it is never half written
+        :return: None
+        """
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as index_file:
+            json.dump(self.blobs, index_file, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
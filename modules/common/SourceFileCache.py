@@ -0,0 +1,76 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import copy
+import hashlib
+import logging
+
+from common.XcalConnect import Connector
+from common.XcalException import XcalException
+from common.XcalGlobals import DEFAULT_CONFIG
+from common.XcalLogger import XcalLogger
+
+logger = logging.getLogger(__name__)
+
+
+class SourceFileCache(object):
+    """
+    File cache of the server (checkFileCacheApi/saveFileCacheApi), which records the blob packs uploaded.
+    A pack is saved once under its pack key after it is uploaded, and the blobs of the pack are only treated as
+    uploaded when the server confirms the pack, the local SourceBlobIndex only tells which pack holds a blob.
+    So there is one request per pack, however many blobs it holds.
+    """
+    def __init__(self, api_server_url: str, token: str, scan_task_id: str = None):
+        """
+        :param api_server_url: url of the api server, e.g. http://127.0.0.1:80
+        :param token: token of the api server
+        :param scan_task_id: id of the scan task, sent with the requests
+        """
+        api_server = copy.deepcopy(DEFAULT_CONFIG["API_SERVER"])
+        api_server["URL"] = api_server_url.rstrip("/")
+        self.connector = Connector(XcalLogger("SourceFileCache", "__init__"), api_server)
+        self.job_config = {"taskConfig": {"token": token, "scanTaskId": scan_task_id}}
+
+    @staticmethod
+    def from_config(project_conf: dict):
+        """
+        :param project_conf: project config, with apiServerUrl and taskConfig.token
+        :return: SourceFileCache, None if the api server is not configured
+        """
+        task_config = project_conf.get("taskConfig") or dict()
+        if not project_conf.get("apiServerUrl") or not task_config.get("token"):
+            return None
+        return SourceFileCache(project_conf.get("apiServerUrl"), task_config.get("token"), task_config.get("scanTaskId"))
+
+    @staticmethod
+    def get_pack_key(pack: str):
+        """
+        :param pack: name of the blob pack, which is unique
+        :return: key of the pack in the file cache
+        """
+        return hashlib.sha256(("source_blob_pack:%s" % pack).encode("UTF-8")).hexdigest()
+
+    def confirm_pack(self, pack: str):
+        """
+        :param pack: name of the blob pack
+        :return: True if the file cache has the pack
+        """
+        try:
+            result = self.connector.check_java_rt_file(None, self.job_config, None, SourceFileCache.get_pack_key(pack))
+        except XcalException as err:
+            logger.warning("cannot check source blob pack %s in the file cache: %s" % (pack, err))
+            return False
+        return isinstance(result, dict) and result.get("fileId") == pack
+
+    def save_pack(self, pack: str):
+        """
+        Record an uploaded pack in the file cache
+        :param pack: name of the uploaded blob pack
+        :return: True if the pack is recorded
+        """
+        try:
+            self.connector.save_file_cache(None, self.job_config, None, SourceFileCache.get_pack_key(pack), pack)
+        except Exception as err:
+            logger.warning("cannot save source blob pack %s in the file cache: %s" % (pack, err))
+            return False
+        return True
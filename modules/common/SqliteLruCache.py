@@ -0,0 +1,80 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteLruCache(object):
+    """
+    Base of the persistent caches stored in a sqlite database, whose least recently used entries are evicted when the
+    cache is closed. Every open of the cache is one generation, the entries record the generation they are last used
+    in as the timestamp of the eviction.
+    Subclasses create their tables in create_tables, and remove the exceeded entries in evict.
+    """
+
+    def __init__(self, cache_path: str):
+        """
+        :param cache_path: path of the sqlite database file, created if not exists
+        """
+        self.cache_path = cache_path
+        self.hit_count = 0
+        self.miss_count = 0
+
+        self.conn = sqlite3.connect(cache_path)
+        self.create_tables()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        self.generation = (row[0] if row is not None else 0) + 1
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (self.generation,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def create_tables(self):
+        """
+        Create the tables of the cache if not exist
+        :return: None
+        """
+        raise NotImplementedError
+
+    def evict(self):
+        """
+        Remove the least recently used entries beyond the limit of the cache
+        :return: number of entries removed
+        """
+        raise NotImplementedError
+
+    def touch(self, table: str, key_column: str, key):
+        """
+        Mark the entry as used in the current generation
+        :param table: table of the entry
+        :param key_column: primary key column of the table
+        :param key: key of the entry
+        :return: None
+        """
+        self.conn.execute("UPDATE %s SET last_used = ? WHERE %s = ?" % (table, key_column), (self.generation, key))
+
+    def get_stats(self):
+        """
+        :return: str of the counters logged when the cache is closed
+        """
+        return "%s hit: %d, miss: %d" % (self.cache_path, self.hit_count, self.miss_count)
+
+    def close(self):
+        """
+        Evict the exceeded entries, commit and close the database
+        :return: None
+        """
+        if self.conn is None:
+            return
+        self.evict()
+        self.conn.commit()
+        self.conn.close()
+        self.conn = None
+        logger.info(self.get_stats())
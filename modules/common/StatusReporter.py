@@ -0,0 +1,172 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+import copy
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# seconds the queued status updates wait before they are sent, unless a terminal status flushes them
+STATUS_FLUSH_INTERVAL = 2.0
+# the fields sent in every status update, the other fields are only sent when changed since the last update
+STATUS_KEY_FIELDS = ("taskConfig", "agentInfo", "errorInfo", "target", "progress", "stage", "status", "message")
+# times a progress update is sent before it is dropped, a failed update is sent again after the flush interval
+STATUS_SEND_ATTEMPTS = 3
+# seconds the queued status updates are waited for when the process exits
+STATUS_CLOSE_TIMEOUT = 10.0
+
+
+class StatusUpdate(object):
+    """
+    A queued status update of a task
+    """
+
+    def __init__(self, task_id, payload: dict, wait: bool, full: bool = False):
+        self.task_id = task_id
+        self.payload = payload
+        self.event = threading.Event() if wait else None
+        self.full = full
+        self.result = None
+        self.attempts = 0
+
+    def can_coalesce(self, other):
+        """
+        :param other: the update queued after this one
+        :return: True if this update can be replaced by the other one, both are progress of the same task and stage
+        """
+        return self.event is None and other.task_id == self.task_id \
+            and self.payload.get("target") == other.payload.get("target") == "progress" \
+            and self.payload.get("stage") == other.payload.get("stage") \
+            and self.payload.get("status") == other.payload.get("status")
+
+
+class StatusReporter(object):
+    """
+    Send the status updates of the tasks in a background thread, so that the job pipeline does not wait on the
+    network. The queued updates are sent every flush interval, or at once when an update waits for its result
+    (e.g. the terminal status). The consecutive progress updates of the same task and stage are coalesced into the
+    last one, and only the fields changed since the last update sent for the task are sent besides the key fields,
+    unless the update is full (e.g. the terminal status and the result), which is always sent as a whole. An update
+    is only taken as sent if send does not raise. A failed progress update is sent again after the flush interval,
+    unless a later update of the task is queued, which carries the changed fields of the failed one too.
+    """
+
+    def __init__(self, send, flush_interval: float = None):
+        """
+        :param send: called as send(payload) in the background thread, returns the result of the update and raises
+                     if the update is not delivered
+        :param flush_interval: seconds the updates wait before they are sent
+        """
+        self.send = send
+        self.flush_interval = STATUS_FLUSH_INTERVAL if flush_interval is None else float(flush_interval)
+        self.queue = deque()
+        self.last_sent = dict()
+        self.flush_requested = False
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="StatusReporter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, task_id, payload: dict, wait: bool = False, timeout: float = None, full: bool = False):
+        """
+        Queue a status update, the payload is copied so that the caller can keep changing it
+        :param task_id: id of the task, the updates are coalesced and compared per task
+        :param payload: status update
+        :param wait: flush the queue and wait for the update to be sent
+        :param timeout: seconds to wait for the update, no limit if None
+        :param full: send the whole payload instead of the fields changed since the last update
+        :return: result of send if wait, otherwise None
+        """
+        update = StatusUpdate(task_id, copy.deepcopy(payload), wait, full)
+        with self.condition:
+            if self.closed:
+                logger.warning("status reporter is closed, drop the update of task %s" % task_id)
+                return None
+            if len(self.queue) > 0 and self.queue[-1].can_coalesce(update):
+                self.queue[-1] = update
+            else:
+                self.queue.append(update)
+            # the other updates are sent by the timer, so that the progress updates can be coalesced
+            if wait:
+                self.flush_requested = True
+                self.condition.notify_all()
+
+        if not wait:
+            return None
+        if not update.event.wait(timeout):
+            logger.warning("status update of task %s is not sent in %s seconds" % (task_id, timeout))
+        return update.result
+
+    def flush(self, timeout: float = None):
+        """
+        Send the queued updates and wait for them
+        :param timeout: seconds to wait, no limit if None
+        :return: None
+        """
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: len(self.queue) == 0 and not self.flush_requested, timeout)
+
+    def close(self, timeout: float = None):
+        """
+        Send the queued updates and stop the background thread
+        :param timeout: seconds to wait, no limit if None
+        :return: None
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def _get_changed_fields(self, update: StatusUpdate):
+        """
+        :param update: status update to send
+        :return: the payload with the key fields and the fields changed since the last update sent for the task,
+                 the whole payload if the update is full
+        """
+        last_payload = self.last_sent.get(update.task_id)
+        if last_payload is None or update.full:
+            return update.payload
+        return {key: value for key, value in update.payload.items()
+                if key in STATUS_KEY_FIELDS or key not in last_payload or last_payload[key] != value}
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.closed and not self.flush_requested:
+                    self.condition.wait(self.flush_interval)
+                if len(self.queue) == 0:
+                    self.flush_requested = False
+                    self.condition.notify_all()
+                    if self.closed:
+                        return
+                    continue
+                update = self.queue.popleft()
+
+            sent = False
+            update.attempts += 1
+            try:
+                update.result = self.send(self._get_changed_fields(update))
+                self.last_sent[update.task_id] = update.payload
+                sent = True
+            except Exception as err:
+                logger.error("send status update of task %s failed: %s" % (update.task_id, err))
+            finally:
+                if update.event is not None:
+                    update.event.set()
+
+            with self.condition:
+                if not sent and update.event is None and update.attempts < STATUS_SEND_ATTEMPTS \
+                        and not any(queued.task_id == update.task_id for queued in self.queue):
+                    # send it again after the flush interval
+                    self.queue.appendleft(update)
+                    self.flush_requested = False
+                else:
+                    # keep sending without waiting until the queue is empty
+                    self.flush_requested = True
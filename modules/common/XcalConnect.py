@@ -1,6 +1,7 @@
 #
 #  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
 #
+import atexit
 import logging
 import json
 import os
@@ -8,25 +9,65 @@ import threading
 import re
 import random
 import requests
+from urllib.parse import urlsplit
 from xcal_common.py.error import EApiInvokeFail
 from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util import Retry
 from requests import Session
 from common.XcalGlobals import FileType
 
 from common import DownloadUtil
 from common.ConfigObject import ConfigObject
-from common.HashUtility import HashUtility
+from common.MultipartEncoder import MultipartStream
+from common.ChunkedUploader import ChunkedUploader, ChunkedUploadUnsupported
+from common.RetryScheduler import RetryScheduler
+from common.StatusReporter import StatusReporter, STATUS_CLOSE_TIMEOUT
 from common.XcalException import XcalException
 from common.XcalLogger import XcalLogger, XcalLoggerExternalLinker
 from common.CommonGlobals import TaskErrorNo, Stage, Status, Percentage, OFFLINE_AGENT_TYPE, AGENT_SOURCE_STORAGE
 
+# connection pools of the session, pool_connections is the number of hosts cached, pool_maxsize the connections per host
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 16
+# retry and timeout policy of the apis, keyed by the api name in API_SERVER, see RetryScheduler for the retry fields.
+# each api has its own circuit breaker and retry metrics, see Connector.get_api_name.
+# timeout is (connect, read) in seconds of an attempt, bounded by the deadline of the call; no timeout if None.
+# the apis not listed use DEFAULT_HTTP_POLICY, which has no deadline and no timeout as the requests had before
+DEFAULT_HTTP_POLICY = {"retry": 30, "backoff": 1, "maxBackoff": 60, "deadline": None, "timeout": None}
+HTTP_POLICIES = {
+    "progressReportApi": {"retry": 3, "backoff": 0.5, "maxBackoff": 5, "deadline": 30, "timeout": (10, 30)},
+    "agentStatusReportApi": {"retry": 3, "backoff": 0.5, "maxBackoff": 5, "deadline": 30, "timeout": (10, 30)},
+    "scanServiceVersionApi": {"retry": 5, "backoff": 1, "maxBackoff": 10, "deadline": 60, "timeout": (10, 30)},
+    # an upload takes as long as the file needs, only the connect is bounded
+    "fileInfoUploadApi": {"retry": 10, "backoff": 2, "maxBackoff": 60, "deadline": None, "timeout": (30, None)},
+    "fileChunkUploadApi": {"retry": 5, "backoff": 1, "maxBackoff": 30, "deadline": 600, "timeout": (30, 300)},
+    "fileChunkUploadInitApi": {"retry": 5, "backoff": 1, "maxBackoff": 10, "deadline": 120, "timeout": (10, 60)},
+    "fileChunkUploadStatusApi": {"retry": 5, "backoff": 1, "maxBackoff": 10, "deadline": 120, "timeout": (10, 60)},
+    "fileChunkUploadCompleteApi": {"retry": 5, "backoff": 1, "maxBackoff": 10, "deadline": 300, "timeout": (10, 240)},
+    "checkFileCacheApi": {"retry": 3, "backoff": 0.5, "maxBackoff": 5, "deadline": 30, "timeout": (10, 30)},
+    "saveFileCacheApi": {"retry": 3, "backoff": 0.5, "maxBackoff": 5, "deadline": 30, "timeout": (10, 30)},
+}
+
 
 class Connector(object):
+    # sessions shared by the connectors of the process, keyed by the host url, so that the connections are kept alive
+    _sessions = dict()
+    _session_lock = threading.Lock()
+    # retries, circuit breakers and retry metrics of the endpoints
+    retry_scheduler = RetryScheduler()
+    # set to False once the file service is found not supporting the chunked upload
+    chunked_upload_supported = True
+
     def __init__(self, logger: XcalLogger, api_server: dict):
         self.logger = logger
         self.api_server = api_server
         self.host_url = api_server.get("URL")
+        # list of (api name, compiled pattern of the path, fixed prefix of the path, length of the api path)
+        self.api_matchers = [(api_name, re.compile(Connector._get_api_pattern(api_path)),
+                              Connector._get_api_prefix(api_path), len(api_path))
+                             for api_name, api_path in api_server.items()
+                             if api_name != "URL" and isinstance(api_path, str)]
+        self.status_reporter = None
+        self.status_reporter_lock = threading.Lock()
 
     def login(self, global_ctx):
         url = "%s%s" % (self.host_url, self.api_server.get("loginApi"))
@@ -78,22 +119,53 @@ class Connector(object):
         :param file_type:
         :return: a dict which contains fileId key/value
         """
-        with open(file_to_upload, "rb") as file_one:
+        if self.is_chunked_upload(global_ctx, file_to_upload):
             try:
-                result = self.send_http_request(self.host_url + self.api_server.get("fileInfoUploadApi"),
-                                                data = {"token": job_config.get("taskConfig").get("token"), "file_checksum": str(HashUtility.get_crc32_checksum(file_to_upload)), "type": file_type.name},
-                                                header = {}, files = {"upload_file": file_one},
-                                                method = "POST_FILE")
-                result.raise_for_status()
-                file_id = result.json().get("id")
+                uploader = ChunkedUploader(self, job_config.get("taskConfig").get("token"), file_to_upload, file_type.name,
+                                           chunk_size = global_ctx.get("UPLOAD_CHUNK_SIZE"),
+                                           workers = global_ctx.get("UPLOAD_CHUNK_WORKERS"))
+                return {"fileId": uploader.upload()}
+            except ChunkedUploadUnsupported as err:
+                self.logger.warn("upload_file", "chunked upload is not available, upload the whole file: %s" % err)
+                # only a file service without the chunked upload turns it off, the other errors affect this file only
+                if err.permanent:
+                    Connector.chunked_upload_supported = False
             except requests.exceptions.RequestException as err:
                 raise XcalException("XcalConnect", "upload_file", "upload_file failed: %s" % err,
                                     TaskErrorNo.E_UPLOAD_FILE_FAILED)
-            except ValueError as err:
+            except (ValueError, KeyError) as err:
                 raise XcalException("XcalConnect", "upload_file", "response info is not valid json format: %s" % err,
                                     TaskErrorNo.E_INVALID_JSON_FORMAT)
+
+        # the file is read once while it is sent, the checksum is calculated in the same read and sent after it
+        body = MultipartStream({"token": job_config.get("taskConfig").get("token"), "type": file_type.name},
+                               "upload_file", file_to_upload, checksum_field = "file_checksum")
+        try:
+            result = self.send_http_request(self.host_url + self.api_server.get("fileInfoUploadApi"),
+                                            data = body, header = {"Content-Type": body.content_type},
+                                            method = "POST_DATA")
+            result.raise_for_status()
+            file_id = result.json().get("id")
+        except requests.exceptions.RequestException as err:
+            raise XcalException("XcalConnect", "upload_file", "upload_file failed: %s" % err,
+                                TaskErrorNo.E_UPLOAD_FILE_FAILED)
+        except ValueError as err:
+            raise XcalException("XcalConnect", "upload_file", "response info is not valid json format: %s" % err,
+                                TaskErrorNo.E_INVALID_JSON_FORMAT)
         return {"fileId": file_id}
 
+    def is_chunked_upload(self, global_ctx, file_to_upload):
+        """
+        :param global_ctx:
+        :param file_to_upload:
+        :return: True if the file should be uploaded in chunks
+        """
+        threshold = global_ctx.get("UPLOAD_CHUNK_THRESHOLD")
+        return global_ctx.get("UPLOAD_CHUNK_ENABLED") == "YES" \
+            and Connector.chunked_upload_supported and threshold is not None \
+            and self.api_server.get("fileChunkUploadInitApi") is not None \
+            and os.path.getsize(file_to_upload) >= int(threshold)
+
     def upload_diagnostic_log(self, global_ctx, job_config, file_to_upload):
 
         """
@@ -104,19 +176,32 @@ class Connector(object):
         :return:
         """
         if os.path.exists(file_to_upload):
-            with open(file_to_upload, "rb") as file_one:
-                file_upload_path = self.api_server.get('scanTaskDiagnosticUploadApi').replace("{id}", job_config.get("taskConfig").get("scanTaskId"))
-
-                result = self.send_http_request(self.host_url + file_upload_path,
-                                                data = {"token": job_config.get("taskConfig").get("token"), "checksum": ""},
-                                                header = {}, files = {"upload_file": file_one},
-                                                method = "POST_FILE")
-                self.logger.info("XcalConnect.upload_diagnostic_log", "result: %s" % result)
+            file_upload_path = self.api_server.get('scanTaskDiagnosticUploadApi').replace("{id}", job_config.get("taskConfig").get("scanTaskId"))
+            body = MultipartStream({"token": job_config.get("taskConfig").get("token"), "checksum": ""},
+                                   "upload_file", file_to_upload)
+            result = self.send_http_request(self.host_url + file_upload_path,
+                                            data = body, header = {"Content-Type": body.content_type},
+                                            method = "POST_DATA")
+            self.logger.info("XcalConnect.upload_diagnostic_log", "result: %s" % result)
 
     def report_status(self, global_ctx, job_config: dict, stage: Stage,
                       status: Status, errno: TaskErrorNo = TaskErrorNo.SUCCESS,
                       percentage: Percentage = Percentage.START, target: str = "progress",
                       message: str = "agent report status"):
+        """
+        Report the status of the task. The progress is queued and sent in background by the status reporter, the
+        terminal status and the result wait until all the queued updates of the task are sent
+        :param global_ctx:
+        :param job_config:
+        :param stage:
+        :param status:
+        :param errno:
+        :param percentage:
+        :param target: "progress" or "result"
+        :param message:
+        :return: the response json of a terminal status or the result, None for the other updates which are not sent
+                 yet when it returns
+        """
         self.logger.trace("XcalConnect-report_status", "scan task id: %s" % job_config.get("taskConfig").get("scanTaskId"))
         job_config["errorInfo"] = errno.value
         job_config["target"] = target
@@ -135,16 +220,40 @@ class Connector(object):
                       "pid": os.getpid()}
         job_config["agentInfo"] = agent_info
 
+        # the progress is reported in background, the terminal status waits until all the updates of the task are sent
+        terminal = status in (Status.COMPLETED, Status.FAILED, Status.TERMINATED) or target == "result"
+        # and is sent as a whole, so that the server gets the complete record of the task (e.g. uploadResults)
+        return self.get_status_reporter().submit(job_config.get("taskConfig").get("scanTaskId"), job_config,
+                                                 wait = terminal, full = terminal)
+
+    def get_status_reporter(self):
+        """
+        :return: the status reporter of the connector, created at the first call
+        """
+        with self.status_reporter_lock:
+            if self.status_reporter is None:
+                self.status_reporter = StatusReporter(self._send_status)
+                # the queued updates are sent before the process exits, a server not responding does not hold the exit
+                atexit.register(self.status_reporter.close, STATUS_CLOSE_TIMEOUT)
+            return self.status_reporter
+
+    def _send_status(self, data: dict):
+        """
+        Send a status update, called by the status reporter
+        :param data: status update
+        :return: the response json, None if the response is not json
+        :raise: requests.exceptions.RequestException if the update is not delivered, the reporter sends it again
+        """
+        result = self.send_http_request(self.host_url + self.api_server.get("progressReportApi"),
+                                        data = data,
+                                        header = {},
+                                        method = "POST")
+        result.raise_for_status()
         try:
-            result = self.send_http_request(self.host_url + self.api_server.get("progressReportApi"),
-                                            data = job_config,
-                                            header = {},
-                                            method = "POST")
             return result.json()
         except ValueError as err:
+            # delivered, only the response is not readable
             self.logger.error("XcalConnect", "report_status", "response info is not valid json format: %s" % err)
-        except Exception as err:
-            self.logger.error("XcalConnect", "report_status", "report status failed: %s" % err)
 
     def report_result(self, global_ctx, job_config: dict):
         return self.report_status(global_ctx, job_config, Stage.AGENT_END, Status.PROCESSING,
@@ -247,7 +356,10 @@ class Connector(object):
                                 TaskErrorNo.E_INVALID_JSON_FORMAT)
 
     def send_http_request(self, url: str, data: dict, header: dict, files: dict = None, timeout: int = 5000, method: str = "PUT"):
-        self.logger.debug("send_http_request", ("url:", url, "data:", data, "header:", header))
+        # the content of the file is not logged
+        self.logger.debug("send_http_request", ("url:", url, "data:", "%d bytes" % len(data) if isinstance(data, bytes) else
+                                                "multipart %s" % data.file_path if isinstance(data, MultipartStream) else data,
+                                                "header:", header))
 
         headers = XcalLoggerExternalLinker.prepare_client_request_headers(url, method, headers = header)
         #ori
@@ -266,35 +378,108 @@ class Connector(object):
         #return result
         #end - ori code
 
-        requests = Session()
-        Retry.BACKOFF_MAX =60
-        retry = Retry(
-            total=30,
-            backoff_factor=60,
-            method_whitelist=['GET', 'POST', 'PUT'],
-            status_forcelist=[401, 402, 403, 500, 502, 504, 494]
-        )
-        requests.mount(url, HTTPAdapter(max_retries=retry))
-        #requests.keep_alive = True
+        requests = self.get_session()
+        api_name, policy = self.get_http_policy(url)
+        policy_timeout = policy.get("timeout")
 
         if method == "POST":
-            response = requests.post(url, json=data, headers=headers, stream=False)
+            send = lambda attempt_timeout: requests.post(url, json=data, headers=headers, stream=False, timeout=attempt_timeout)
         elif method == "GET":
-            response = requests.get(url, headers=headers, stream=False)
+            send = lambda attempt_timeout: requests.get(url, headers=headers, stream=False, timeout=attempt_timeout)
         elif method == "POST_TIMEOUT":
-            response = requests.post(url, json=data, headers=headers, stream=False, timeout=timeout / 1000)
+            policy_timeout = timeout / 1000
+            send = lambda attempt_timeout: requests.post(url, json=data, headers=headers, stream=False, timeout=attempt_timeout)
         elif method == "POST_FILE":
-            response = requests.post(url, data=data, headers=headers, files=files, stream=False)
+            def send(attempt_timeout):
+                # the files are read by the previous attempt
+                for file_object in files.values():
+                    if hasattr(file_object, "seek"):
+                        file_object.seek(0)
+                return requests.post(url, data=data, headers=headers, files=files, stream=False, timeout=attempt_timeout)
+        elif method == "POST_DATA":
+            # the body (e.g. MultipartStream) is generated again by each attempt
+            send = lambda attempt_timeout: requests.post(url, data=data, headers=headers, stream=False, timeout=attempt_timeout)
+        elif method == "PUT_DATA":
+            send = lambda attempt_timeout: requests.put(url, data=data, headers=headers, stream=False, timeout=attempt_timeout)
         elif method == "PUT":
-            response = requests.put(url, data=json.dumps(data), headers=headers, stream=False)
+            send = lambda attempt_timeout: requests.put(url, data=json.dumps(data), headers=headers, stream=False, timeout=attempt_timeout)
         else:
             logging.error("unknown http method: %s" % method)
             raise EApiInvokeFail
+        # the authentication errors are returned at once, the other failures are retried until the deadline
+        response = Connector.retry_scheduler.call(api_name, send, policy, policy_timeout)
         result = response
+        # the content is read already, closing the response returns the connection to the pool
         response.close()
         del(response)
         return result
 
+    @staticmethod
+    def _get_api_prefix(api_path: str):
+        """
+        :param api_path: api path in API_SERVER, may contain {placeholder} and query
+        :return: the fixed part of the path before the placeholders and the query
+        """
+        return re.split(r"[{?]", api_path, maxsplit=1)[0]
+
+    @staticmethod
+    def _get_api_pattern(api_path: str):
+        """
+        :param api_path: api path in API_SERVER, may contain {placeholder} and query
+        :return: regular expression of the path without the query, a placeholder matches one path segment
+        """
+        path = api_path.split("?", 1)[0]
+        return "".join("[^/]+" if part.startswith("{") else re.escape(part) for part in re.split(r"(\{[^}]*\})", path))
+
+    def get_api_name(self, url: str):
+        """
+        :param url: request url
+        :return: name of the API_SERVER entry the url belongs to. the entry whose path matches the whole url path wins,
+                 then the entry with the longest fixed prefix of the url path (e.g. scanServiceApi). the url path
+                 without the query is returned if no entry matches
+        """
+        path = url[len(self.host_url):] if url.startswith(self.host_url) else urlsplit(url).path
+        path = path.split("?", 1)[0]
+        api = None
+        matched_length = -1
+        for api_name, pattern, prefix, api_path_length in self.api_matchers:
+            if pattern.fullmatch(path) is not None:
+                # longer than any prefix, the longest template is the most specific one
+                length = len(path) + api_path_length
+            else:
+                length = len(prefix) if len(prefix) > 0 and path.startswith(prefix) else -1
+            if length > matched_length:
+                api = api_name
+                matched_length = length
+        return path if api is None else api
+
+    def get_http_policy(self, url: str):
+        """
+        :param url: request url
+        :return: tuple of (api name, retry and timeout policy) of the api the url belongs to, see get_api_name.
+                 the retries, the circuit breaker and the metrics are per api name. the apis not in HTTP_POLICIES
+                 use DEFAULT_HTTP_POLICY
+        """
+        api = self.get_api_name(url)
+        return api, HTTP_POLICIES.get(api, DEFAULT_HTTP_POLICY)
+
+    def get_session(self):
+        """
+        :return: the session of the host, created at the first call
+        """
+        with Connector._session_lock:
+            session = Connector._sessions.get(self.host_url)
+            if session is not None:
+                return session
+
+            session = Session()
+            # the retries are done by the retry scheduler, not by urllib3
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            Connector._sessions[self.host_url] = session
+            return session
+
     @staticmethod
     def append_to_job_config(global_ctx, job_config, step_config, file_id=None, upload_result=None):
         if upload_result is None:
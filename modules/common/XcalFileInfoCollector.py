@@ -5,19 +5,36 @@ import logging
 import os
 import json
 import ntpath
+import sqlite3
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
 
 from common import XcalGlobals
-from common.HashUtility import HashUtility
 from common.FileUtility import FileUtility
+from common.FileInfoCache import FileInfoCache
+from common.HashUtility import HashUtility
+from common.PathFilter import PathFilter
 from common.CommonGlobals import TaskErrorNo, GIT_METADATA_FILE_NAME, FILE_INFO_FILE_NAME, COMMIT_FILE_NAME
 import subprocess
 
-from common.XcalGlobals import SOURCE_CODE_SUFFIX
 from xcal_common.py.error import EFileInfoPjNull, EFileInfoGatherFail, ECommonInvalidContent, ECommonFileNotExist, \
     EFileInfoNoFileid
 
 logger = logging.getLogger(__name__)
 
+# read size used when reading the output of git, large enough to avoid a syscall every few KiB
+SCAN_CHUNK_SIZE = 1024 * 1024
+# number of files in flight per worker thread when scanning the files
+SCAN_WINDOW_FACTOR = 16
+# git file modes of the index entries which are not regular files: symbolic link and submodule
+GIT_SYMLINK_MODE = "120000"
+GIT_SUBMODULE_MODE = "160000"
+# git blob id of the empty content, the file info of such a file is known without reading it
+GIT_EMPTY_BLOB_ID = "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+# byte value of the new line, which is what indexing a bytearray returns
+NEW_LINE = ord("\n")
+
 
 def _file_lines(filename):
     """
@@ -33,11 +50,220 @@ def _file_lines(filename):
         logger.error("%s cannot be read" % filename)
         return 0
 
-    i = -1
-    with open(filename, 'rb') as f:     # open file in binary mode to avoid the decode error
-        for i, l in enumerate(f):
-            pass
-    return i + 1
+    with open(filename, 'rb', buffering=0) as f:     # open file in binary mode to avoid the decode error
+        return _scan_stream(f, checksum=False)[2]
+
+
+def _scan_stream(f, checksum: bool = True):
+    """
+    Read the binary file object to the end by the chunk reader of HashUtility, and count the new lines of each chunk
+    by bytearray.count instead of splitting it into lines
+    :param f: binary file object, better unbuffered
+    :param checksum: also calculate the crc32 checksum
+    :return: tuple of (crc32 checksum, size, number of lines)
+    """
+    crc32 = 0
+    file_size = 0
+    line_num = 0
+    last_byte = NEW_LINE
+    for buffer, size in HashUtility.iter_file_chunks(f):
+        if checksum:
+            with memoryview(buffer) as view:
+                crc32 = zlib.crc32(view[:size], crc32)
+        file_size += size
+        line_num += buffer.count(b"\n", 0, size)
+        last_byte = buffer[size - 1]
+    if last_byte != NEW_LINE:
+        line_num += 1     # the last line does not end with new line, it is counted as a line too
+    return crc32 & 0xFFFFFFFF, file_size, line_num
+
+
+def _scan_file(filename):
+    """
+    Read the file once and collect its crc32 checksum, size and number of lines together
+    :param filename: file path
+    :return: tuple of (crc32 checksum, file size, number of lines)
+    """
+    with open(filename, 'rb', buffering=0) as f:     # open file in binary mode to avoid the decode error
+        return _scan_stream(f)
+
+
+class FileRecord(object):
+    """
+    File info of a file or a directory. The values are kept in their native types,
+    and only converted to the str fields of fileinfo.json by to_dict
+    """
+    __slots__ = ('file_id', 'file_name', 'type', 'depth', 'parent_path', 'file_path', 'relative_path', 'version',
+                 'checksum', 'file_size', 'line_num', 'blob_id')
+
+    def __init__(self, file_id: int, file_name: str, type: str, depth: int, parent_path: str, file_path: str,
+                 relative_path: str, version, checksum: int = 0, file_size: int = 0, line_num: int = 0,
+                 blob_id: str = None):
+        self.file_id = file_id
+        self.file_name = file_name
+        self.type = type
+        self.depth = depth
+        self.parent_path = parent_path
+        self.file_path = file_path
+        self.relative_path = relative_path
+        self.version = version
+        self.checksum = checksum
+        self.file_size = file_size
+        self.line_num = line_num
+        self.blob_id = blob_id   # git blob id of the file if its content is the same as the git index
+
+    def to_dict(self):
+        """
+        :return: a dict which contains the file info as it is written into fileinfo.json
+        """
+        return {'fileId': str(self.file_id),
+                'fileName': self.file_name,
+                'type': self.type,
+                'depth': str(self.depth),
+                'parentPath': self.parent_path,
+                'filePath': self.file_path,
+                'relativePath': self.relative_path,
+                'version': str(self.version),
+                'checksum': str(self.checksum),
+                'fileSize': str(self.file_size),
+                'noOfLines': str(self.line_num)
+                }
+
+
+class FileInfoSummary(object):
+    """
+    Counters of the generated file info, accumulated while the file info is generated
+    """
+
+    def __init__(self):
+        self.number_of_files = 0
+        self.number_of_dirs = 0
+        self.number_of_files_without_permission = 0
+        self.total_line_num = 0
+
+
+def _submit_scan(file_record: FileRecord, executor: ThreadPoolExecutor = None, cache: FileInfoCache = None,
+                 blob_scans: dict = None):
+    """
+    Start to scan the file of the file record, the file is scanned in place if no executor
+    :param file_record: file record of a file or a directory
+    :param executor: thread pool to scan the file
+    :param cache: file info cache, files whose stat signature or git blob id is unchanged reuse the cached result
+    :param blob_scans: dict of git blob id to the scan started for it, the files of the same blob share one scan
+    :return: tuple of (file_record, signature, cached result, scan result or Future of the scan result)
+    """
+    if file_record.type != "FILE":
+        return file_record, None, None, None
+
+    blob_id = file_record.blob_id
+    if blob_id is None or blob_scans is None:
+        return _start_scan(file_record, executor, cache)
+
+    # the content of a file unchanged from the git index is identified by the blob id, it is not read again
+    if blob_id == GIT_EMPTY_BLOB_ID:
+        return file_record, None, (0, 0, 0), (0, 0, 0)
+    if blob_id in blob_scans:
+        # the result is cached or saved in the cache with the first file of the blob
+        return file_record, None, blob_scans[blob_id], blob_scans[blob_id]
+    pending_scan = _start_scan(file_record, executor, cache)
+    blob_scans[blob_id] = pending_scan[3]
+    return pending_scan
+
+
+def _start_scan(file_record: FileRecord, executor: ThreadPoolExecutor = None, cache: FileInfoCache = None):
+    """
+    Look up the file in the cache, and start to scan it if not cached
+    :param file_record: file record of a file
+    :param executor: thread pool to scan the file
+    :param cache: file info cache
+    :return: tuple of (file_record, signature, cached result, scan result or Future of the scan result)
+    """
+    file_path = file_record.file_path
+    signature = None
+    cached_result = None
+    if cache is not None and file_record.blob_id is not None:
+        cached_result = cache.get_blob(file_record.blob_id)
+        if cached_result is not None and not cache.verify:
+            return file_record, signature, cached_result, cached_result
+    elif cache is not None:
+        signature = cache.get_signature(file_path)
+        cached_result = cache.get(os.path.abspath(file_path), signature)
+        if cached_result is not None and not cache.verify:
+            return file_record, signature, cached_result, cached_result
+
+    if executor is None:
+        return file_record, signature, cached_result, _scan_file(file_path)
+    return file_record, signature, cached_result, executor.submit(_scan_file, file_path)
+
+
+def _complete_scan(pending_scan: tuple, summary: FileInfoSummary, cache: FileInfoCache = None):
+    """
+    Wait for the scan started by _submit_scan, and fill checksum, file size and number of lines into the file record
+    :param pending_scan: returned by _submit_scan
+    :param summary: counters of the file info
+    :param cache: file info cache
+    :return: the file record
+    """
+    file_record, signature, cached_result, scan_result = pending_scan
+    if file_record.type != "FILE":
+        summary.number_of_dirs += 1
+        return file_record
+
+    if isinstance(scan_result, Future):
+        # the scan shared with the first file of the blob is handled with that file
+        if scan_result is cached_result:
+            cached_result = scan_result.result()
+        scan_result = scan_result.result()
+    if cache is not None and scan_result is not cached_result:
+        # in verification mode, a stale entry is replaced by the scan result
+        file_path = os.path.abspath(file_record.file_path)
+        if cached_result is None or not cache.check(file_path, cached_result, scan_result):
+            if file_record.blob_id is not None:
+                cache.put_blob(file_record.blob_id, scan_result)
+            else:
+                cache.put(file_path, signature, scan_result)
+
+    file_record.checksum, file_record.file_size, file_record.line_num = scan_result
+    summary.number_of_files += 1
+    summary.total_line_num += file_record.line_num
+    return file_record
+
+
+def _scan_file_info(file_records, summary: FileInfoSummary, workers: int = None, cache: FileInfoCache = None):
+    """
+    Fill checksum, file size and number of lines into the file records of the files, fan out to a thread pool when
+    more than one worker is used. File reading and crc32 release the GIL, so threads are enough to keep the cores busy.
+    The file records are yielded in the same order as file_records, and only a bounded window of files is in flight.
+    The files unchanged from the git index (with a blob id) are read once per blob, an empty blob is not read at all
+    :param file_records: iterable of FileRecord, files are not scanned yet
+    :param summary: counters of the file info
+    :param workers: number of worker threads, default is the cpu count
+    :param cache: file info cache, files whose stat signature is unchanged reuse the cached result
+    :return: generator of the completed FileRecord
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    executor = None
+    if workers > 1:
+        logger.debug("scan files with %d workers" % workers)
+        executor = ThreadPoolExecutor(max_workers = workers)
+
+    pending_scans = deque()
+    blob_scans = dict()
+    try:
+        for file_record in file_records:
+            pending_scans.append(_submit_scan(file_record, executor, cache, blob_scans))
+            if len(pending_scans) > workers * SCAN_WINDOW_FACTOR:
+                yield _complete_scan(pending_scans.popleft(), summary, cache)
+        while len(pending_scans) > 0:
+            yield _complete_scan(pending_scans.popleft(), summary, cache)
+    finally:
+        if executor is not None:
+            for _, _, _, scan_result in pending_scans:
+                if isinstance(scan_result, Future):
+                    scan_result.cancel()
+            executor.shutdown()
 
 
 def _getmtime_nano(filename):
@@ -53,13 +279,55 @@ def get_git_commit_id(project_path):
             commit_id = json.load(f).get('commit_id')
 
     if commit_id is None:
-        utility = FileUtility()
-        utility.goto_dir(project_path)
-        commit_id = subprocess.check_output("git rev-parse HEAD", shell=True).strip().decode('utf-8')
-        utility.goback_dir()
+        commit_id = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=project_path).strip().decode('utf-8')
     return commit_id
 
 
+def _iter_git_output(args: list, project_path):
+    """
+    run the git command in the project path and split its NUL terminated (-z) output while it is produced
+    :param args: git command arguments, without "git"
+    :param project_path: project path, the paths in the output are relative to it
+    :return: generator of the output records as str
+    """
+    with subprocess.Popen(["git"] + args, cwd=project_path, stdout=subprocess.PIPE) as process:
+        remainder = b""
+        for chunk in iter(lambda: process.stdout.read(SCAN_CHUNK_SIZE), b""):
+            records = (remainder + chunk).split(b"\0")
+            remainder = records.pop()
+            for record in records:
+                yield os.fsdecode(record)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ["git"] + args)
+
+
+def _get_git_index_files(project_path):
+    """
+    read the regular files tracked by git in the project path from the git index, without traversing the work tree
+    :param project_path: project path
+    :return: dict of relative file path (separated by '/') to git blob id in the git index order.
+             the blob id is None if the file in the work tree differs from the git index
+    """
+    git_files = dict()
+    # each record is "<mode> <blob id> <stage>\t<path>"
+    for record in _iter_git_output(["ls-files", "-s", "-z"], project_path):
+        info, _, relative_path = record.partition("\t")
+        mode, blob_id, stage = info.split(" ")
+        if mode in (GIT_SYMLINK_MODE, GIT_SUBMODULE_MODE):
+            continue
+        # the unmerged file has several stages, its content is decided by the work tree
+        git_files[relative_path] = blob_id if stage == "0" and relative_path not in git_files else None
+
+    # the files whose stat info differs from the git index, they need to be scanned from the work tree
+    dirty_file_count = 0
+    for relative_path in _iter_git_output(["diff-files", "--name-only", "--relative", "-z"], project_path):
+        if relative_path in git_files:
+            git_files[relative_path] = None
+            dirty_file_count += 1
+    logger.info("%d files tracked by git, %d of them are modified in work tree" % (len(git_files), dirty_file_count))
+    return git_files
+
+
 def _get_source_code_zip_file_id(upload_results, step_config):
     """
 
@@ -85,6 +353,7 @@ def _get_directory_name(project_path, file_name):
     """
     logger.info("begin to parse the file to get directory name")
 
+    path_filter = PathFilter(project_path)
     dir_set = set()
     with open(file_name) as json_file:
         source_code_files = json.load(json_file)
@@ -95,41 +364,82 @@ def _get_directory_name(project_path, file_name):
         for source_code_file in source_code_files:
             # file path may contain .., normpath can make the path canonical
             source_code_file = os.path.normpath(source_code_file)
-            if source_code_file.startswith(project_path):
+            if path_filter.is_under_project(source_code_file):
                 path_list = source_code_file.split(os.sep)[1:-1]    # only keep the directory info
                 dir_set.update(path_list)
     return dir_set
 
 
-def _get_filename_depth_map(project_path, dir_starts_with_dot_list: list = []):
+def _walk_project(project_path, dir_starts_with_dot_list: list = []):
     """
-    traverse the project path to get the filename/depth key/value pair. The directory starts with '.' and
+    traverse the project path once by os.scandir, include the symbolic links. The directory starts with '.' and
     exists in dir_starts_with_dot_list should also be included. Other directories start with '.' is excluded.
-    only file's real path exists in project path will be collected
+    only the directory/file whose real path exists in project path will be collected, and each real directory is
+    visited only once. The symbolic link is resolved once per directory, the stat results are cached by os.DirEntry
     :param project_path:
-    :param log:
     :param dir_starts_with_dot_list:
-    :return: dict type object
+    :return: tuple of (filename_depth_map, directories). directories is a list of
+             (directory real path, depth, os.DirEntry list of the files in it), in os.walk top-down order
     """
+    path_filter = PathFilter(project_path)
     filename_depth_map = dict()
+    directories = []
     base_depth = project_path.count(os.sep)
-    # traverse the project path, include the symbolic links
-    file_set = set()
+    visited_dir_set = set()
     logger.debug("begin to traverse project path: %s" % project_path)
-    for root, dirs, filenames in os.walk(project_path, followlinks = True):
-        if os.path.realpath(root).startswith(project_path) and os.path.realpath(root) not in file_set:
-            file_set.add(os.path.realpath(root))
+    stack = [(project_path, False)]
+    while len(stack) > 0:
+        root, is_link = stack.pop()
+        if is_link:
+            root = os.path.realpath(root)
+        if not path_filter.is_under_project(root) or root in visited_dir_set:
+            continue
+        visited_dir_set.add(root)
+
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError as err:
+            logger.warning("cannot traverse directory %s: %s" % (root, err))
+            continue
+
+        depth = root.count(os.sep) - base_depth
+        filename_depth_map[root] = depth
+        file_entries = []
+        sub_dirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                # currently only collect directory starts with '.' and exists in dir_starts_with_dot_list.
+                # Other directories start with '.' is excluded no matter what os (windows, linux, macOS).
+                if entry.name in dir_starts_with_dot_list or not entry.name.startswith('.'):
+                    sub_dirs.append((entry.path, entry.is_symlink()))
+                continue
+
+            file_entries.append(entry)
+            real_path = os.path.realpath(entry.path) if entry.is_symlink() else entry.path
+            if path_filter.is_under_project(real_path):
+                filename_depth_map[real_path] = depth + 1
+        directories.append((root, depth, file_entries))
+        stack.extend(reversed(sub_dirs))
+
+    return filename_depth_map, directories
 
-            # currently only collect directory starts with '.' and exists in dir_starts_with_dot_list.
-            # Other directories start with '.' is excluded no matter what os (windows, linux, macOS).
-            dirs[:] = [dir_name for dir_name in dirs if (dir_name in dir_starts_with_dot_list or not dir_name.startswith('.'))]
-            depth = os.path.realpath(root).count(os.sep) - base_depth
-            filename_depth_map[os.path.realpath(root)] = depth
-            for filename in filenames:
-                if os.path.realpath(os.path.join(root, filename)).startswith(project_path):
-                    filename_depth_map[os.path.realpath(os.path.join(root, filename))] = depth + 1
 
-    return filename_depth_map
+def _get_filename_depth_map(project_path, dir_starts_with_dot_list: list = []):
+    """
+    traverse the project path to get the filename/depth key/value pair. The directory starts with '.' and
+    exists in dir_starts_with_dot_list should also be included. Other directories start with '.' is excluded.
+    only file's real path exists in project path will be collected
+    :param project_path:
+    :param dir_starts_with_dot_list:
+    :return: dict type object
+    """
+    return _walk_project(project_path, dir_starts_with_dot_list)[0]
 
 
 def _get_parent_path(relative_path: str, depth: int):
@@ -147,226 +457,326 @@ def _get_parent_path(relative_path: str, depth: int):
         return os.path.dirname(relative_path)
 
 
-def generate_directory_file_info(project_path, directory, filename_depth_map, file_num, version):
+def _get_directory_file_record(project_path, directory, filename_depth_map, file_num, version):
     """
-    generate the file info of the directory
+    generate the file record of the directory
     :param project_path: the whole project path
     :param directory: the directory whose file info will be generated
     :param filename_depth_map: the directory name depth map
     :param file_num: file number
     :param version: git commit id or zero for directory type
-    :return: a dict which contains the directory file info
+    :return: FileRecord of the directory
     """
     depth = filename_depth_map.get(directory)
     if directory != project_path:
         relative_path = os.path.relpath(directory, project_path)
     else:
         relative_path = os.sep
-    file = {'fileId': str(file_num),
-            'fileName': os.path.basename(directory),
-            'type': "DIRECTORY",
-            'depth': str(depth),
-            'parentPath': _get_parent_path(relative_path, depth),
-            'filePath': directory,
-            'relativePath': relative_path,
-            'version': str(version),
-            'checksum': str(0),
-            'fileSize': str(0),
-            'noOfLines': str(0)
-            }
-    return file
+    return FileRecord(file_num, os.path.basename(directory), "DIRECTORY", depth, _get_parent_path(relative_path, depth),
+                      directory, relative_path, version)
 
 
-def generate_file_info_by_traverse_project_path(project_path, filename_depth_map, is_vcs_project, xcalbuild_path):
+def generate_directory_file_info(project_path, directory, filename_depth_map, file_num, version):
     """
+    generate the file info of the directory
+    :param project_path: the whole project path
+    :param directory: the directory whose file info will be generated
+    :param filename_depth_map: the directory name depth map
+    :param file_num: file number
+    :param version: git commit id or zero for directory type
+    :return: a dict which contains the directory file info
+    """
+    return _get_directory_file_record(project_path, directory, filename_depth_map, file_num, version).to_dict()
+
+
+def _iter_file_info_by_traverse_project_path(project_path, filename_depth_map, directories, is_vcs_project, path_filter: PathFilter, summary: FileInfoSummary):
+    """
+    generate the file info of the directories and source code files in the traversed directories
     :param project_path:
     :param filename_depth_map:
+    :param directories: directories returned by _walk_project
     :param is_vcs_project:
-    :return:
+    :param path_filter: selects the source code files
+    :param summary: counters of the file info
+    :return: generator of FileRecord, checksum/file_size/line_num of the files are filled by _scan_file_info
     """
     version = 0
     if is_vcs_project:
         version = get_git_commit_id(project_path)
 
-    number_of_files_without_permission = 0
-    total_line_num = 0
     file_num = 0
-    files = []
-    file_set = set()
-
     logger.info("begin to traverse project path: %s" % project_path)
-    logger.debug("xcalbuild_path : %s" % xcalbuild_path)
-    # traverse the project path, include the symbolic links
-    for root, dirs, filenames in os.walk(project_path, followlinks = True):
-        # currently not collect directory start with '.', no matter what os (windows, linux, macOS).
-        dirs[:] = [dir_name for dir_name in dirs if not dir_name.startswith('.')]
-
-        if os.path.realpath(root).startswith(project_path) and os.path.realpath(root) not in file_set:
-            file_num += 1
-            dir_file_info = generate_directory_file_info(project_path, os.path.realpath(root), filename_depth_map, file_num, version)
-            files.append(dir_file_info)
-            file_set.add(os.path.realpath(root))
-
-        for filename in filenames:
-            if filename.endswith(tuple(SOURCE_CODE_SUFFIX)):
+    logger.debug("xcalbuild_path : %s" % path_filter.xcalbuild_path)
+    for root, _, file_entries in directories:
+        file_num += 1
+        yield _get_directory_file_record(project_path, root, filename_depth_map, file_num, version)
+
+        in_xcalbuild_path = path_filter.in_xcalbuild_path(root)
+        for entry in file_entries:
+            filename = entry.name
+            if not path_filter.has_source_suffix(filename):
+                continue
+
+            file_path = entry.path
+            relative_path = path_filter.get_relative_path(file_path)
+            if path_filter.match_patterns(relative_path):
                 lost_file = False
-                depth = filename_depth_map.get(os.path.join(root, filename))
+                depth = filename_depth_map.get(file_path)
 
                 # Do not check the source code of xcalbuild_path
-                if not xcalbuild_path is None and root.find(xcalbuild_path) > -1 and filename.endswith(".h"):
+                if in_xcalbuild_path and filename.endswith(".h"):
                     logger.info("This source code is owned by xcalbuild, please do not show it to users")
                     continue
-                if os.path.islink(os.path.join(root, filename)):
-                    logger.info("This source code is link file: %s" % os.path.join(root, filename))
+                if entry.is_symlink():
+                    logger.info("This source code is link file: %s" % file_path)
                     continue
 
                 if depth is None:
-                    logger.warning("source code file %s does not exist" % os.path.join(root, filename))
+                    logger.warning("source code file %s does not exist" % file_path)
                     lost_file = True
 
-                if not os.path.isfile(os.path.join(root, filename)):
-                    logger.warning("file %s does not exist" % os.path.join(root, filename))
+                if not entry.is_file():
+                    logger.warning("file %s does not exist" % file_path)
                     lost_file = True
 
                 if lost_file:
                     continue
 
                 file_num += 1
-                file_path = os.path.join(root, filename)
                 if not os.access(file_path, os.R_OK):
-                    number_of_files_without_permission += 1
-                relative_path = os.path.relpath(file_path, project_path)
+                    summary.number_of_files_without_permission += 1
 
                 if not is_vcs_project:
-                    version = _getmtime_nano(file_path)
+                    version = entry.stat().st_mtime_ns
+
+                yield FileRecord(file_num, filename, "FILE", depth, _get_parent_path(relative_path, depth),
+                                 file_path, relative_path, version)
+
+
+def _iter_file_info_by_git_index(project_path, git_files: dict, path_filter: PathFilter, summary: FileInfoSummary):
+    """
+    generate the file info of the source code files tracked by git and their directories, the file list comes from
+    the git index instead of traversing the project path. The files in the directories start with '.' are excluded
+    as _walk_project does, and the directories without tracked files are not listed.
+    The records are in the same depth first order as _walk_project: a directory, its files, then its sub directories
+    one by one. The files and the sub directories are sorted by name here, while _walk_project keeps the order of the
+    directory listing, so the file ids match the traversal only where the file system lists the entries sorted
+    :param project_path:
+    :param git_files: returned by _get_git_index_files
+    :param path_filter: selects the source code files
+    :param summary: counters of the file info
+    :return: generator of FileRecord, checksum/file_size/line_num of the files are filled by _scan_file_info
+    """
+    version = get_git_commit_id(project_path)
+
+    # group the files by directory, and record the sub directories of each directory
+    directory_files = {"": []}
+    sub_directories = {"": []}
+    for relative_path in git_files:
+        path_list = relative_path.split("/")
+        if any(dir_name.startswith('.') for dir_name in path_list[:-1]):
+            continue
+        directory = ""
+        for dir_name in path_list[:-1]:
+            parent = directory
+            directory = directory + "/" + dir_name if directory else dir_name
+            if directory not in directory_files:
+                directory_files[directory] = []
+                sub_directories[directory] = []
+                sub_directories[parent].append(dir_name)
+        directory_files[directory].append(relative_path)
+
+    file_num = 0
+    filename_depth_map = dict()
+    logger.info("begin to read git index of project path: %s" % project_path)
+    logger.debug("xcalbuild_path : %s" % path_filter.xcalbuild_path)
+    stack = [""]
+    while len(stack) > 0:
+        directory = stack.pop()
+        stack.extend(directory + "/" + dir_name if directory else dir_name
+                     for dir_name in sorted(sub_directories[directory], reverse=True))
+        relative_paths = sorted(directory_files[directory])
+        root = os.path.join(project_path, directory.replace("/", os.sep)) if directory else project_path
+        depth = directory.count("/") + 1 if directory else 0
+        filename_depth_map[root] = depth
+        file_num += 1
+        yield _get_directory_file_record(project_path, root, filename_depth_map, file_num, version)
+
+        in_xcalbuild_path = path_filter.in_xcalbuild_path(root)
+        for relative_path in relative_paths:
+            filename = relative_path.rpartition("/")[2]
+            if not path_filter.has_source_suffix(filename):
+                continue
+
+            blob_id = git_files[relative_path]
+            relative_path = relative_path.replace("/", os.sep)
+            if not path_filter.match_patterns(relative_path):
+                continue
+
+            # Do not check the source code of xcalbuild_path
+            if in_xcalbuild_path and filename.endswith(".h"):
+                logger.info("This source code is owned by xcalbuild, please do not show it to users")
+                continue
+
+            file_path = os.path.join(project_path, relative_path)
+            # the file modified in the work tree may be deleted or replaced
+            if blob_id is None and (os.path.islink(file_path) or not os.path.isfile(file_path)):
+                logger.warning("file %s does not exist" % file_path)
+                continue
 
-                files.append({'fileId': str(file_num),
-                              'fileName': filename,
-                              'type': "FILE",
-                              'depth': str(depth),
-                              'parentPath': _get_parent_path(relative_path, depth),
-                              'filePath': file_path,
-                              'relativePath': relative_path,
-                              'version': str(version),
-                              'checksum': str(HashUtility.get_crc32_checksum(file_path)),
-                              'fileSize': str(os.path.getsize(file_path)),
-                              'noOfLines': str(_file_lines(file_path))
-                              })
-                total_line_num += _file_lines(file_path)
-                #else:
-                #    log.warn("generate_file_info_by_traverse_project_path", "file %s does not exist" % os.path.join(root, filename))
+            file_num += 1
+            if not os.access(file_path, os.R_OK):
+                summary.number_of_files_without_permission += 1
 
-    return files, number_of_files_without_permission, total_line_num
+            yield FileRecord(file_num, filename, "FILE", depth + 1, _get_parent_path(relative_path, depth + 1),
+                             file_path, relative_path, version, blob_id=blob_id)
 
 
-def generate_file_info_by_analyse_file(project_path, filename_depth_map, dir_starts_with_dot_list: list, file_name, is_vcs_project, xcalbuild_path):
+def _iter_file_info_by_analyse_file(project_path, filename_depth_map, directories, file_name, is_vcs_project, path_filter: PathFilter, summary: FileInfoSummary, git_files: dict = None):
     """
-    
+    generate the file info of the traversed directories and the source code files in file_name
     :param project_path:
     :param filename_depth_map:
-    :param dir_starts_with_dot_list:
-    :param file_name: 
-    :param is_vcs_project: 
-    :return: 
-    """""
+    :param directories: directories returned by _walk_project
+    :param file_name: json file which contains all the file paths being preprocessed
+    :param is_vcs_project:
+    :param path_filter: selects the source code files
+    :param summary: counters of the file info
+    :param git_files: returned by _get_git_index_files, the files unchanged from the git index reuse the blob id
+    :return: generator of FileRecord, checksum/file_size/line_num of the files are filled by _scan_file_info
+    """
     version = 0
     if is_vcs_project:
         version = get_git_commit_id(project_path)
 
-    number_of_files_without_permission = 0
-    total_line_num = 0
     file_num = 0
-    files = []
-    file_set = set()
-    # traverse the project path, include the symbolic links
     logger.info("begin to traverse project path %s to get directory file info" % project_path)
-    logger.debug("xcalbuild_path : %s" % xcalbuild_path)
-    for root, dirs, filenames in os.walk(project_path, followlinks = True):
-        # currently only collect directory starts with '.' and exists in dir_starts_with_dot_list.
-        # Other directories start with '.' is excluded no matter what os (windows, linux, macOS).
-        dirs[:] = [dir_name for dir_name in dirs if
-                   (dir_name in dir_starts_with_dot_list or not dir_name.startswith('.'))]
-        if os.path.realpath(root).startswith(project_path) and os.path.realpath(root) not in file_set:
-            file_num += 1
-            dir_file_info = generate_directory_file_info(project_path, os.path.realpath(root), filename_depth_map, file_num, version)
-            files.append(dir_file_info)
-            file_set.add(os.path.realpath(root))
+    logger.debug("xcalbuild_path : %s" % path_filter.xcalbuild_path)
+    for root, _, _ in directories:
+        file_num += 1
+        yield _get_directory_file_record(project_path, root, filename_depth_map, file_num, version)
 
     logger.debug("begin to analyse file %s to get file info" % file_name)
     with open(file_name) as json_file:
         source_code_files = json.load(json_file)
-        if not isinstance(source_code_files, list) or len(source_code_files) == 0:
-            logger.error("source code file content is invalid: %s" % source_code_files)
-            raise ECommonInvalidContent
+    if not isinstance(source_code_files, list) or len(source_code_files) == 0:
+        logger.error("source code file content is invalid: %s" % source_code_files)
+        raise ECommonInvalidContent
+
+    file_path_set = set()
+    for source_code_file in source_code_files:
+        # file path may contain .., normpath can make the path canonical
+        source_code_file = os.path.normpath(source_code_file)
+        # relative file path is relative to the project path
+        if not os.path.exists(os.path.join(project_path, source_code_file)):
+            logger.error("source code file does not exist: %s" % source_code_file)
+            raise ECommonFileNotExist
+
+        if source_code_file not in file_path_set:   # defensive, avoid add duplicate file info
+            lost_file = False
+            depth = filename_depth_map.get(source_code_file)
+
+            #Do not check the source code of xcalbuild_path
+            if path_filter.is_xcalbuild_header(source_code_file):
+                logger.debug("This source code is owned by xcalbuild, please do not show it to users")
+                continue
+
+            if not path_filter.is_under_project(source_code_file):
+                logger.warning("source code file %s does not belong to %s" % (source_code_file, project_path))
+                lost_file = True
+            elif not path_filter.match_patterns(path_filter.get_relative_path(source_code_file)):
+                logger.debug("source code file %s is excluded" % source_code_file)
+                continue
+
+            if depth is None:
+                logger.warning("file depth should not be None. file: %s" % source_code_file)
+                lost_file = True
+
+            if lost_file:
+                continue
 
-        utility = FileUtility()
-        utility.goto_dir(project_path)
-        file_path_set = set()
-        for source_code_file in source_code_files:
-            # file path may contain .., normpath can make the path canonical
-            source_code_file = os.path.normpath(source_code_file)
-            if not os.path.exists(source_code_file):
-                logger.error("source code file does not exist: %s" % source_code_file)
-                raise ECommonFileNotExist
+            file_num += 1
+            file_path = source_code_file
+            if not os.access(file_path, os.R_OK):
+                summary.number_of_files_without_permission += 1
+            relative_path = path_filter.get_relative_path(file_path)
 
-            if source_code_file not in file_path_set:   # defensive, avoid add duplicate file info
-                lost_file = False
-                depth = filename_depth_map.get(source_code_file)
+            if not is_vcs_project:
+                version = _getmtime_nano(file_path)
 
-                #Do not check the source code of xcalbuild_path
-                if not xcalbuild_path is None and source_code_file.find(xcalbuild_path) > -1 and source_code_file.endswith(".h"):
-                    logger.debug("This source code is owned by xcalbuild, please do not show it to users")
-                    continue
+            blob_id = None
+            if git_files is not None:
+                blob_id = git_files.get(relative_path.replace(os.sep, "/"))
+            yield FileRecord(file_num, ntpath.basename(file_path), "FILE", depth, _get_parent_path(relative_path, depth),
+                             file_path, relative_path, version, blob_id=blob_id)
 
-                if not source_code_file.startswith(project_path):
-                    logger.warning("source code file %s does not belong to %s" % (source_code_file, project_path))
-                    lost_file = True
+            file_path_set.add(source_code_file)
 
-                if depth is None:
-                    logger.warning("file depth should not be None. file: %s" % source_code_file)
-                    lost_file = True
 
-                if lost_file:
-                    continue
+def generate_file_info_by_traverse_project_path(project_path, filename_depth_map, is_vcs_project, xcalbuild_path, workers: int = None, cache: FileInfoCache = None, directories: list = None):
+    """
+    :param project_path:
+    :param filename_depth_map:
+    :param is_vcs_project:
+    :param workers: number of worker threads to scan the files
+    :param cache: file info cache
+    :param directories: directories returned by _walk_project, traverse the project path if None
+    :return:
+    """
+    if directories is None:
+        filename_depth_map, directories = _walk_project(project_path)
 
-                file_num += 1
-                file_path = source_code_file
-                if not os.access(file_path, os.R_OK):
-                    number_of_files_without_permission += 1
-                relative_path = os.path.relpath(file_path, project_path)
+    summary = FileInfoSummary()
+    path_filter = PathFilter(project_path, xcalbuild_path=xcalbuild_path)
+    file_records = _iter_file_info_by_traverse_project_path(project_path, filename_depth_map, directories, is_vcs_project, path_filter, summary)
+    files = [file_record.to_dict() for file_record in _scan_file_info(file_records, summary, workers, cache)]
+    return files, summary.number_of_files_without_permission, summary.total_line_num
 
-                if not is_vcs_project:
-                    version = _getmtime_nano(file_path)
 
-                files.append({'fileId': str(file_num),
-                              'fileName': ntpath.basename(file_path),
-                              'type': "FILE",
-                              'depth': str(depth),
-                              'parentPath': _get_parent_path(relative_path, depth),
-                              'filePath': file_path,
-                              'relativePath': relative_path,
-                              'version': str(version),
-                              'checksum': str(HashUtility.get_crc32_checksum(file_path)),
-                              'fileSize': str(os.path.getsize(file_path)),
-                              'noOfLines': str(_file_lines(file_path))
-                              })
-                total_line_num += _file_lines(file_path)
+def generate_file_info_by_analyse_file(project_path, filename_depth_map, dir_starts_with_dot_list: list, file_name, is_vcs_project, xcalbuild_path, workers: int = None, cache: FileInfoCache = None, directories: list = None):
+    """
+    
+    :param project_path:
+    :param filename_depth_map:
+    :param dir_starts_with_dot_list:
+    :param file_name: 
+    :param is_vcs_project: 
+    :param workers: number of worker threads to scan the files
+    :param cache: file info cache
+    :param directories: directories returned by _walk_project, traverse the project path if None
+    :return: 
+    """""
+    if directories is None:
+        filename_depth_map, directories = _walk_project(project_path, dir_starts_with_dot_list)
+
+    summary = FileInfoSummary()
+    path_filter = PathFilter(project_path, xcalbuild_path=xcalbuild_path)
+    file_records = _iter_file_info_by_analyse_file(project_path, filename_depth_map, directories, file_name, is_vcs_project, path_filter, summary)
+    files = [file_record.to_dict() for file_record in _scan_file_info(file_records, summary, workers, cache)]
+    return files, summary.number_of_files_without_permission, summary.total_line_num
 
-                file_path_set.add(source_code_file)
 
-        utility.goback_dir()
+def _open_file_info_cache(step_config):
+    """
+    Open the file info cache configured in step_config, the cache is optional and is skipped if it cannot be opened
+    :param step_config: Current Step's Information
+    :return: FileInfoCache object or None
+    """
+    cache_path = step_config.get("fileInfoCachePath")
+    if cache_path is None:
+        return None
 
-    return files, number_of_files_without_permission, total_line_num
+    try:
+        return FileInfoCache(cache_path, step_config.get("fileInfoCacheMaxEntries"), step_config.get("fileInfoCacheVerify", False))
+    except sqlite3.Error as err:
+        logger.warning("cannot open file info cache %s, ignore it: %s" % (cache_path, err))
+        return None
 
 
-def generate_file_info(project_path, job_config, step_config, xcalbuild_path=None):
+def _get_real_project_path(project_path):
     """
-    generate the files information of the project
-    :param xcalbuild_path: Current xcalbuild path
-    :param step_config: Current Step's Information
-    :param job_config: Current Job's Info
     :param project_path: where the project source code root path
-    :return: file_info dictionary content
+    :return: the canonical real path of the project
     """
     logger.debug("project_path: %s" % project_path)
 
@@ -375,27 +785,16 @@ def generate_file_info(project_path, job_config, step_config, xcalbuild_path=Non
     if not os.path.isdir(project_path) or not os.path.exists(project_path):
         logger.error("project path does not exist: %s" % project_path)
         raise EFileInfoPjNull
+    return project_path
 
-    input_filename = step_config.get("inputFileName")  # information of the source code files which are preprocessed
-
-    is_vcs_project = False
-    if step_config.get("sourceStorageType").lower() in ["gitlab", "gitlab_v3", "github", 'gerrit']:
-        is_vcs_project = True
-
-    file_info = {}
-    if input_filename is None or not os.path.exists(input_filename):
-        # if source_files.json not exists, collect the file information in project_path.
-        logger.debug("traverse project path to generate file info")
-        filename_depth_map = _get_filename_depth_map(project_path)
-        files, number_of_files_without_permission, total_line_num = generate_file_info_by_traverse_project_path(project_path, filename_depth_map, is_vcs_project, xcalbuild_path)
-    else:
-        logger.debug("analyse file %s to generate file info" % input_filename)
-        dir_set = _get_directory_name(project_path, input_filename)
-        dir_starts_with_dot_list = [dir_name for dir_name in dir_set if dir_name.startswith('.')]
-        filename_depth_map = _get_filename_depth_map(project_path, dir_starts_with_dot_list)
-        files, number_of_files_without_permission, total_line_num = generate_file_info_by_analyse_file(project_path, filename_depth_map, dir_starts_with_dot_list, input_filename, is_vcs_project, xcalbuild_path)
 
-    file_info['sourceCodeFileId'] = ""
+def _get_file_info_header(job_config, step_config):
+    """
+    :param job_config: Current Job's Info
+    :param step_config: Current Step's Information
+    :return: the fields placed before the files in the file info
+    """
+    file_info = {'sourceCodeFileId': ""}
     if step_config.get("sourceStorageName") == "agent" and step_config.get("uploadSource"):
         file_info['sourceType'] = "volume_upload"
         source_code_zip_file_id = ""
@@ -405,25 +804,145 @@ def generate_file_info(project_path, job_config, step_config, xcalbuild_path=Non
         file_info['sourceCodeFileId'] = source_code_zip_file_id
     else:
         file_info['sourceType'] = step_config.get("sourceStorageName")
+    return file_info
+
+
+def _get_file_info_trailer(step_config, summary: FileInfoSummary):
+    """
+    :param step_config: Current Step's Information
+    :param summary: counters of the file info, complete after all the files are generated
+    :return: the fields placed after the files in the file info
+    """
+    return {'gitUrl': step_config.get('gitUrl'),
+            'osType': XcalGlobals.os_info,
+            'numberOfFiles': str(summary.number_of_files),
+            'numberOfDirs': str(summary.number_of_dirs),
+            'totalLineNum': str(summary.total_line_num),
+            'numberOfFilesWithoutPermission': str(summary.number_of_files_without_permission)
+            }
+
+
+def _iter_project_file_info(project_path, step_config, xcalbuild_path, summary: FileInfoSummary):
+    """
+    generate the file records of the directories and files of the project one by one
+    :param project_path: the canonical real path of the project
+    :param step_config: Current Step's Information
+    :param xcalbuild_path: Current xcalbuild path
+    :param summary: counters of the file info
+    :return: generator of FileRecord
+    """
+    input_filename = step_config.get("inputFileName")  # information of the source code files which are preprocessed
+
+    is_vcs_project = False
+    if step_config.get("sourceStorageType").lower() in ["gitlab", "gitlab_v3", "github", 'gerrit']:
+        is_vcs_project = True
+
+    # number of worker threads used to scan the files, default is the cpu count
+    workers = step_config.get("fileInfoWorkers")
+    if workers is not None:
+        workers = int(workers)
+
+    # the include/exclude patterns are shared with the source code archive
+    path_filter = PathFilter(project_path, include_patterns=step_config.get("sourceIncludePatterns"),
+                             exclude_patterns=step_config.get("sourceExcludePatterns"), xcalbuild_path=xcalbuild_path)
 
-    dirs = [file_item for file_item in files if file_item.get("type") == "DIRECTORY"]
+    git_files = None
+    if is_vcs_project and step_config.get("fileInfoGitIndex"):
+        try:
+            git_files = _get_git_index_files(project_path)
+        except (OSError, subprocess.CalledProcessError) as err:
+            logger.warning("cannot read git index of %s, traverse project path instead: %s" % (project_path, err))
 
-    file_info['files'] = files
-    file_info['gitUrl'] = step_config.get('gitUrl')
-    file_info['osType'] = XcalGlobals.os_info
-    file_info['numberOfFiles'] = str(len(files) - len(dirs))
-    file_info['numberOfDirs'] = str(len(dirs))
-    file_info['totalLineNum'] = str(total_line_num)
-    file_info['numberOfFilesWithoutPermission'] = str(number_of_files_without_permission)
+    cache = _open_file_info_cache(step_config)
+    try:
+        if (input_filename is None or not os.path.exists(input_filename)) and git_files is not None:
+            # if source_files.json not exists, collect the file information of the files tracked by git.
+            logger.debug("read git index to generate file info")
+            file_records = _iter_file_info_by_git_index(project_path, git_files, path_filter, summary)
+        elif input_filename is None or not os.path.exists(input_filename):
+            # if source_files.json not exists, collect the file information in project_path.
+            logger.debug("traverse project path to generate file info")
+            filename_depth_map, directories = _walk_project(project_path)
+            file_records = _iter_file_info_by_traverse_project_path(project_path, filename_depth_map, directories, is_vcs_project, path_filter, summary)
+        else:
+            logger.debug("analyse file %s to generate file info" % input_filename)
+            dir_set = _get_directory_name(project_path, input_filename)
+            dir_starts_with_dot_list = [dir_name for dir_name in dir_set if dir_name.startswith('.')]
+            filename_depth_map, directories = _walk_project(project_path, dir_starts_with_dot_list)
+            file_records = _iter_file_info_by_analyse_file(project_path, filename_depth_map, directories, input_filename, is_vcs_project, path_filter, summary, git_files)
+
+        yield from _scan_file_info(file_records, summary, workers, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def generate_file_info(project_path, job_config, step_config, xcalbuild_path=None):
+    """
+    generate the files information of the project
+    :param xcalbuild_path: Current xcalbuild path
+    :param step_config: Current Step's Information
+    :param job_config: Current Job's Info
+    :param project_path: where the project source code root path
+    :return: file_info dictionary content
+    """
+    project_path = _get_real_project_path(project_path)
+
+    summary = FileInfoSummary()
+    file_info = _get_file_info_header(job_config, step_config)
+    file_info['files'] = [file_record.to_dict() for file_record in _iter_project_file_info(project_path, step_config, xcalbuild_path, summary)]
+    file_info.update(_get_file_info_trailer(step_config, summary))
     return file_info
 
 
+def _dump_file_info(outfile, header: dict, files, get_trailer, indent: int = None):
+    """
+    Write the file info as json one file at a time, the output is the same as json.dump with the same indent
+    :param outfile: text file object to write
+    :param header: the fields placed before the files
+    :param files: iterable of FileRecord
+    :param get_trailer: function returning the fields placed after the files, called after all the files are written
+    :param indent: indent of json, None for the compact output
+    :return: None
+    """
+    if indent is None:
+        item_separator, key_separator = ',', ':'
+    else:
+        item_separator, key_separator = ',', ': '
+
+    def new_line(level):
+        return '' if indent is None else '\n' + ' ' * (indent * level)
+
+    def dumps(value, level):
+        text = json.dumps(value, indent = indent, separators = (item_separator, key_separator))
+        return text if indent is None else text.replace('\n', new_line(level))
+
+    outfile.write('{')
+    for key, value in header.items():
+        outfile.write(new_line(1) + json.dumps(key) + key_separator + dumps(value, 1) + item_separator)
+
+    outfile.write(new_line(1) + json.dumps('files') + key_separator + '[')
+    is_empty = True
+    for file in files:
+        if not is_empty:
+            outfile.write(item_separator)
+        outfile.write(new_line(2) + dumps(file.to_dict(), 2))
+        is_empty = False
+    outfile.write(('' if is_empty else new_line(1)) + ']')
+
+    for key, value in get_trailer().items():
+        outfile.write(item_separator + new_line(1) + json.dumps(key) + key_separator + dumps(value, 1))
+    outfile.write(new_line(0) + '}')
+
+
 def generate_file(project_path, job_config, step_config, destination_path=None, filename=None, xcalbuild_path=None):
     """
-    generate the file which contains the file information of the project
+    generate the file which contains the file information of the project.
+    the file info is written while it is generated, so the memory usage does not grow with the number of files
     :param project_path: project path
     :param job_config:  Job's configuration, containing all steps, defined in AgentInvoker
     :param step_config: Step's configuration, singled step defined in the task's configuration
+                        fileInfoCompact in step_config writes the file without indent
     :param destination_path: where to save the file
     :param filename: filename of the generated file
     :param xcalbuild_path: xcalbuild path
@@ -444,18 +963,23 @@ def generate_file(project_path, job_config, step_config, destination_path=None,
     if filename is None:
         filename = FILE_INFO_FILE_NAME
 
+    indent = None if step_config.get("fileInfoCompact") else 1
+    temp_filename = filename + ".tmp"
     try:
-        project_file_info = generate_file_info(project_path, job_config, step_config, xcalbuild_path)
+        project_path = _get_real_project_path(project_path)
+        summary = FileInfoSummary()
+        header = _get_file_info_header(job_config, step_config)
+        with open(temp_filename, 'w') as outfile:
+            _dump_file_info(outfile, header, _iter_project_file_info(project_path, step_config, xcalbuild_path, summary),
+                            lambda: _get_file_info_trailer(step_config, summary), indent)
     except Exception as err:
         logger.error("generate file info failed.")
         logging.exception(err)
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
         raise EFileInfoGatherFail
 
-    if os.path.exists(filename):
-        os.remove(filename)
-
-    with open(filename, 'w') as outfile:
-        json.dump(project_file_info, outfile, indent=1)
+    os.replace(temp_filename, filename)
 
     utility.goback_dir()
 
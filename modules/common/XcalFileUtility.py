@@ -54,6 +54,16 @@ class FilePathResolver(object):
     def get_file_path_in_xcalagent_install_dir(global_ctx, file_name: str):
         return os.path.join(str(global_ctx.get("XCAL_AGENT_INSTALL_DIR")), file_name)
 
+    @staticmethod
+    def get_scan_cache_path(output_path: str, file_name: str):
+        """
+        The output path is per scan, the caches are kept in its parent folder so that they are reused by the next scan
+        :param output_path: output path of the scan
+        :param file_name: file name of the cache
+        :return: path of the cache
+        """
+        return os.path.join(os.path.dirname(os.path.normpath(output_path)), file_name)
+
     def get_file_path_in_job_dir(self, global_ctx, job_config, file_name: str):
         return os.path.join(self.get_job_dir(global_ctx, job_config), file_name)
 
@@ -110,7 +110,11 @@ DEFAULT_CONFIG = {
 #For Plugin
         "fileSystemApi": "/api/file_service/v2/file/file_system", #added for filesystem
         "updateProject": "/api/project_service/v2/project?token={token}", #added for offline agent
-        "getProjectByIdApi": "/api/project_service/v2/project/{projectId}?token={token}"
+        "getProjectByIdApi": "/api/project_service/v2/project/{projectId}?token={token}",
+        "fileChunkUploadInitApi": "/api/file_service/v2/file/upload_session?token={token}",
+        "fileChunkUploadStatusApi": "/api/file_service/v2/file/upload_session/{uploadId}?token={token}",
+        "fileChunkUploadApi": "/api/file_service/v2/file/upload_session/{uploadId}/chunk/{index}?token={token}",
+        "fileChunkUploadCompleteApi": "/api/file_service/v2/file/upload_session/{uploadId}/complete?token={token}"
 },
     "XCAL_BUILD_SCRIPT_PATH": os.path.join("$XCALAGENT", "xcalbuild", os_info, "bin", "xcalbuild"),
     "XCAL_AGENT_INSTALL_DIR": "--autofill--",
@@ -151,6 +155,12 @@ DEFAULT_CONFIG = {
     "runtimeGenMaxMemory": "3300",
     # Miscellaneous Options
     "PRINT_SUBPROCESS_OUTPUT": "NO",
+    # Files not smaller than the threshold are uploaded in chunks (in bytes), only if enabled as the file service
+    # needs the upload session apis
+    "UPLOAD_CHUNK_ENABLED": "NO",
+    "UPLOAD_CHUNK_THRESHOLD": 64 * 1024 * 1024,
+    "UPLOAD_CHUNK_SIZE": 8 * 1024 * 1024,
+    "UPLOAD_CHUNK_WORKERS": 4,
     "collectDiagnosticInfo": "YES",
 
     # Auto clean for c/c++
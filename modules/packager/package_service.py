@@ -6,8 +6,11 @@ import os
 import time
 
 from common.CommonGlobals import SOURCE_CODE_ARCHIVE_FILE_NAME, SOURCE_FILES_NAME, \
-    FILE_INFO_FILE_NAME, AGENT_SOURCE_STORAGE, GERRIT_SOURCE_STORAGE
+    FILE_INFO_FILE_NAME, FILE_INFO_CACHE_FILE_NAME, SOURCE_MANIFEST_FILE_NAME, AGENT_SOURCE_STORAGE, GERRIT_SOURCE_STORAGE
 from common.CompressionUtility import CompressionUtility
+from common.PathFilter import PathFilter
+from common.SourceBlobIndex import SourceBlobIndex
+from common.SourceFileCache import SourceFileCache
 from common.XcalFileUtility import FilePathResolver
 from common import XcalFileInfoCollector
 
@@ -35,7 +38,31 @@ class PackageService(object):
         logger.debug("source_code_path: %s, filename: %s, input_filename: %s, dest_path: %s" % (source_code_path, filename, input_filename, dest_path))
 
         logger.info("Compress start at: %s" % time.asctime())
-        archive_file_path = CompressionUtility.get_archive(filename, source_code_path, input_filename, destination_path=dest_path)
+        path_filter = PathFilter(source_code_path,
+                                 include_patterns=self.job_config.get("sourceIncludePatterns"),
+                                 exclude_patterns=self.job_config.get("sourceExcludePatterns"))
+        if self.job_config.get("sourceArchiveDedup"):
+            # the index of the uploaded blobs is shared by the scans of the project, it is updated by the uploader.
+            # a blob is left out of the pack only if the file cache of the server confirms it is uploaded
+            file_cache = SourceFileCache.from_config(self.job_config)
+            if file_cache is None:
+                logger.warning("api server is not configured, cannot check the uploaded source blobs, pack all of them")
+            blob_index = SourceBlobIndex(SourceBlobIndex.get_index_path(dest_path), self.job_config.get("sourceBlobExpireDays"),
+                                         file_cache)
+            manifest_path = CompressionUtility.get_dedup_archive(SOURCE_MANIFEST_FILE_NAME, source_code_path, input_filename,
+                                                                 destination_path=dest_path,
+                                                                 path_filter=path_filter,
+                                                                 blob_index=blob_index,
+                                                                 compress_level=self.job_config.get("sourceArchiveCompressLevel"),
+                                                                 workers=self.job_config.get("sourceArchiveWorkers"))
+            logger.info("Compress complete at: %s" % time.asctime())
+            logger.debug("Compress source code complete, manifest path: %s" % manifest_path)
+            return
+
+        archive_file_path = CompressionUtility.get_archive(filename, source_code_path, input_filename, destination_path=dest_path,
+                                                           path_filter=path_filter,
+                                                           compress_level=self.job_config.get("sourceArchiveCompressLevel"),
+                                                           workers=self.job_config.get("sourceArchiveWorkers"))
         logger.info("Compress complete at: %s" % time.asctime())
         logger.debug("Compress source code complete, path: %s" % archive_file_path)
 
@@ -52,6 +79,15 @@ class PackageService(object):
         step_config["gitUrl"] = self.job_config.get("gitUrl")
         step_config["inputFileName"] = SOURCE_FILES_NAME
         step_config["uploadSource"] = self.job_config.get("uploadSource")
+        step_config["fileInfoWorkers"] = self.job_config.get("fileInfoWorkers")
+        step_config["fileInfoCompact"] = self.job_config.get("fileInfoCompact", False)
+        if self.job_config.get("fileInfoCache", True):
+            step_config["fileInfoCachePath"] = FilePathResolver.get_scan_cache_path(dest_path, FILE_INFO_CACHE_FILE_NAME)
+        step_config["fileInfoCacheMaxEntries"] = self.job_config.get("fileInfoCacheMaxEntries")
+        step_config["fileInfoCacheVerify"] = self.job_config.get("fileInfoCacheVerify", False)
+        step_config["fileInfoGitIndex"] = self.job_config.get("fileInfoGitIndex", False)
+        step_config["sourceIncludePatterns"] = self.job_config.get("sourceIncludePatterns")
+        step_config["sourceExcludePatterns"] = self.job_config.get("sourceExcludePatterns")
 
         if self.job_config.get("gitUrl"):
             step_config["sourceStorageName"] = GERRIT_SOURCE_STORAGE
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.append(parentdir)
+
+import argparse
+import shutil
+import tempfile
+import time
+
+from common.XcalFileInfoCollector import _file_lines
+
+# (name, number of files, lines per file, bytes per line)
+FILE_SETS = [
+    ("small", 20000, 40, 40),
+    ("medium", 500, 20000, 60),
+    ("giant", 2, 5000000, 80),
+]
+
+
+def file_lines_by_enumerate(filename):
+    """
+    _file_lines as it was before the chunked counting
+    """
+    if not os.path.isfile(filename):
+        return 0
+
+    if not os.access(filename, os.R_OK):
+        return 0
+
+    i = -1
+    with open(filename, 'rb') as f:
+        for i, l in enumerate(f):
+            pass
+    return i + 1
+
+
+def write_files(folder: str, count: int, lines: int, line_size: int):
+    line = b"x" * (line_size - 1) + b"\n"
+    content = line * lines
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, "file_%d.c" % i)
+        with open(path, "wb") as f:
+            f.write(content)
+        paths.append(path)
+    return paths
+
+
+def measure(count_lines, paths: list, repeat: int):
+    """
+    :return: tuple of (best seconds of the repeats, total lines)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        total = sum(count_lines(path) for path in paths)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare _file_lines with counting the lines by enumerate')
+    parser.add_argument('--repeat', '-r', dest = 'repeat', type = int, default = 3, help = 'runs of each set, the best is reported')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for name, count, lines, line_size in FILE_SETS:
+            folder = os.path.join(temp_dir, name)
+            os.makedirs(folder)
+            paths = write_files(folder, count, lines, line_size)
+            # the files are in the page cache after they are written, both are measured without disk reads
+            old_time, old_total = measure(file_lines_by_enumerate, paths, args.repeat)
+            new_time, new_total = measure(_file_lines, paths, args.repeat)
+            assert old_total == new_total, "line counts differ: %d != %d" % (old_total, new_total)
+            print("%-6s %6d files x %8d lines  enumerate %.3fs  _file_lines %.3fs  speedup %.1fx" %
+                  (name, count, lines, old_time, new_time, old_time / new_time))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
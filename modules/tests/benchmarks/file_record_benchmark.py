@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.append(parentdir)
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from common.XcalFileInfoCollector import FileRecord
+
+
+def make_dict(file_id: int, relative_path: str, checksum: int, file_size: int, line_num: int):
+    """
+    File info as it was kept before FileRecord, a dict of str values
+    """
+    return {'fileId': str(file_id),
+            'fileName': os.path.basename(relative_path),
+            'type': "FILE",
+            'depth': str(relative_path.count("/") + 1),
+            'parentPath': os.path.dirname(relative_path),
+            'filePath': "/project/" + relative_path,
+            'relativePath': relative_path,
+            'version': str(1600000000000000000),
+            'checksum': str(checksum),
+            'fileSize': str(file_size),
+            'noOfLines': str(line_num)
+            }
+
+
+def make_record(file_id: int, relative_path: str, checksum: int, file_size: int, line_num: int):
+    return FileRecord(file_id, os.path.basename(relative_path), "FILE", relative_path.count("/") + 1,
+                      os.path.dirname(relative_path), "/project/" + relative_path, relative_path,
+                      1600000000000000000, checksum, file_size, line_num)
+
+
+def measure(make, paths: list):
+    """
+    :return: tuple of (seconds to build, bytes allocated by the records, seconds to serialize, serialized records)
+    """
+    build = lambda: [make(file_id, path, (file_id * 2654435761) & 0xFFFFFFFF, file_id * 37, file_id % 5000)
+                     for file_id, path in enumerate(paths)]
+
+    # tracemalloc slows down the allocations, the memory is measured in a separate build
+    tracemalloc.start()
+    records = build()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+
+    start = time.perf_counter()
+    records = build()
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dump = json.dumps([record if isinstance(record, dict) else record.to_dict() for record in records])
+    return build_time, allocated, time.perf_counter() - start, dump
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare FileRecord with the dict of str file info')
+    parser.add_argument('--files', '-n', dest = 'files', type = int, default = 200000, help = 'number of files')
+    args = parser.parse_args()
+
+    # the paths are shared by both runs, only the memory of the file info is measured
+    paths = ["src/module_%d/sub_%d/file_%d.c" % (i % 97, i % 13, i) for i in range(args.files)]
+
+    results = dict()
+    for name, make in (("dict", make_dict), ("FileRecord", make_record)):
+        build_time, allocated, dump_time, dump = measure(make, paths)
+        results[name] = dump
+        print("%-10s build %.3fs  memory %.1f MiB (%d bytes/file)  serialize %.3fs" %
+              (name, build_time, allocated / 1024 / 1024, allocated // args.files, dump_time))
+
+    print("serialized file info is %s" % ("identical" if results["dict"] == results["FileRecord"] else "DIFFERENT"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from buildtask.xcal_build_task import XcalBuildTask
+from common import BuildConcurrency as concurrency_module
+from common.BuildConcurrency import BuildConcurrency
+
+VirtualMemory = namedtuple("VirtualMemory", ["available"])
+GIB = 1024 * 1024 * 1024
+
+
+class InjectJobsTest(unittest.TestCase):
+
+    def _check(self, cases: list, environment: dict = None):
+        for build_command, expected in cases:
+            self.assertEqual(BuildConcurrency.inject_jobs(build_command, 4, environment or dict()), expected,
+                             (build_command, environment))
+
+    def test_make(self):
+        self._check([("make", "make -j4"),
+                     ("make all", "make -j4 all"),
+                     ("/usr/bin/gmake -C src all", "/usr/bin/gmake -j4 -C src all"),
+                     ("CC=gcc CFLAGS='-O2 -g' make all", "CC=gcc CFLAGS='-O2 -g' make -j4 all"),
+                     ("make && make install", "make -j4 && make install"),
+                     # the j of -Cjdir is the directory of -C
+                     ("make -Cjdir", "make -j4 -Cjdir")])
+
+    def test_make_jobs_kept(self):
+        self._check([("make -j8", "make -j8"),
+                     ("make -j 8 all", "make -j 8 all"),
+                     ("make -Bj2", "make -Bj2"),
+                     ("make --jobs=3", "make --jobs=3"),
+                     ("make -k -j", "make -k -j")])
+
+    def test_make_flags(self):
+        for make_flags in ("-j2", "kj", "ks -j4", "--jobserver-auth=3,4", " -k --jobs=2"):
+            self._check([("make all", "make all")], {"MAKEFLAGS": make_flags})
+        self._check([("make all", "make all")], {"GNUMAKEFLAGS": "-j2"})
+        self._check([("MAKEFLAGS=-j2 make all", "MAKEFLAGS=-j2 make all")])
+        # the flags without the number of jobs
+        for make_flags in ("k", "-k -s", "--no-print-directory", "-Cjdir"):
+            self._check([("make all", "make -j4 all")], {"MAKEFLAGS": make_flags})
+
+    def test_ninja(self):
+        self._check([("ninja", "ninja -j4"),
+                     ("ninja -C build", "ninja -j4 -C build"),
+                     ("ninja -j2 -C build", "ninja -j2 -C build"),
+                     ("ninja -Cjbuild", "ninja -j4 -Cjbuild")])
+        # ninja does not read MAKEFLAGS
+        self._check([("ninja -C build", "ninja -j4 -C build")], {"MAKEFLAGS": "-j2"})
+
+    def test_gradle(self):
+        self._check([("gradle build", "gradle build --max-workers=4"),
+                     ("./gradlew assemble ", "./gradlew assemble --max-workers=4"),
+                     ("./gradlew build --max-workers=2", "./gradlew build --max-workers=2"),
+                     ("./gradlew clean && ./gradlew build", "./gradlew clean && ./gradlew build")])
+
+    def test_cmake(self):
+        # cmake --build reads the number of jobs from the environment
+        self._check([("cmake --build build", "cmake --build build")])
+
+        self.assertEqual(BuildConcurrency.get_build_environment(4, {"PATH": "/bin"}),
+                         {"PATH": "/bin", "CMAKE_BUILD_PARALLEL_LEVEL": "4"})
+        self.assertEqual(BuildConcurrency.get_build_environment(4, {"CMAKE_BUILD_PARALLEL_LEVEL": "2"}),
+                         {"CMAKE_BUILD_PARALLEL_LEVEL": "2"})
+
+    def test_other_commands(self):
+        self._check([("./build.sh", "./build.sh"),
+                     ("bazel build //...", "bazel build //..."),
+                     ("CC=gcc", "CC=gcc"),
+                     ("make 'unterminated", "make 'unterminated")])
+
+
+class GetBuildJobsTest(unittest.TestCase):
+
+    def _get_build_jobs(self, job_config: dict, cpu_count: int = 8, available_memory: int = 64 * GIB):
+        with mock.patch.object(BuildConcurrency, "get_cpu_count", return_value=cpu_count), \
+                mock.patch.object(concurrency_module.psutil, "virtual_memory",
+                                  return_value=VirtualMemory(available_memory)):
+            return XcalBuildTask._get_build_jobs(job_config)
+
+    def test_not_set(self):
+        self.assertEqual(self._get_build_jobs(dict()), (None, None))
+
+    def test_number(self):
+        self.assertEqual(self._get_build_jobs({"buildJobs": "6"}), (6, None))
+        self.assertEqual(self._get_build_jobs({"buildJobs": 0}), (1, None))
+
+    def test_auto(self):
+        self.assertEqual(self._get_build_jobs({"buildJobs": "auto"}), (8, None))
+        # bounded by the available memory and buildMaxJobs
+        self.assertEqual(self._get_build_jobs({"buildJobs": "AUTO"}, available_memory=3 * GIB), (3, None))
+        self.assertEqual(self._get_build_jobs({"buildJobs": "auto", "buildMemoryPerJob": 4 * GIB}), (8, None))
+        self.assertEqual(self._get_build_jobs({"buildJobs": "auto", "buildMemoryPerJob": 16 * GIB}), (4, None))
+        self.assertEqual(self._get_build_jobs({"buildJobs": "auto", "buildMaxJobs": 2}), (2, None))
+        self.assertEqual(self._get_build_jobs({"buildJobs": "auto"}, available_memory=GIB // 2), (1, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
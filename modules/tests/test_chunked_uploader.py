@@ -0,0 +1,260 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import http.server
+import json
+import re
+import shutil
+import socketserver
+import tempfile
+import threading
+import unittest
+import copy
+import zlib
+from unittest import mock
+
+import requests
+
+from common.ChunkedUploader import ChunkedUploader, ChunkedUploadUnsupported
+from common.XcalConnect import Connector
+from common.XcalGlobals import DEFAULT_CONFIG
+from common.XcalLogger import XcalLogger
+
+CHUNK_SIZE = 64 * 1024
+TOKEN = "test-token"
+API_SERVER = {
+    "fileChunkUploadInitApi": "/upload_session?token={token}",
+    "fileChunkUploadStatusApi": "/upload_session/{uploadId}?token={token}",
+    "fileChunkUploadApi": "/upload_session/{uploadId}/chunk/{index}?token={token}",
+    "fileChunkUploadCompleteApi": "/upload_session/{uploadId}/complete?token={token}",
+}
+
+
+class UploadSessionHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Stand-in of the upload session apis of the file service, the state is kept in the server
+    """
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, code: int, content: dict):
+        body = json.dumps(content).encode("UTF-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding") != "chunked":
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        # a streamed body, e.g. MultipartStream
+        chunks = []
+        size = int(self.rfile.readline().split(b";")[0], 16)
+        while size > 0:
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+            size = int(self.rfile.readline().split(b";")[0], 16)
+        self.rfile.readline()
+        return b"".join(chunks)
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.split("?")[0]
+        if path == "/upload_session":
+            if self.server.init_status != 200:
+                return self._reply(self.server.init_status, {})
+            upload_id = "session-%d" % len(self.server.sessions)
+            self.server.sessions[upload_id] = dict()
+            return self._reply(200, {"uploadId": upload_id})
+        match = re.match(r"/upload_session/([\w-]+)/complete$", path)
+        if match is not None:
+            chunks = self.server.sessions.pop(match.group(1))
+            content = b"".join(chunks[index] for index in sorted(chunks))
+            if str(zlib.crc32(content)) != json.loads(body.decode("UTF-8"))["file_checksum"]:
+                return self._reply(400, {})
+            self.server.files.append(content)
+            return self._reply(200, {"id": "file-%d" % len(self.server.files)})
+        if path == "/upload_file":
+            self.server.whole_files.append(body)
+            return self._reply(200, {"id": "whole-%d" % len(self.server.whole_files)})
+        self._reply(404, {})
+
+    def do_GET(self):
+        self._read_body()
+        match = re.match(r"/upload_session/([\w-]+)$", self.path.split("?")[0])
+        if match is None or match.group(1) not in self.server.sessions:
+            return self._reply(404, {})
+        self._reply(200, {"chunks": sorted(self.server.sessions[match.group(1)])})
+
+    def do_PUT(self):
+        body = self._read_body()
+        match = re.match(r"/upload_session/([\w-]+)/chunk/(\d+)$", self.path.split("?")[0])
+        index = int(match.group(2))
+        self.server.chunk_requests.append(index)
+        if index in self.server.failed_chunks:
+            self.server.failed_chunks.remove(index)
+            return self._reply(503, {})
+        if str(zlib.crc32(body)) != self.headers["X-Chunk-Checksum"]:
+            return self._reply(400, {})
+        self.server.sessions[match.group(1)][index] = body
+        self._reply(200, {})
+
+    def log_message(self, *args):
+        pass
+
+
+class UploadSessionServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), UploadSessionHandler)
+        self.sessions = dict()
+        self.files = []
+        self.chunk_requests = []
+        self.failed_chunks = set()
+        self.init_status = 200
+        self.whole_files = []
+
+
+class TestConnector(object):
+    """
+    The part of XcalConnect.Connector used by ChunkedUploader, without retries
+    """
+
+    def __init__(self, host_url: str):
+        self.host_url = host_url
+        self.api_server = API_SERVER
+
+    def send_http_request(self, url: str, data, header: dict, files: dict = None, timeout: int = 5000, method: str = "PUT"):
+        if method == "POST":
+            return requests.post(url, json=data, headers=header)
+        if method == "GET":
+            return requests.get(url, headers=header)
+        if method == "PUT_DATA":
+            return requests.put(url, data=data, headers=header)
+        raise ValueError("unknown http method %s" % method)
+
+
+class ChunkedUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = UploadSessionServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.connector = TestConnector("http://127.0.0.1:%d" % self.server.server_port)
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, "preprocess.tar.gz")
+        self.content = os.urandom(CHUNK_SIZE * 5 + CHUNK_SIZE // 2)
+        with open(self.file_path, "wb") as upload_file:
+            upload_file.write(self.content)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def _get_uploader(self):
+        return ChunkedUploader(self.connector, TOKEN, self.file_path, "SOURCE", chunk_size=CHUNK_SIZE, workers=3)
+
+    def test_upload_in_chunks(self):
+        file_id = self._get_uploader().upload()
+
+        self.assertEqual(file_id, "file-1")
+        self.assertEqual(self.server.files, [self.content])
+        self.assertEqual(sorted(self.server.chunk_requests), list(range(6)))
+        self.assertFalse(os.path.exists(self.file_path + ".upload.json"))
+
+    def test_resume_from_received_chunks(self):
+        self.server.failed_chunks.add(3)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self._get_uploader().upload()
+        self.assertTrue(os.path.exists(self.file_path + ".upload.json"))
+        received = set(next(iter(self.server.sessions.values())))
+        self.assertNotIn(3, received)
+
+        self.server.chunk_requests.clear()
+        file_id = self._get_uploader().upload()
+
+        self.assertEqual(file_id, "file-1")
+        self.assertEqual(self.server.files, [self.content])
+        # only the chunks not received by the session are uploaded again
+        self.assertEqual(sorted(self.server.chunk_requests), sorted(set(range(6)) - received))
+
+    def test_restart_when_file_changed(self):
+        self.server.failed_chunks.add(0)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self._get_uploader().upload()
+
+        self.content = os.urandom(CHUNK_SIZE * 2)
+        with open(self.file_path, "wb") as upload_file:
+            upload_file.write(self.content)
+        self.server.chunk_requests.clear()
+        self._get_uploader().upload()
+
+        self.assertEqual(self.server.files, [self.content])
+        self.assertEqual(sorted(self.server.chunk_requests), [0, 1])
+
+    def test_unsupported_when_init_rejected(self):
+        for status_code in (400, 401, 403, 404, 405, 415, 500, 501, 503):
+            self.server.init_status = status_code
+            with self.assertRaises(ChunkedUploadUnsupported) as context:
+                self._get_uploader().upload()
+            self.assertEqual(context.exception.permanent, status_code in (404, 405, 501))
+        self.assertEqual(self.server.chunk_requests, [])
+
+
+class ConnectorFallbackTest(unittest.TestCase):
+    """
+    Connector.upload_file falls back to the whole file upload when the upload session is not created
+    """
+
+    def setUp(self):
+        self.server = UploadSessionServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, "preprocess.tar.gz")
+        self.content = os.urandom(CHUNK_SIZE * 2)
+        with open(self.file_path, "wb") as upload_file:
+            upload_file.write(self.content)
+
+        api_server = copy.deepcopy(DEFAULT_CONFIG["API_SERVER"])
+        api_server.update(API_SERVER)
+        api_server["URL"] = "http://127.0.0.1:%d" % self.server.server_port
+        api_server["fileInfoUploadApi"] = "/upload_file"
+        self.connector = Connector(XcalLogger("ConnectorFallbackTest", "setUp"), api_server)
+        self.global_ctx = {"UPLOAD_CHUNK_ENABLED": "YES", "UPLOAD_CHUNK_THRESHOLD": 0, "UPLOAD_CHUNK_SIZE": CHUNK_SIZE}
+        self.job_config = {"taskConfig": {"token": TOKEN}}
+        patcher = mock.patch.object(Connector, "chunked_upload_supported", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_other_error_falls_back_for_the_file(self):
+        # e.g. an expired token of the proxy, which is not retried
+        self.server.init_status = 401
+
+        self.assertEqual(self.connector.upload_file(self.global_ctx, self.job_config, self.file_path), {"fileId": "whole-1"})
+        self.assertIn(self.content, self.server.whole_files[0])
+        self.assertTrue(Connector.chunked_upload_supported)
+
+        self.server.init_status = 200
+        self.assertEqual(self.connector.upload_file(self.global_ctx, self.job_config, self.file_path), {"fileId": "file-1"})
+
+    def test_unsupported_turns_chunked_upload_off(self):
+        self.server.init_status = 404
+
+        self.assertEqual(self.connector.upload_file(self.global_ctx, self.job_config, self.file_path), {"fileId": "whole-1"})
+        self.assertFalse(Connector.chunked_upload_supported)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import gzip
+import io
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from common import CompressionUtility as compression_module
+from common.CompressionUtility import CompressionUtility, ParallelGzipWriter
+from common.XcalException import XcalException
+from common.XcalLogger import XcalLogger
+
+# extra field id of the ZIP64 sizes and offset
+ZIP64_EXTRA_ID = b"\x01\x00"
+
+
+class GetArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.project_path = os.path.join(self.temp_dir, "project")
+        self.output_path = os.path.join(self.temp_dir, "output")
+        os.makedirs(os.path.join(self.project_path, "src", "sub"))
+        self.contents = {
+            "src/main.c": b"int main() { return 0; }\n" * 100,
+            "src/sub/util.c": os.urandom(200 * 1024),
+            "src/sub/empty.h": b"",
+            "src/big.c": b"/* generated */\n" * 64 * 1024,
+        }
+        for relative_path, content in self.contents.items():
+            with open(os.path.join(self.project_path, relative_path), "wb") as source_file:
+                source_file.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _check_archive(self, archive_path: str):
+        with zipfile.ZipFile(archive_path) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(sorted(archive.namelist()), sorted(self.contents))
+            for relative_path, content in self.contents.items():
+                self.assertEqual(archive.read(relative_path), content)
+            return {info.filename: info for info in archive.infolist()}
+
+    def test_stored_archive(self):
+        archive_path = CompressionUtility.get_archive("source_code.zip", self.project_path,
+                                                      destination_path=self.output_path, workers=3)
+
+        infos = self._check_archive(archive_path)
+        self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in infos.values()))
+
+    def test_deflated_archive(self):
+        # the large file is written by zipfile from the file instead of read by the worker threads
+        with mock.patch.object(compression_module, "ARCHIVE_READ_MAX_SIZE", 512 * 1024):
+            archive_path = CompressionUtility.get_archive("source_code.zip", self.project_path,
+                                                          destination_path=self.output_path, compress_level=6, workers=3)
+
+        infos = self._check_archive(archive_path)
+        self.assertTrue(all(info.compress_type == zipfile.ZIP_DEFLATED for info in infos.values()))
+        self.assertLess(infos["src/big.c"].compress_size, infos["src/big.c"].file_size)
+
+    def test_zip64_archive(self):
+        # lower the ZIP64 threshold instead of archiving files of 2G, as the zipfile tests of CPython do. both the
+        # member compressed by the worker threads and the one streamed from the file are beyond it
+        with mock.patch.object(compression_module, "ZIP64_LIMIT", 64 * 1024), \
+                mock.patch.object(compression_module, "ARCHIVE_READ_MAX_SIZE", 512 * 1024):
+            for compress_level in (None, 6):
+                archive_path = CompressionUtility.get_archive("source_code_%s.zip" % compress_level, self.project_path,
+                                                              destination_path=self.output_path,
+                                                              compress_level=compress_level, workers=3)
+                infos = self._check_archive(archive_path)
+                for relative_path in ("src/sub/util.c", "src/big.c"):
+                    self.assertTrue(infos[relative_path].extra.startswith(ZIP64_EXTRA_ID))
+
+    def test_zip64_end_record(self):
+        # more members than the end record holds, the count is only in the ZIP64 end record
+        with mock.patch.object(compression_module, "ZIP_FILECOUNT_LIMIT", 2):
+            archive_path = CompressionUtility.get_archive("source_code.zip", self.project_path,
+                                                          destination_path=self.output_path, compress_level=6, workers=3)
+
+        self._check_archive(archive_path)
+
+    def test_non_ascii_name(self):
+        self.contents["src/\u6e90\u7801.c"] = b"int x;\n"
+        with open(os.path.join(self.project_path, "src", "\u6e90\u7801.c"), "wb") as source_file:
+            source_file.write(self.contents["src/\u6e90\u7801.c"])
+
+        archive_path = CompressionUtility.get_archive("source_code.zip", self.project_path,
+                                                      destination_path=self.output_path, workers=3)
+
+        self._check_archive(archive_path)
+
+    @unittest.skipUnless(shutil.which("unzip"), "unzip is not installed")
+    def test_unzip_reads_archive(self):
+        with mock.patch.object(compression_module, "ZIP64_LIMIT", 64 * 1024), \
+                mock.patch.object(compression_module, "ARCHIVE_READ_MAX_SIZE", 512 * 1024):
+            archive_path = CompressionUtility.get_archive("source_code.zip", self.project_path,
+                                                          destination_path=self.output_path, compress_level=6, workers=3)
+
+        result = subprocess.run(["unzip", "-t", archive_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+    def test_pending_bytes_bounded(self):
+        in_flight = []
+        peak = [0]
+
+        def read_member(file_path, arcname):
+            in_flight.append(file_path)
+            return file_path
+
+        members = [(os.path.join(self.project_path, relative_path), relative_path) for relative_path in sorted(self.contents)] * 20
+        # a round of the members is about 1.2 MiB, the window of 16 members would hold several rounds
+        with mock.patch.object(compression_module, "ARCHIVE_PENDING_MAX_SIZE", 1536 * 1024):
+            for _, result in compression_module._map_members(read_member, members, 4, compression_module._get_member_weight):
+                peak[0] = max(peak[0], sum(compression_module._get_member_weight(path, None) for path in in_flight))
+                in_flight.remove(result)
+
+        self.assertLessEqual(peak[0], 1536 * 1024)
+
+    def test_serial_archive_is_same(self):
+        serial_path = CompressionUtility.get_archive("serial.zip", self.project_path,
+                                                     destination_path=self.output_path, compress_level=6, workers=1)
+        parallel_path = CompressionUtility.get_archive("parallel.zip", self.project_path,
+                                                       destination_path=self.output_path, compress_level=6, workers=4)
+
+        with open(serial_path, "rb") as serial_file, open(parallel_path, "rb") as parallel_file:
+            self.assertEqual(serial_file.read(), parallel_file.read())
+
+
+class ExtractTarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.dest_dir = os.path.join(self.temp_dir, "dest")
+        self.outside_path = os.path.join(self.temp_dir, "outside.h")
+        with open(self.outside_path, "wb") as outside_file:
+            outside_file.write(b"int outside;\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write_tar(self, members: list):
+        """
+        :param members: list of (name, type, content or link name)
+        :return: path of the tar file
+        """
+        tar_path = os.path.join(self.temp_dir, "source_code.tar.gz")
+        with tarfile.open(tar_path, "w:gz") as tar_file:
+            for name, member_type, value in members:
+                info = tarfile.TarInfo(name)
+                info.type = member_type
+                if member_type == tarfile.REGTYPE:
+                    info.size = len(value)
+                    tar_file.addfile(info, io.BytesIO(value))
+                else:
+                    info.linkname = value
+                    tar_file.addfile(info)
+        return tar_path
+
+    def _extract(self, members: list):
+        CompressionUtility._extract_tar(self._write_tar(members), self.dest_dir)
+
+    def test_links_inside(self):
+        self._extract([("include/a.h", tarfile.REGTYPE, b"int a;\n"),
+                       ("include/rel.h", tarfile.SYMTYPE, "a.h"),
+                       ("src/up.h", tarfile.SYMTYPE, "../include/a.h"),
+                       ("abs.h", tarfile.SYMTYPE, os.path.join(self.dest_dir, "include", "a.h")),
+                       ("hard.h", tarfile.LNKTYPE, "include/a.h")])
+
+        for name in ("include/rel.h", "src/up.h", "abs.h", "hard.h"):
+            with open(os.path.join(self.dest_dir, name), "rb") as link_file:
+                self.assertEqual(link_file.read(), b"int a;\n", name)
+
+    def test_member_traversal(self):
+        with self.assertRaises(XcalException):
+            self._extract([("../escaped.h", tarfile.REGTYPE, b"int escaped;\n")])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, "escaped.h")))
+
+    def test_symlink_traversal(self):
+        for link_name in ("../../outside.h", "../include/../../outside.h", self.outside_path):
+            with self.assertRaises(XcalException, msg=link_name):
+                self._extract([("include/link.h", tarfile.SYMTYPE, link_name)])
+            self.assertFalse(os.path.lexists(os.path.join(self.dest_dir, "include", "link.h")), link_name)
+
+    def test_write_through_symlink(self):
+        # the link directory is accepted, the member written through it is not
+        os.makedirs(self.dest_dir)
+        os.symlink(self.temp_dir, os.path.join(self.dest_dir, "out"))
+
+        with self.assertRaises(XcalException):
+            self._extract([("out/outside.h", tarfile.REGTYPE, b"int overwritten;\n")])
+        with open(self.outside_path, "rb") as outside_file:
+            self.assertEqual(outside_file.read(), b"int outside;\n")
+
+    def test_hardlink_traversal(self):
+        with self.assertRaises(XcalException):
+            self._extract([("hard.h", tarfile.LNKTYPE, "../outside.h")])
+        self.assertFalse(os.path.lexists(os.path.join(self.dest_dir, "hard.h")))
+
+
+class CompressTarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.temp_dir, "preprocess")
+        os.makedirs(os.path.join(self.source_path, "sub"))
+        # larger than GZIP_BLOCK_SIZE, so that the parallel gzip file has several members
+        self.contents = {"a.i": b"int a;\n" * 400000, "sub/b.ii": os.urandom(300 * 1024), "sub/empty.i": b""}
+        for relative_path, content in self.contents.items():
+            with open(os.path.join(self.source_path, relative_path), "wb") as source_file:
+                source_file.write(content)
+        self.logger = XcalLogger("CompressTarTest", "setUp")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _read_tar(self, package_path: str):
+        with tarfile.open(package_path) as tar_file:
+            return {member.name: tar_file.extractfile(member).read() if member.isfile() else None
+                    for member in tar_file.getmembers()}
+
+    def test_gzip_writer_round_trip(self):
+        for data in (b"", b"x", os.urandom(1000), b"int a;\n" * 1000):
+            output = io.BytesIO()
+            with ParallelGzipWriter(output, workers=3, block_size=256) as writer:
+                for offset in range(0, len(data), 100):
+                    writer.write(data[offset:offset + 100])
+                self.assertEqual(writer.tell(), len(data))
+
+            self.assertEqual(gzip.decompress(output.getvalue()), data)
+
+    def test_parallel_gzip_tar_same_as_serial(self):
+        # the compressed bytes differ, the tar streams are the same
+        serial_path = os.path.join(self.temp_dir, "serial.tar.gz")
+        parallel_path = os.path.join(self.temp_dir, "parallel.tar.gz")
+        CompressionUtility.compress_tar_package(self.logger, self.source_path, serial_path, workers=1)
+        CompressionUtility.compress_tar_package(self.logger, self.source_path, parallel_path, workers=4)
+
+        with gzip.open(serial_path) as serial_file, gzip.open(parallel_path) as parallel_file:
+            self.assertEqual(serial_file.read(), parallel_file.read())
+        contents = self._read_tar(parallel_path)
+        for relative_path, content in self.contents.items():
+            self.assertEqual(contents["preprocess/" + relative_path], content)
+
+    def test_extract_round_trip(self):
+        for mode, package_name in (("x:gz", "preprocess.tar.gz"), ("x", "preprocess.tar")):
+            package_path = os.path.join(self.temp_dir, package_name)
+            dest_dir = os.path.join(self.temp_dir, "extract_" + package_name)
+            CompressionUtility.compress_tar_from_dir(self.logger, self.source_path, package_path, mode, workers=2)
+
+            CompressionUtility.extract_file(self.logger, package_path, dest_dir, False)
+
+            for relative_path, content in self.contents.items():
+                with open(os.path.join(dest_dir, relative_path), "rb") as extracted_file:
+                    self.assertEqual(extracted_file.read(), content, (mode, relative_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ElementTree
+
+from common.CppcheckResultCache import CppcheckResultCache
+
+CPPCHECK_VERSION = "Cppcheck 2.3"
+
+
+class CppcheckResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.temp_dir, "cppcheck_cache.db")
+        self.suppression_path = self._write("suppressions.txt", "misra-c2012-2.7\n")
+        self.main_path = self._write("main.c", '#include "util.h"\nint main() { return util(); }\n')
+        self.other_path = self._write("other.c", "int other;\n")
+        self.util_path = self._write("util.h", '#include "types.h"\nint util(void);\n')
+        self.types_path = self._write("types.h", "typedef int util_t;\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, name: str, content: str):
+        file_path = os.path.join(self.temp_dir, name)
+        with open(file_path, "w") as source_file:
+            source_file.write(content)
+        return file_path
+
+    def _open(self):
+        return CppcheckResultCache(self.cache_path, self.suppression_path, CPPCHECK_VERSION)
+
+    def _put_all(self):
+        with self._open() as cache:
+            keys = cache.get_keys([self.main_path, self.other_path], workers=1)
+            for file_path, key in keys.items():
+                error = ElementTree.Element("error", {"id": "misra-c2012-8.4", "file": file_path})
+                cache.put(key, [error])
+        return keys
+
+    def test_hit(self):
+        keys = self._put_all()
+
+        with self._open() as cache:
+            self.assertEqual(cache.get_keys([self.main_path, self.other_path], workers=1), keys)
+            errors = cache.get(keys[self.main_path])
+        self.assertEqual([error.get("file") for error in errors], [self.main_path])
+
+    def test_header_change_invalidates_entry(self):
+        keys = self._put_all()
+        # the header is included by util.h, not by main.c itself
+        self._write("types.h", "typedef long util_t;\n")
+
+        with self._open() as cache:
+            new_keys = cache.get_keys([self.main_path, self.other_path], workers=1)
+            self.assertNotEqual(new_keys[self.main_path], keys[self.main_path])
+            self.assertIsNone(cache.get(new_keys[self.main_path]))
+            self.assertEqual(new_keys[self.other_path], keys[self.other_path])
+            self.assertIsNotNone(cache.get(new_keys[self.other_path]))
+
+    def test_missing_header_is_part_of_key(self):
+        keys = self._put_all()
+        os.remove(self.types_path)
+
+        with self._open() as cache:
+            self.assertNotEqual(cache.get_keys([self.main_path], workers=1)[self.main_path], keys[self.main_path])
+
+    def test_macro_include_not_cached(self):
+        macro_path = self._write("macro.c", "#include HEADER\nint macro;\n")
+
+        with self._open() as cache:
+            self.assertNotIn(macro_path, cache.get_keys([macro_path, self.other_path], workers=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
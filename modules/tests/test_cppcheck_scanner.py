@@ -0,0 +1,97 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ElementTree
+from unittest import mock
+
+from common.CppcheckScanner import CppcheckScanner, CPPCHECK_SHARD_FOLDER_NAME
+
+# stand-in of cppcheck, reports one error per file of the file list and records the file list of each run
+FAKE_CPPCHECK = """#!%s
+import os, sys
+file_list = [arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--file-list=")][0]
+with open(file_list) as f:
+    files = f.read().split("\\n")
+with open(os.environ["FAKE_CPPCHECK_RUNS"], "a") as f:
+    f.write(",".join(files) + "\\n")
+if any(name.endswith("fail.c") for name in files):
+    sys.exit(1)
+sys.stderr.write('<?xml version="1.0" encoding="UTF-8"?>\\n<results version="2"><cppcheck version="2.3"/><errors>')
+for name in files:
+    sys.stderr.write('<error id="misra-c2012-8.4" severity="style" msg="m"><location file="%%s" line="1"/></error>' %% name)
+sys.stderr.write('</errors></results>\\n')
+"""
+
+
+@unittest.skipUnless(os.name == "posix", "the stand-in of cppcheck is a script")
+class CppcheckScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.temp_dir, "bin")
+        os.makedirs(bin_dir)
+        cppcheck_path = os.path.join(bin_dir, "cppcheck")
+        with open(cppcheck_path, "w") as script:
+            script.write(FAKE_CPPCHECK % sys.executable)
+        os.chmod(cppcheck_path, 0o755)
+        self.runs_path = os.path.join(self.temp_dir, "runs.txt")
+        patcher = mock.patch.dict(os.environ, {"PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+                                               "FAKE_CPPCHECK_RUNS": self.runs_path})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.result_dir = os.path.join(self.temp_dir, "result")
+        os.makedirs(self.result_dir)
+        self.output_file = os.path.join(self.result_dir, "misra.xml")
+        self.log_path = os.path.join(self.temp_dir, "cppcheck.log")
+        self.file_list = [self._write("file_%d.c" % i) for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, name: str):
+        file_path = os.path.join(self.temp_dir, name)
+        with open(file_path, "w") as source_file:
+            source_file.write("int %s;\n" % name.split(".")[0])
+        return file_path
+
+    def _get_runs(self):
+        with open(self.runs_path) as runs:
+            return [line.strip().split(",") for line in runs]
+
+    def _get_error_files(self):
+        return sorted(location.get("file") for location in ElementTree.parse(self.output_file).iter("location"))
+
+    def test_single_process_by_default(self):
+        self.assertTrue(CppcheckScanner.scan(self.file_list, "suppressions.txt", self.output_file, self.log_path))
+
+        self.assertEqual(self._get_runs(), [self.file_list])
+        self.assertEqual(self._get_error_files(), self.file_list)
+        self.assertFalse(os.path.exists(os.path.join(self.result_dir, CPPCHECK_SHARD_FOLDER_NAME)))
+
+    def test_shards_merged(self):
+        self.assertTrue(CppcheckScanner.scan(self.file_list, "suppressions.txt", self.output_file, self.log_path,
+                                             workers=2, shard=True, max_files=2))
+
+        self.assertEqual(sorted(self._get_runs()), [self.file_list[0:2], self.file_list[2:4], self.file_list[4:]])
+        self.assertEqual(self._get_error_files(), self.file_list)
+
+    def test_failed_shards_kept(self):
+        file_list = self.file_list + [self._write("fail.c")]
+
+        self.assertFalse(CppcheckScanner.scan(file_list, "suppressions.txt", self.output_file, self.log_path,
+                                              shard=True, max_files=2))
+        self.assertTrue(os.path.isdir(os.path.join(self.result_dir, CPPCHECK_SHARD_FOLDER_NAME)))
+
+
+if __name__ == "__main__":
+    unittest.main()
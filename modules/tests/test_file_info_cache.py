@@ -0,0 +1,91 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import shutil
+import tempfile
+import unittest
+
+from common.FileInfoCache import FileInfoCache
+from common.XcalFileInfoCollector import FileRecord, FileInfoSummary, _scan_file, _scan_file_info
+
+
+class FileInfoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.temp_dir, "file_info_cache.db")
+        self.file_path = os.path.join(self.temp_dir, "main.c")
+        self._write(self.file_path, b"int main() {\n  return 0;\n}\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @staticmethod
+    def _write(file_path: str, data: bytes):
+        with open(file_path, "wb") as source_file:
+            source_file.write(data)
+
+    def _scan(self, cache: FileInfoCache, blob_id: str = None):
+        file_record = FileRecord(1, "main.c", "FILE", 1, self.temp_dir, self.file_path, "/main.c", "1", blob_id=blob_id)
+        file_record, = _scan_file_info([file_record], FileInfoSummary(), 1, cache)
+        return file_record.checksum, file_record.file_size, file_record.line_num
+
+    def test_hit_and_miss(self):
+        signature = FileInfoCache.get_signature(self.file_path)
+        with FileInfoCache(self.cache_path) as cache:
+            self.assertIsNone(cache.get(self.file_path, signature))
+            cache.put(self.file_path, signature, (123, 27, 3))
+
+        with FileInfoCache(self.cache_path) as cache:
+            self.assertEqual(cache.get(self.file_path, signature), (123, 27, 3))
+            self.assertIsNone(cache.get(os.path.join(self.temp_dir, "other.c"), signature))
+            self.assertEqual((cache.hit_count, cache.miss_count), (1, 1))
+
+    def test_stale_signature(self):
+        with FileInfoCache(self.cache_path) as cache:
+            self.assertEqual(self._scan(cache), _scan_file(self.file_path))
+
+        self._write(self.file_path, b"int main() { return 1; }\n")
+        os.utime(self.file_path, ns=(0, 0))
+        with FileInfoCache(self.cache_path) as cache:
+            self.assertIsNone(cache.get(self.file_path, FileInfoCache.get_signature(self.file_path)))
+            self.assertEqual(self._scan(cache), _scan_file(self.file_path))
+
+    def test_eviction(self):
+        with FileInfoCache(self.cache_path, max_entries=2) as cache:
+            cache.put("/old.c", (1, 1, 1), (1, 1, 1))
+        with FileInfoCache(self.cache_path, max_entries=2) as cache:
+            cache.put("/new.c", (2, 2, 2), (2, 2, 2))
+            cache.put("/newer.c", (3, 3, 3), (3, 3, 3))
+            cache.put_blob("blob", (4, 4, 4))
+
+        with FileInfoCache(self.cache_path, max_entries=2) as cache:
+            self.assertIsNone(cache.get("/old.c", (1, 1, 1)))
+            self.assertEqual(cache.get("/new.c", (2, 2, 2)), (2, 2, 2))
+            self.assertEqual(cache.get("/newer.c", (3, 3, 3)), (3, 3, 3))
+            self.assertEqual(cache.get_blob("blob"), (4, 4, 4))
+
+    def test_verify_corrects_stale_entry(self):
+        signature = FileInfoCache.get_signature(self.file_path)
+        with FileInfoCache(self.cache_path) as cache:
+            cache.put(self.file_path, signature, (1, 1, 1))
+            cache.put_blob("blob", (1, 1, 1))
+
+        with FileInfoCache(self.cache_path, verify=True) as cache:
+            self.assertEqual(self._scan(cache), _scan_file(self.file_path))
+            self.assertEqual(self._scan(cache, "blob"), _scan_file(self.file_path))
+            self.assertEqual(cache.mismatch_count, 2)
+
+        with FileInfoCache(self.cache_path) as cache:
+            self.assertEqual(cache.get(self.file_path, signature), _scan_file(self.file_path))
+            self.assertEqual(cache.get_blob("blob"), _scan_file(self.file_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
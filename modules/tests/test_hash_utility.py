@@ -0,0 +1,75 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import hashlib
+import shutil
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+from common import HashUtility as hash_module
+from common.HashUtility import CRC32, HashUtility
+
+# chunk size used by the tests, so that the files end before, at and after the chunk boundaries
+TEST_CHUNK_SIZE = 1024
+
+
+class HashUtilityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.contents = dict()
+        for size in (0, 1, TEST_CHUNK_SIZE - 1, TEST_CHUNK_SIZE, TEST_CHUNK_SIZE + 1, TEST_CHUNK_SIZE * 5 // 2):
+            file_path = os.path.join(self.temp_dir, "file_%d.bin" % size)
+            content = os.urandom(size)
+            with open(file_path, "wb") as data_file:
+                data_file.write(content)
+            self.contents[file_path] = content
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _check_digests(self):
+        for file_path, content in self.contents.items():
+            digests = HashUtility.get_file_digests(file_path, ("crc32", "md5", "sha1", "sha256"))
+
+            self.assertEqual(digests, {"crc32": str(zlib.crc32(content)),
+                                       "md5": hashlib.md5(content).hexdigest(),
+                                       "sha1": hashlib.sha1(content).hexdigest(),
+                                       "sha256": hashlib.sha256(content).hexdigest()}, file_path)
+            self.assertEqual(HashUtility.get_crc32_checksum(file_path), str(zlib.crc32(content)))
+            self.assertEqual(HashUtility.get_md5_checksum(file_path), hashlib.md5(content).hexdigest())
+            self.assertEqual(HashUtility.get_sha1_hash(file_path), hashlib.sha1(content).hexdigest())
+            self.assertEqual(HashUtility.get_sha256_hash(file_path), hashlib.sha256(content).hexdigest())
+
+    def test_same_as_hashlib(self):
+        self._check_digests()
+
+    def test_same_as_hashlib_across_chunks(self):
+        with mock.patch.object(hash_module, "HASH_CHUNK_SIZE", TEST_CHUNK_SIZE):
+            self._check_digests()
+
+    def test_files_digests(self):
+        digests = HashUtility.get_files_digests(list(self.contents), ("sha256",), workers=3)
+
+        self.assertEqual(digests, {file_path: {"sha256": hashlib.sha256(content).hexdigest()}
+                                   for file_path, content in self.contents.items()})
+
+    def test_crc32_object(self):
+        crc32 = CRC32(b"int main;")
+        copy = crc32.copy()
+        crc32.update(b"\n")
+
+        self.assertEqual(int(crc32.hexdigest(), 16), zlib.crc32(b"int main;\n"))
+        self.assertEqual(int.from_bytes(copy.digest(), "big"), zlib.crc32(b"int main;"))
+
+
+if __name__ == "__main__":
+    unittest.main()
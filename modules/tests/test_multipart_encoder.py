@@ -0,0 +1,93 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import email
+import shutil
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+import requests
+
+from common import MultipartEncoder as encoder_module
+from common.MultipartEncoder import MultipartStream
+
+FIELDS = {"token": "test-token", "checksum": "", "type": "SOURCE"}
+
+
+class MultipartStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, "preprocess.tar.gz")
+        self.content = os.urandom(300 * 1024) + b"\r\n--"
+        with open(self.file_path, "wb") as upload_file:
+            upload_file.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _encode_by_requests(self, fields: dict, boundary: str):
+        """
+        :return: tuple of (body, content type) of requests.post(data=fields, files={"upload_file": file})
+        """
+        with open(self.file_path, "rb") as upload_file, \
+                mock.patch.object(requests.packages.urllib3.filepost, "choose_boundary", return_value=boundary):
+            request = requests.Request("POST", "http://127.0.0.1/upload", data=fields,
+                                       files={"upload_file": upload_file}).prepare()
+        return request.body, request.headers["Content-Type"]
+
+    @staticmethod
+    def _parse(body: bytes, content_type: str):
+        """
+        :return: list of (field name, file name, content) of the parts
+        """
+        message = email.message_from_bytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+        return [(part.get_param("name", header="content-disposition"), part.get_filename(),
+                 part.get_payload(decode=True)) for part in message.get_payload()]
+
+    def test_same_as_requests(self):
+        for block_size in (encoder_module.MULTIPART_BLOCK_SIZE, 1000):
+            with mock.patch.object(encoder_module, "MULTIPART_BLOCK_SIZE", block_size):
+                stream = MultipartStream(FIELDS, "upload_file", self.file_path)
+                body = b"".join(stream)
+
+            expected_body, expected_content_type = self._encode_by_requests(FIELDS, stream.boundary)
+            self.assertEqual(body, expected_body)
+            self.assertEqual(stream.content_type, expected_content_type)
+            self.assertEqual(len(stream), len(body))
+
+    def test_checksum_after_file(self):
+        fields = {"token": "test-token", "type": "SOURCE"}
+        stream = MultipartStream(fields, "upload_file", self.file_path, checksum_field="file_checksum")
+        body = b"".join(stream)
+
+        # the length is not known before the file is read, the body is sent with chunked transfer encoding
+        self.assertEqual(len(stream), 0)
+        self.assertTrue(stream)
+        self.assertEqual(stream.checksum, zlib.crc32(self.content))
+        self.assertEqual(self._parse(body, stream.content_type),
+                         [("token", None, b"test-token"), ("type", None, b"SOURCE"),
+                          ("upload_file", "preprocess.tar.gz", self.content),
+                          ("file_checksum", None, str(zlib.crc32(self.content)).encode("latin-1"))])
+        # the same fields as the body encoded by requests with the checksum calculated before
+        expected_fields = dict(fields, file_checksum=str(zlib.crc32(self.content)))
+        expected_body, expected_content_type = self._encode_by_requests(expected_fields, stream.boundary)
+        self.assertEqual(sorted(self._parse(body, stream.content_type), key=lambda part: part[0]),
+                         sorted(self._parse(expected_body, expected_content_type), key=lambda part: part[0]))
+
+    def test_generated_again(self):
+        stream = MultipartStream(FIELDS, "upload_file", self.file_path, checksum_field="file_checksum")
+
+        self.assertEqual(b"".join(stream), b"".join(stream))
+
+
+if __name__ == "__main__":
+    unittest.main()
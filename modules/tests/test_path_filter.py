@@ -0,0 +1,82 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import fnmatch
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from common.CompressionUtility import CompressionUtility
+from common.PathFilter import PathFilter
+from common.XcalFileInfoCollector import generate_file_info
+
+PROJECT_FILES = ["main.c", "README.md", "src/util.c", "src/util.h", "src/gen/parser.cpp", "src/gen/parser.o",
+                 "test/test_util.c", "test/data/input.c", "third_party/lib/lib.c", "include/api.hpp"]
+
+# (include patterns, exclude patterns)
+PATTERNS = [
+    (None, None),
+    (["src/*"], None),
+    (None, ["test/*", "*.h"]),
+    (["src/*", "include/*"], ["src/gen/*"]),
+    (["re:(src|test)/.*\\.c"], ["re:.*/data/.*"]),
+]
+
+
+class PathFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.project_path = os.path.join(self.temp_dir, "project")
+        self.output_path = os.path.join(self.temp_dir, "output")
+        for relative_path in PROJECT_FILES:
+            file_path = os.path.join(self.project_path, *relative_path.split("/"))
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "w") as source_file:
+                source_file.write("int %s;\n" % os.path.basename(relative_path).split(".")[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_match_patterns_same_as_fnmatch(self):
+        for include_patterns, exclude_patterns in PATTERNS:
+            if any(pattern.startswith("re:") for pattern in (include_patterns or []) + (exclude_patterns or [])):
+                continue
+            path_filter = PathFilter(self.project_path, include_patterns=include_patterns,
+                                     exclude_patterns=exclude_patterns)
+            for relative_path in PROJECT_FILES:
+                expected = (not include_patterns or any(fnmatch.fnmatchcase(relative_path, pattern)
+                                                        for pattern in include_patterns)) and \
+                           not any(fnmatch.fnmatchcase(relative_path, pattern) for pattern in exclude_patterns or [])
+                self.assertEqual(path_filter.match_patterns(relative_path.replace("/", os.sep)), expected,
+                                 (relative_path, include_patterns, exclude_patterns))
+
+    def test_file_info_same_as_archive(self):
+        for index, (include_patterns, exclude_patterns) in enumerate(PATTERNS):
+            step_config = {"sourceStorageType": "agent", "sourceStorageName": "agent",
+                           "sourceIncludePatterns": include_patterns, "sourceExcludePatterns": exclude_patterns}
+            file_info = generate_file_info(self.project_path, dict(), step_config)
+            info_paths = sorted(file["relativePath"].replace(os.sep, "/") for file in file_info["files"]
+                                if file["type"] == "FILE")
+
+            path_filter = PathFilter(os.path.realpath(self.project_path), include_patterns=include_patterns,
+                                     exclude_patterns=exclude_patterns)
+            archive_path = CompressionUtility.get_archive("source_code_%d.zip" % index, self.project_path,
+                                                          destination_path=self.output_path, path_filter=path_filter)
+            with zipfile.ZipFile(archive_path) as archive:
+                archive_paths = sorted(archive.namelist())
+
+            self.assertEqual(info_paths, archive_paths, (include_patterns, exclude_patterns))
+            self.assertNotIn("README.md", archive_paths)
+            self.assertNotIn("src/gen/parser.o", archive_paths)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from common import RetryScheduler as retry_module
+from common.RetryScheduler import RetryScheduler, CircuitOpenError
+from common.XcalConnect import Connector
+from common.XcalGlobals import DEFAULT_CONFIG
+from common.XcalLogger import XcalLogger
+
+POLICY = {"retry": 10, "backoff": 0.01, "maxBackoff": 0.05, "deadline": 5}
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code: int, headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or dict()
+
+    def close(self):
+        pass
+
+
+class RetrySchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(retry_module, "CIRCUIT_RESET_TIMEOUT", 0.3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = RetryScheduler()
+
+    def test_retry_until_success(self):
+        responses = [FakeResponse(503), FakeResponse(502), FakeResponse(200)]
+
+        response = self.scheduler.call("api", lambda timeout: responses.pop(0), POLICY)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.scheduler.get_metrics()["api"]["retries"], 2)
+
+    def test_client_error_not_retried(self):
+        response = self.scheduler.call("api", lambda timeout: FakeResponse(401), POLICY)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.scheduler.get_metrics()["api"]["attempts"], 1)
+
+    def test_parallel_calls_wait_for_open_circuit(self):
+        # the endpoint fails for a while, enough to open the circuit, then recovers
+        recover_time = time.monotonic() + 0.2
+        send = lambda timeout: FakeResponse(503 if time.monotonic() < recover_time else 200)
+        results = []
+
+        def call():
+            try:
+                results.append(self.scheduler.call("api", send, POLICY).status_code)
+            except CircuitOpenError as err:
+                results.append(err)
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(results, [200] * 8)
+        self.assertGreaterEqual(self.scheduler.get_metrics()["api"]["circuitOpened"], 1)
+
+    def test_open_circuit_beyond_deadline(self):
+        breaker = self.scheduler.get_breaker("api")
+        for _ in range(retry_module.CIRCUIT_FAILURE_THRESHOLD):
+            breaker.record_failure()
+
+        with self.assertRaises(CircuitOpenError):
+            self.scheduler.call("api", lambda timeout: FakeResponse(200), dict(POLICY, deadline=0.1))
+        # the trial is let through once the reset timeout is over
+        self.assertEqual(self.scheduler.call("api", lambda timeout: FakeResponse(200), POLICY).status_code, 200)
+        self.assertFalse(breaker.is_open())
+
+    def test_throttled_is_not_failure(self):
+        responses = [FakeResponse(429, {"Retry-After": "0"}) for _ in range(8)] + [FakeResponse(200)]
+
+        response = self.scheduler.call("api", lambda timeout: responses.pop(0), POLICY)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.scheduler.get_breaker("api").is_open())
+        self.assertEqual(self.scheduler.get_metrics()["api"]["circuitOpened"], 0)
+
+    def test_no_timeout_without_policy_timeout(self):
+        timeouts = []
+
+        self.scheduler.call("api", lambda timeout: timeouts.append(timeout) or FakeResponse(200), POLICY)
+        self.scheduler.call("api", lambda timeout: timeouts.append(timeout) or FakeResponse(200), POLICY, (10, 60))
+
+        self.assertIsNone(timeouts[0])
+        # an explicit timeout is still bounded by the deadline
+        self.assertLessEqual(max(timeouts[1]), 5)
+
+
+class ApiNameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = Connector(XcalLogger("ApiNameTest", "setUp"), DEFAULT_CONFIG["API_SERVER"])
+        self.host_url = DEFAULT_CONFIG["API_SERVER"]["URL"]
+
+    def test_api_name(self):
+        self.assertEqual(self.connector.get_api_name(self.host_url + "/api/file_service/v2/file/upload_session/123/chunk/4?token=x"),
+                         "fileChunkUploadApi")
+        self.assertEqual(self.connector.get_api_name(self.host_url + "/api/file_service/v2/file/upload_session?token=x"),
+                         "fileChunkUploadInitApi")
+        self.assertEqual(self.connector.get_api_name(self.host_url + "/api/scan_task_service/v3/other/path"),
+                         "scanServiceApi")
+        self.assertEqual(self.connector.get_api_name("http://other.host/unknown/path?x=1"), "/unknown/path")
+
+
+if __name__ == "__main__":
+    unittest.main()
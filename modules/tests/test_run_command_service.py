@@ -0,0 +1,64 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from common import RunCommandService as command_module
+from common.RunCommandService import ExecuteCommandService
+
+
+class ExecuteCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.temp_dir, "build.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_execute_command(self):
+        self.assertEqual(ExecuteCommandService.execute_command("exit 3", self.log_path), 3)
+        with open(self.log_path) as log_file:
+            self.assertIn("command return code: 3", log_file.read())
+
+    def test_run_command_output(self):
+        result = ExecuteCommandService.run_command("echo built; echo failed >&2; exit 2", self.log_path,
+                                                   sample_interval = 0, echo = False)
+
+        self.assertEqual(result.returncode, 2)
+        self.assertFalse(result.timed_out)
+        self.assertEqual(sorted(result.tail), ["built\n", "failed\n"])
+
+    @unittest.skipUnless(os.name == "posix", "the process group is only killed on posix")
+    def test_run_command_timeout(self):
+        start = time.time()
+        result = ExecuteCommandService.run_command("sleep 30", self.log_path, timeout = 1, sample_interval = 0,
+                                                   echo = False)
+
+        self.assertTrue(result.timed_out)
+        self.assertLess(time.time() - start, 15)
+
+    @unittest.skipUnless(os.name == "posix", "the pipes are polled by select on posix")
+    def test_run_command_background_process(self):
+        start = time.time()
+        with mock.patch.object(command_module, "COMMAND_OUTPUT_DRAIN_TIMEOUT", 1):
+            result = ExecuteCommandService.run_command("sleep 20 & echo built", self.log_path, sample_interval = 0,
+                                                       echo = False)
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(list(result.tail), ["built\n"])
+        self.assertLess(time.time() - start, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import http.server
+import json
+import shutil
+import socketserver
+import tempfile
+import threading
+import unittest
+import zipfile
+from urllib.parse import urlsplit, parse_qs
+
+from common.CompressionUtility import CompressionUtility
+from common.SourceBlobIndex import SourceBlobIndex
+from common.SourceFileCache import SourceFileCache
+
+TOKEN = "test-token"
+
+
+class FileCacheHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Stand-in of checkFileCacheApi and saveFileCacheApi of the scan task service
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        self.server.requests.append((url.path, query["checksum"]))
+        if url.path.endswith("/check_file_cache"):
+            content = {"fileId": self.server.cache[query["checksum"]]} if query["checksum"] in self.server.cache else {}
+        elif url.path.endswith("/save_file_cache"):
+            self.server.cache[query["checksum"]] = query["fileId"]
+            content = {}
+        else:
+            content = {}
+        body = json.dumps(content).encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FileCacheServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FileCacheHandler)
+        self.cache = dict()
+        self.requests = []
+
+
+class DedupArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FileCacheServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.project_conf = {"apiServerUrl": "http://127.0.0.1:%d" % self.server.server_port,
+                             "taskConfig": {"token": TOKEN}}
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.project_path = os.path.join(self.temp_dir, "project")
+        self.output_path = os.path.join(self.temp_dir, "scan", "output")
+        os.makedirs(os.path.join(self.project_path, "src"))
+        os.makedirs(self.output_path)
+        for name, content in (("main.c", b"int main() { return 0; }\n"), ("util.c", b"int util;\n"),
+                              ("copy.c", b"int util;\n")):
+            with open(os.path.join(self.project_path, "src", name), "wb") as source_file:
+                source_file.write(content)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def _archive(self, project_conf: dict):
+        """
+        Package the project as the packager does
+        :return: manifest
+        """
+        file_cache = SourceFileCache.from_config(project_conf)
+        blob_index = SourceBlobIndex(SourceBlobIndex.get_index_path(self.output_path), file_cache=file_cache)
+        manifest_path = CompressionUtility.get_dedup_archive("source_manifest.json", self.project_path,
+                                                             destination_path=self.output_path, blob_index=blob_index)
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def _upload(self, manifest: dict):
+        """
+        Record the pack as the uploader does after the pack is uploaded
+        """
+        self.assertTrue(SourceFileCache.from_config(self.project_conf).save_pack(manifest["pack"]))
+        blob_index = SourceBlobIndex(SourceBlobIndex.get_index_path(self.output_path))
+        blob_index.add_blobs(SourceBlobIndex.get_manifest_blobs(manifest), manifest["pack"])
+        blob_index.save()
+
+    def test_reuse_confirmed_blobs(self):
+        first = self._archive(self.project_conf)
+        with zipfile.ZipFile(os.path.join(self.output_path, first["pack"])) as pack:
+            self.assertEqual(len(pack.namelist()), 2)
+        # no blob is asked before any pack is uploaded
+        self.assertEqual(self.server.requests, [])
+        self._upload(first)
+        self.assertEqual(self.server.cache, {SourceFileCache.get_pack_key(first["pack"]): first["pack"]})
+
+        self.server.requests.clear()
+        second = self._archive(self.project_conf)
+
+        self.assertIsNone(second["pack"])
+        self.assertEqual({file_info["pack"] for file_info in second["files"]}, {first["pack"]})
+        # the pack is asked once for all its blobs
+        self.assertEqual(self.server.requests, [("/api/scan_task_service/v2/agent/check_file_cache",
+                                                 SourceFileCache.get_pack_key(first["pack"]))])
+
+    def test_pack_not_confirmed(self):
+        first = self._archive(self.project_conf)
+        self._upload(first)
+        # the server lost the pack
+        self.server.cache.clear()
+
+        second = self._archive(self.project_conf)
+
+        self.assertIsNotNone(second["pack"])
+        with zipfile.ZipFile(os.path.join(self.output_path, second["pack"])) as pack:
+            self.assertEqual(len(pack.namelist()), 2)
+        self.assertEqual({file_info["pack"] for file_info in second["files"]}, {second["pack"]})
+
+    def test_pack_all_without_file_cache(self):
+        self._upload(self._archive(self.project_conf))
+
+        manifest = self._archive(dict())
+
+        self.assertIsNotNone(manifest["pack"])
+        self.assertEqual({file_info["pack"] for file_info in manifest["files"]}, {manifest["pack"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import threading
+import unittest
+
+from common.StatusReporter import StatusReporter, STATUS_SEND_ATTEMPTS
+
+
+class FakeSend(object):
+    """
+    Stand-in of the progress report api, records the payloads and fails the first calls if asked
+    """
+
+    def __init__(self, failures: int = 0):
+        self.payloads = []
+        self.failures = failures
+        self.lock = threading.Lock()
+
+    def __call__(self, payload: dict):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise IOError("connection reset")
+            self.payloads.append(payload)
+            return {"status": payload.get("status")}
+
+
+def progress(percentage: int, status: str = "PROCESSING", **fields):
+    payload = {"taskConfig": {"scanTaskId": "1"}, "target": "progress", "stage": "AGENT_START", "status": status,
+               "progress": percentage, "message": "agent report status"}
+    payload.update(fields)
+    return payload
+
+
+class StatusReporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.send = FakeSend()
+        # a long interval, so that only a terminal status or a flush sends the queued updates
+        self.reporter = StatusReporter(self.send, flush_interval=60)
+
+    def tearDown(self):
+        self.reporter.close(5)
+
+    def test_coalesce_progress(self):
+        for percentage in range(10):
+            self.assertIsNone(self.reporter.submit("1", progress(percentage)))
+        self.reporter.flush(5)
+
+        self.assertEqual([payload["progress"] for payload in self.send.payloads], [9])
+
+    def test_changed_fields(self):
+        self.reporter.submit("1", progress(10, sourceCodeFileId="a", uploadResults=[1]))
+        self.reporter.flush(5)
+        self.reporter.submit("1", progress(20, sourceCodeFileId="a", uploadResults=[1, 2]))
+        self.reporter.flush(5)
+
+        first, second = self.send.payloads
+        self.assertIn("sourceCodeFileId", first)
+        self.assertNotIn("sourceCodeFileId", second)
+        self.assertEqual(second["uploadResults"], [1, 2])
+        self.assertEqual(second["progress"], 20)
+
+    def test_terminal_flush(self):
+        self.reporter.submit("1", progress(10, sourceCodeFileId="a"))
+        self.reporter.submit("1", progress(50, stage="AGENT_END"))
+
+        result = self.reporter.submit("1", progress(100, "COMPLETED", sourceCodeFileId="a"), wait=True, timeout=5,
+                                      full=True)
+
+        self.assertEqual(result, {"status": "COMPLETED"})
+        self.assertEqual([payload["progress"] for payload in self.send.payloads], [10, 50, 100])
+        # the terminal status is sent as a whole
+        self.assertEqual(self.send.payloads[-1]["sourceCodeFileId"], "a")
+
+    def test_failed_progress_sent_again(self):
+        self.send.failures = STATUS_SEND_ATTEMPTS - 1
+        reporter = StatusReporter(self.send, flush_interval=0.05)
+        try:
+            reporter.submit("1", progress(10, sourceCodeFileId="a"))
+            reporter.flush(5)
+        finally:
+            reporter.close(5)
+
+        self.assertEqual(len(self.send.payloads), 1)
+        self.assertEqual(self.send.payloads[0]["sourceCodeFileId"], "a")
+
+    def test_close_timeout(self):
+        blocked = threading.Event()
+        reporter = StatusReporter(lambda payload: blocked.wait(10), flush_interval=60)
+        reporter.submit("1", progress(10))
+
+        reporter.close(0.2)
+
+        self.assertTrue(reporter.thread.is_alive())
+        blocked.set()
+        reporter.thread.join(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
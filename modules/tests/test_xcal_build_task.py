@@ -0,0 +1,105 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import io
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from buildtask.xcal_build_task import XcalBuildTask
+from common import XcalGlobals
+from xcal_common.py.error import ENoIFileGenerated
+
+
+class ValidatePreprocessPackageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.package_path = os.path.join(self.temp_dir, "preprocess.tar.gz")
+        self.log_path = os.path.join(self.temp_dir, "xcalbuild.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write_package(self, names: list):
+        with tarfile.open(self.package_path, "w:gz") as tf:
+            for name in names:
+                data = ("content of %s\n" % name).encode("UTF-8")
+                tar_info = tarfile.TarInfo(name)
+                tar_info.size = len(data)
+                tf.addfile(tar_info, io.BytesIO(data))
+
+    def test_valid_package(self):
+        self._write_package(["xcalibyte.properties", "main.c.i", "util.cpp.ii"])
+
+        self.assertIsNone(XcalBuildTask._validate_preprocess_package(self.package_path, self.log_path))
+
+    def test_no_i_file(self):
+        self._write_package(["xcalibyte.properties", "main.c", "build.log"])
+
+        with self.assertRaises(ENoIFileGenerated):
+            XcalBuildTask._validate_preprocess_package(self.package_path, self.log_path)
+
+    def test_no_properties(self):
+        self._write_package(["main.c.i"])
+
+        with self.assertRaises(AssertionError):
+            XcalBuildTask._validate_preprocess_package(self.package_path, self.log_path)
+
+
+class PackagePreprocessResultTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.package_path = os.path.join(self.temp_dir, "preprocess.tar.gz")
+        with tarfile.open(self.package_path, "w:gz") as tf:
+            tf.add(__file__, "xcalibyte.properties")
+        with open(self.package_path, "rb") as package_file:
+            self.inner_package = package_file.read()
+        self.package_files = [self.package_path]
+        for name in ("source_files.json", XcalGlobals.SCAN_MISRA_RESULT_FILE_NAME):
+            file_path = os.path.join(self.temp_dir, name)
+            with open(file_path, "w") as package_file:
+                package_file.write("content of %s\n" % name)
+            self.package_files.append(file_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_layout(self):
+        XcalBuildTask._package_preprocess_result(self.package_path, self.package_files)
+
+        with tarfile.open(self.package_path, "r:gz") as tf:
+            members = tf.getmembers()
+            self.assertEqual([(member.name, member.type) for member in members],
+                             [("", tarfile.DIRTYPE), (XcalGlobals.SCAN_MISRA_RESULT_FILE_NAME, tarfile.REGTYPE),
+                              ("preprocess.tar.gz", tarfile.REGTYPE), ("source_files.json", tarfile.REGTYPE)])
+            self.assertEqual(tf.extractfile("preprocess.tar.gz").read(), self.inner_package)
+        self.assertFalse(os.path.exists(self.package_path + ".tmp"))
+
+    def test_same_layout_as_directory(self):
+        # the package used to be written by adding a directory of the files as ''
+        directory_path = os.path.join(self.temp_dir, "tmp_preprocess_tgz")
+        os.makedirs(directory_path)
+        for package_file in self.package_files:
+            shutil.copy(package_file, directory_path)
+        directory_package_path = os.path.join(self.temp_dir, "directory.tar.gz")
+        with tarfile.open(directory_package_path, "w:gz") as tf:
+            tf.add(directory_path, '')
+
+        XcalBuildTask._package_preprocess_result(self.package_path, self.package_files)
+
+        with tarfile.open(directory_package_path) as expected, tarfile.open(self.package_path) as actual:
+            self.assertEqual([(member.name, member.type, member.size) for member in actual.getmembers()],
+                             [(member.name, member.type, member.size) for member in expected.getmembers()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import http.server
+import json
+import socketserver
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from common.XcalConnect import Connector, HTTP_POOL_MAXSIZE
+from common.XcalLogger import XcalLogger
+
+
+class ConnectionRecordHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Stand-in of the api server, keeps the connection alive and records the client address of each request
+    """
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self):
+        with self.server.lock:
+            self.server.client_addresses.append(self.client_address)
+        body = json.dumps({"path": self.path}).encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._reply()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ConnectionRecordServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ConnectionRecordHandler)
+        self.client_addresses = []
+        self.lock = threading.Lock()
+
+
+class SessionReuseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ConnectionRecordServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.host_url = "http://127.0.0.1:%d" % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get_connector(self, host_url: str = None):
+        api_server = {"URL": host_url or self.host_url, "scanServiceVersionApi": "/api/scan_service/v2/version"}
+        return Connector(XcalLogger("SessionReuseTest", "_get_connector"), api_server)
+
+    def test_session_shared_by_host(self):
+        first = self._get_connector()
+        second = self._get_connector()
+        other_host = self._get_connector("http://127.0.0.2:%d" % self.server.server_port)
+
+        self.assertIs(first.get_session(), second.get_session())
+        self.assertIsNot(first.get_session(), other_host.get_session())
+
+    def test_connection_reused(self):
+        url = self.host_url + "/api/scan_service/v2/version"
+        for connector in (self._get_connector(), self._get_connector()):
+            for method in ("GET", "POST", "GET"):
+                response = connector.send_http_request(url, {"index": 1}, {}, method=method)
+                self.assertEqual(response.json(), {"path": "/api/scan_service/v2/version"})
+
+        self.assertEqual(len(self.server.client_addresses), 6)
+        # the requests are sent one by one, so they are all on the same kept alive connection
+        self.assertEqual(len(set(self.server.client_addresses)), 1)
+
+    def test_concurrent_connections_pooled(self):
+        connector = self._get_connector()
+        url = self.host_url + "/api/scan_service/v2/version"
+
+        with ThreadPoolExecutor(max_workers=HTTP_POOL_MAXSIZE) as executor:
+            for _ in range(3):
+                responses = list(executor.map(lambda index: connector.send_http_request(url, {}, {}, method="GET"),
+                                              range(HTTP_POOL_MAXSIZE * 2)))
+                self.assertTrue(all(response.status_code == 200 for response in responses))
+
+        # the connections are returned to the pool and reused by the later requests
+        self.assertEqual(len(self.server.client_addresses), HTTP_POOL_MAXSIZE * 6)
+        self.assertLessEqual(len(set(self.server.client_addresses)), HTTP_POOL_MAXSIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
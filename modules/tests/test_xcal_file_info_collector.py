@@ -0,0 +1,194 @@
+#
+#  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
+#
+
+import sys, os
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import json
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+from common import HashUtility as hash_module
+from common import XcalFileInfoCollector as collector_module
+from common.HashUtility import HashUtility
+from common.XcalFileInfoCollector import _file_lines, _scan_file, generate_file, generate_file_info
+
+# (file name, content) covering the line ending cases
+SCAN_FILES = [
+    ("empty.c", b""),
+    ("one_line.c", b"int x;\n"),
+    ("no_new_line.c", b"int x;\nint y;"),
+    ("blank_lines.c", b"\n\n\n"),
+    ("crlf.c", b"int x;\r\nint y;\r\n"),
+    ("binary.o", bytes(range(256)) * 40),
+]
+
+
+class ScanFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, name: str, content: bytes):
+        file_path = os.path.join(self.temp_dir, name)
+        with open(file_path, "wb") as source_file:
+            source_file.write(content)
+        return file_path
+
+    def _check(self, name: str, content: bytes):
+        file_path = self._write(name, content)
+        # a last line without new line is counted too
+        expected_lines = content.count(b"\n") + (1 if content and not content.endswith(b"\n") else 0)
+
+        self.assertEqual(_scan_file(file_path), (zlib.crc32(content), len(content), expected_lines), name)
+        self.assertEqual(_file_lines(file_path), expected_lines, name)
+        self.assertEqual(str(_scan_file(file_path)[0]), HashUtility.get_crc32_checksum(file_path), name)
+
+    def test_scan_file(self):
+        for name, content in SCAN_FILES:
+            self._check(name, content)
+
+    def test_scan_file_across_chunks(self):
+        # the chunks end in the middle of a line and right after a new line
+        with mock.patch.object(hash_module, "HASH_CHUNK_SIZE", 7):
+            for name, content in SCAN_FILES + [("long.c", b"int x;\n" * 100 + b"int y;")]:
+                self._check(name, content)
+
+
+def write_project(project_path: str, files: dict):
+    """
+    :param project_path: project path
+    :param files: dict of relative path (separated by '/') to the content
+    """
+    for relative_path, content in files.items():
+        file_path = os.path.join(project_path, *relative_path.split("/"))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as source_file:
+            source_file.write(content)
+
+
+@unittest.skipUnless(shutil.which("git"), "git is not installed")
+class GitIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.project_path = os.path.join(self.temp_dir, "project")
+        write_project(self.project_path, {"main.c": b"int main() { return util(); }\n",
+                                          "src/util.c": b"int util() { return 0; }\n",
+                                          "src/copy.c": b"int util() { return 0; }\n",
+                                          "src/empty.h": b"",
+                                          "src/b/deep.c": b"int deep;",
+                                          "src-extra/x.c": b"int x;\n",
+                                          "include/util.h": b"int util();\n"})
+        for args in (["init", "-q"], ["add", "-A"],
+                     ["-c", "user.name=test", "-c", "user.email=test@test", "commit", "-q", "-m", "init"]):
+            subprocess.run(["git"] + args, cwd=self.project_path, check=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _generate(self, git_index: bool):
+        step_config = {"sourceStorageType": "github", "sourceStorageName": "github", "fileInfoGitIndex": git_index,
+                       "fileInfoWorkers": 2}
+        return generate_file_info(self.project_path, dict(), step_config)["files"]
+
+    @staticmethod
+    def _get_contents(files: list):
+        return sorted((file["type"], file["relativePath"], file["depth"], file["parentPath"], file["checksum"],
+                       file["fileSize"], file["noOfLines"]) for file in files)
+
+    def test_same_as_traverse(self):
+        self.assertEqual(self._get_contents(self._generate(True)), self._get_contents(self._generate(False)))
+
+    def test_depth_first_order(self):
+        paths = [file["relativePath"] for file in self._generate(True)]
+
+        self.assertEqual(paths, [os.sep, "main.c",
+                                 "include", os.path.join("include", "util.h"),
+                                 "src", os.path.join("src", "copy.c"), os.path.join("src", "empty.h"),
+                                 os.path.join("src", "util.c"),
+                                 os.path.join("src", "b"), os.path.join("src", "b", "deep.c"),
+                                 "src-extra", os.path.join("src-extra", "x.c")])
+
+    def test_blob_read_once(self):
+        with mock.patch.object(collector_module, "_scan_file", side_effect=_scan_file) as scan_file:
+            files = self._generate(True)
+
+        scanned = sorted(os.path.relpath(call[0][0], self.project_path) for call in scan_file.call_args_list)
+        # copy.c and util.c are the same blob, and the empty header is not read
+        self.assertEqual(scanned, sorted(["main.c", os.path.join("include", "util.h"), os.path.join("src", "copy.c"),
+                                          os.path.join("src", "b", "deep.c"), os.path.join("src-extra", "x.c")]))
+        checksums = {file["relativePath"]: file["checksum"] for file in files}
+        self.assertEqual(checksums[os.path.join("src", "copy.c")], checksums[os.path.join("src", "util.c")])
+
+    def test_modified_file_read(self):
+        write_project(self.project_path, {"src/copy.c": b"int copy;\n"})
+
+        files = {file["relativePath"]: file for file in self._generate(True)}
+
+        self.assertEqual(files[os.path.join("src", "copy.c")]["checksum"], str(zlib.crc32(b"int copy;\n")))
+        self.assertEqual(files[os.path.join("src", "util.c")]["checksum"], str(zlib.crc32(b"int util() { return 0; }\n")))
+
+
+class GenerateFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.project_path = os.path.join(self.temp_dir, "project")
+        self.output_path = os.path.join(self.temp_dir, "output")
+        files = {"main.c": b"int main() { return 0; }\n", "empty.h": b"", "data.c": os.urandom(100 * 1024)}
+        for i in range(40):
+            files["src/mod_%d/file_%d.c" % (i % 7, i)] = b"int value_%d;\n" % i * (i + 1)
+        write_project(self.project_path, files)
+        os.makedirs(os.path.join(self.project_path, "src", "empty_dir"))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _generate(self, filename: str, **options):
+        step_config = {"sourceStorageType": "agent", "sourceStorageName": "agent"}
+        step_config.update(options)
+        file_path = generate_file(self.project_path, dict(), step_config, self.output_path, filename)
+        with open(file_path, "rb") as file_info:
+            return file_info.read()
+
+    def test_parallel_same_as_serial(self):
+        serial = self._generate("serial.json", fileInfoWorkers=1)
+        parallel = self._generate("parallel.json", fileInfoWorkers=4)
+
+        self.assertEqual(serial, parallel)
+        self.assertEqual(json.loads(serial.decode())["numberOfFiles"], "43")
+
+    def test_same_as_json_dump(self):
+        file_info = generate_file_info(self.project_path, dict(), {"sourceStorageType": "agent",
+                                                                   "sourceStorageName": "agent"})
+
+        self.assertEqual(self._generate("indent.json").decode(), json.dumps(file_info, indent=1))
+        self.assertEqual(self._generate("compact.json", fileInfoCompact=True).decode(),
+                         json.dumps(file_info, separators=(",", ":")))
+
+    def test_all_files_listed(self):
+        expected = set()
+        for root, dir_names, file_names in os.walk(self.project_path):
+            for name in dir_names + file_names:
+                expected.add(os.path.relpath(os.path.join(root, name), self.project_path))
+
+        file_info = json.loads(self._generate("fileinfo.json").decode())
+
+        paths = [file["relativePath"] for file in file_info["files"]]
+        self.assertEqual(len(paths), len(set(paths)))
+        self.assertEqual(set(paths) - {os.sep}, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
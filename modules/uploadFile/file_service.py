@@ -1,30 +1,70 @@
 #
 #  Copyright (C) 2021 Xcalibyte (Shenzhen) Limited.
 #
+import json
 import logging
 import os
 
 from common.CommonGlobals import SOURCE_CODE_ARCHIVE_FILE_NAME, FILE_INFO_FILE_NAME, PREPROCESS_FILE_NAME, \
-    VCS_DIFF_RESULT_FILE_NAME
+    VCS_DIFF_RESULT_FILE_NAME, SOURCE_MANIFEST_FILE_NAME
+from common.SourceBlobIndex import SourceBlobIndex
+from common.SourceFileCache import SourceFileCache
 from file_util import FileUtil, get_client, PREPROCESS_DATA_BUCKET_NAME
 
 logger = logging.getLogger(__name__)
 
+# the blob packs of a project are kept in this folder, they are referred by the manifests of the scans
+BLOB_PACK_FOLDER_NAME = "blobs"
+
 
 class FileService(object):
-    def __init__(self, file_dir):
+    def __init__(self, file_dir, project_conf: dict = None):
         self.files = [FILE_INFO_FILE_NAME, PREPROCESS_FILE_NAME, VCS_DIFF_RESULT_FILE_NAME]
         self.file_dir = file_dir
+        self.project_conf = project_conf or dict()
+        self.manifest = None
 
     def prepare_files_to_upload(self):
-        self.files.append(SOURCE_CODE_ARCHIVE_FILE_NAME)
+        manifest_path = os.path.join(self.file_dir, SOURCE_MANIFEST_FILE_NAME)
+        if not os.path.exists(manifest_path):
+            self.files.append(SOURCE_CODE_ARCHIVE_FILE_NAME)
+            return
+
+        # content addressed source code, only the new blob pack is uploaded with the manifest
+        with open(manifest_path) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.files.append(SOURCE_MANIFEST_FILE_NAME)
 
     def upload_files(self, url, project_id):
         client = get_client(url)
         file_util = FileUtil(client)
         file_util.create_bucket(PREPROCESS_DATA_BUCKET_NAME)
 
+        # the pack goes first, the manifest is never uploaded referring to a pack which is not uploaded
+        if self.manifest is not None and self.manifest.get("pack") is not None:
+            self.upload_blob_pack(file_util, project_id)
+
         for file_name in self.files:
             file_path = os.path.join(self.file_dir, file_name)
             if os.path.exists(file_path) and os.path.isfile(file_path):
                 file_util.upload_file(PREPROCESS_DATA_BUCKET_NAME, os.path.join(project_id, file_name), file_path)
+
+    def upload_blob_pack(self, file_util, project_id):
+        pack = self.manifest.get("pack")
+        file_util.upload_file(PREPROCESS_DATA_BUCKET_NAME, os.path.join(project_id, BLOB_PACK_FOLDER_NAME, pack),
+                              os.path.join(self.file_dir, pack))
+
+        # the blobs can be reused by the next scans only after the pack is uploaded and saved in the file cache
+        blobs = SourceBlobIndex.get_manifest_blobs(self.manifest)
+        file_cache = SourceFileCache.from_config(self.project_conf)
+        if file_cache is None:
+            logger.warning("api server is not configured, %d source blobs in %s are not reused" % (len(blobs), pack))
+            return
+        if not file_cache.save_pack(pack):
+            logger.warning("%d source blobs in %s are not saved in the file cache, they are not reused" % (len(blobs), pack))
+            return
+
+        blob_index = SourceBlobIndex(SourceBlobIndex.get_index_path(self.file_dir))
+        blob_index.add_blobs(blobs, pack)
+        blob_index.save()
+        logger.info("%d source blobs uploaded in %s and saved in the file cache" % (len(blobs), pack))
@@ -123,7 +123,7 @@ if __name__ == "__main__":
                                       + " --url " + str(args.url)
         POST_STATUS.init(PREPROC.UP_FILE.name, PREPROC.UP_FILE.value, init_time=init_time)
 
-        file_service = FileService(input_conf.get("fileDir"))
+        file_service = FileService(input_conf.get("fileDir"), input_conf)
         if input_conf.get("gitUrl") is None and input_conf.get("uploadSource") is True:
             file_service.prepare_files_to_upload()
         file_service.upload_files(input_conf.get("url"), input_conf.get("projectId"))